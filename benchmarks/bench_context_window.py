@@ -0,0 +1,100 @@
+"""
+Throughput of context window loops: list pop(0) shifting (as in the old
+token.shift_context_center_tokens) vs token.ContextWindow.
+  shift: window maintenance only (skip_tokens / transform_tokens style)
+  pairs: word2vec style loop visiting every (center, context) pair
+
+python -m plp.benchmarks.bench_context_window [num_tokens]
+"""
+import sys
+import time
+import random
+import itertools
+import plp.token as ptoken
+
+
+def _list_shift(left, center, right, token_iter, max_num_left):
+    left.append(center)
+    if len(left) > max_num_left:
+        left.pop(0)
+    if len(right) == 0:
+        return next(token_iter, None)
+    center = right.pop(0)
+    try:
+        right.append(next(token_iter))
+    except StopIteration:
+        pass
+    return center
+
+
+def list_shift(tokens, window_size):
+    token_iter = iter(tokens)
+    center = next(token_iter)
+    left, right = [], list(itertools.islice(token_iter, window_size))
+    num_centers = 0
+    while center is not None:
+        num_centers += 1
+        center = _list_shift(left, center, right, token_iter, window_size)
+    return num_centers
+
+
+def ring_shift(tokens, window_size):
+    window = ptoken.ContextWindow(iter(tokens), window_size, window_size)
+    window.fill_right()
+    num_centers = 0
+    while window.has_center:
+        num_centers += 1
+        window.shift()
+    return num_centers
+
+
+def list_pairs(tokens, window_size):
+    token_iter = iter(tokens)
+    center = next(token_iter)
+    left, right = [], list(itertools.islice(token_iter, window_size))
+    num_pairs = 0
+    while center is not None:
+        for _ in left + right:
+            num_pairs += 1
+        center = _list_shift(left, center, right, token_iter, window_size)
+    return num_pairs
+
+
+def ring_pairs(tokens, window_size):
+    window = ptoken.ContextWindow(iter(tokens), window_size, window_size)
+    window.fill_right()
+    left_buf, right_buf = window.left_buf, window.right_buf
+    num_pairs = 0
+    for _ in window.iter_centers():
+        for _ in left_buf:
+            num_pairs += 1
+        for _ in right_buf:
+            num_pairs += 1
+    return num_pairs
+
+
+def _bench(name, fs, tokens, window_size):
+    results = []
+    for f in fs:
+        best_time = None
+        for _ in range(3):
+            start = time.time()
+            res = f(tokens, window_size)
+            elapsed = time.time() - start
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+        results.append((f.__name__, len(tokens) / best_time, res))
+    assert results[0][2] == results[1][2]
+    print("%s window_size=%d: " % (name, window_size) + ", ".join(
+        "%s %.0f tokens/s" % (f_name, tokens_per_sec) for f_name, tokens_per_sec, _ in results))
+
+
+def main(num_tokens):
+    tokens = [str(random.randint(0, 10000)) for _ in range(num_tokens)]
+    for window_size in (2, 10, 100, 1000):
+        _bench("shift", (list_shift, ring_shift), tokens, window_size)
+    for window_size in (2, 10, 50):
+        _bench("pairs", (list_pairs, ring_pairs), tokens, window_size)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,95 @@
+"""
+Throughput of the tfrecords savers: tf.train protos and
+tf.python_io.TFRecordWriter (as in the old serializers.tfrecords) vs the
+TF-free wire encoding and ptfrecord_writer.TFRecordWriter.
+  lists: packed LM blocks of ids (int64 feature lists)
+  words: word blocks (bytes feature lists)
+The TF path is skipped if tensorflow isn't installed.
+
+python -m plp.benchmarks.bench_tfrecords_save [num_tokens] [GZIP | ZLIB]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import numpy as np
+import plp.serializers.tfrecords as ptfrecords
+from plp.transformers.interface import ListStat
+
+
+def save_tf(save_path, lists_iter, lists_stats, compression_type):
+    import tensorflow as tf
+    python_io = getattr(tf, "python_io", None) or tf.compat.v1.python_io
+
+    def int64_feature(value):
+        return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+    def bytes_feature(value):
+        return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value.encode()]))
+
+    feature_fs = [int64_feature if list_stat.token_type == "id_type" else bytes_feature
+                  for list_stat in lists_stats]
+    options = python_io.TFRecordOptions(
+        getattr(python_io.TFRecordCompressionType, compression_type or "NONE"))
+    with python_io.TFRecordWriter(save_path, options) as writer:
+        for lists in lists_iter:
+            feature_list_dict = {
+                list_stat.name: tf.train.FeatureList(feature=[feature_f(v) for v in t_list])
+                for list_stat, feature_f, t_list in zip(lists_stats, feature_fs, lists)
+            }
+            seq_ex = tf.train.SequenceExample(
+                context=tf.train.Features(feature={}),
+                feature_lists=tf.train.FeatureLists(feature_list=feature_list_dict))
+            writer.write(seq_ex.SerializeToString())
+
+
+def save_wire(save_path, lists_iter, lists_stats, compression_type):
+    ptfrecords._transformed_save(lists_iter, lists_stats, save_path, None, compression_type)
+
+
+def _bench(name, fs, create_args_f, out_path):
+    results = []
+    for f in fs:
+        best_time = None
+        for _ in range(3):
+            args = create_args_f()
+            start = time.time()
+            f(*args)
+            elapsed = time.time() - start
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+        results.append((f.__name__, os.path.getsize(out_path) / best_time / 1e6))
+    print("%s: " % name + ", ".join("%s %.1f MB/s" % result for result in results))
+
+
+def main(num_tokens, compression_type):
+    try:
+        import tensorflow
+        fs = (save_tf, save_wire)
+    except ImportError:
+        print("tensorflow isn't installed, only the TF-free path is timed")
+        fs = (save_wire,)
+    out_dir = tempfile.mkdtemp()
+    out_path = os.path.join(out_dir, "out.tfrecords")
+
+    block_len = 128
+    blocks = np.random.randint(0, 50000, (num_tokens // block_len, block_len))
+    lists_stats = (ListStat("input", "id_type", block_len, is_seq=True),
+                   ListStat("target", "id_type", block_len, is_seq=True))
+    create_lists_args_f = lambda: (out_path, ((block, block) for block in blocks),
+                                   lists_stats, compression_type)
+    _bench("lists", fs, create_lists_args_f, out_path)
+
+    words = [random.choice(("the", "cat", "sat", "on", "a", "mat.")) for _ in range(num_tokens)]
+    word_blocks = [words[i:i + block_len] for i in range(0, len(words) - block_len + 1, block_len)]
+    words_stats = (ListStat("input", "word_type", block_len, is_seq=True),)
+    create_words_args_f = lambda: (out_path, ((block,) for block in word_blocks),
+                                   words_stats, compression_type)
+    _bench("words", fs, create_words_args_f, out_path)
+    os.remove(out_path)
+    os.rmdir(out_dir)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+         sys.argv[2] if len(sys.argv) > 2 else "")
@@ -0,0 +1,89 @@
+"""
+Throughput of the txt savers: per token / per list f.write calls (as in the
+old serializers.txt) vs the block buffered, join based writers.
+  doc: doc_save of word tokens
+  lists: _transformed_save of id lists, as numpy arrays (packed LM blocks)
+
+python -m plp.benchmarks.bench_txt_save [num_tokens | txt_path]
+A txt path (e.g. a multi-GB corpus) is saved as its own tokens.
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import numpy as np
+import plp.doc as pdoc
+import plp.serializers.txt as ptxt
+from plp.transformers.interface import ListStat
+
+
+def write_doc(doc_path, doc_iter):
+    with open(doc_path, "w") as f:
+        for token in doc_iter:
+            f.write(token)
+            if token != "\n":
+                f.write(" ")
+
+
+def write_lists(save_paths, lists_iter, lists_stats):
+    fs = [open(save_path, "w") for save_path in save_paths]
+    for lists in lists_iter:
+        for f, t_list in zip(fs, lists):
+            f.write(" ".join([str(token) for token in t_list]))
+            f.write("\n")
+    for f in fs:
+        f.close()
+
+
+def save_doc(doc_path, doc_iter):
+    ptxt.doc_save(doc_path, doc_iter)
+
+
+def save_lists(save_paths, lists_iter, lists_stats):
+    ptxt._transformed_save(lists_iter, lists_stats, save_paths, None)
+
+
+def _bench(name, fs, create_args_f, out_paths):
+    results = []
+    for f in fs:
+        best_time = None
+        for _ in range(3):
+            args = create_args_f()
+            start = time.time()
+            f(*args)
+            elapsed = time.time() - start
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+        num_bytes = sum(os.path.getsize(path) for path in out_paths)
+        results.append((f.__name__, num_bytes / best_time / 1e6))
+    print("%s: " % name + ", ".join("%s %.1f MB/s" % result for result in results))
+
+
+def main(arg):
+    out_dir = tempfile.mkdtemp()
+    out_path = os.path.join(out_dir, "out.txt")
+    if os.path.exists(arg):
+        doc = pdoc.Document.create_from_txt(arg, "word_type", "keep_eol_nl")
+        create_doc_args_f = lambda: (out_path, iter(doc))
+        num_tokens = len(doc)
+    else:
+        num_tokens = int(arg)
+        tokens = [random.choice(("\n", "the", "cat", "sat", "on", "a", "mat."))
+                  for _ in range(num_tokens)]
+        create_doc_args_f = lambda: (out_path, iter(tokens))
+    _bench("doc", (write_doc, save_doc), create_doc_args_f, [out_path])
+
+    block_len = 128
+    blocks = np.random.randint(0, 50000, (num_tokens // block_len, block_len))
+    lists_stats = (ListStat("input", "id_type", block_len, is_seq=True),
+                   ListStat("target", "id_type", block_len, is_seq=True))
+    save_paths = [os.path.join(out_dir, "input.txt"), os.path.join(out_dir, "target.txt")]
+    create_lists_args_f = lambda: (save_paths, ((block, block) for block in blocks), lists_stats)
+    _bench("lists", (write_lists, save_lists), create_lists_args_f, save_paths)
+    for f_name in os.listdir(out_dir):
+        os.remove(os.path.join(out_dir, f_name))
+    os.rmdir(out_dir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "5000000")
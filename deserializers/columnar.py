@@ -0,0 +1,122 @@
+import os
+import json
+import numpy as np
+import plp.serializers.columnar as pcolumnar
+from plp.transformers.interface import ListStat
+
+
+class ColumnarDataset:
+    """
+    Reader of a pcolumnar saved dir, the columns are memory-mapped and
+    examples are read in O(1) by index, so any order (shuffle) costs the
+    same as the saved one.
+    Numeric columns are returned as numpy views over the maps, word_type
+    columns are decoded to (nested) lists of str.
+    """
+    def __init__(self, save_dir):
+        with open(os.path.join(save_dir, pcolumnar.SCHEMA_F_NAME)) as f:
+            self._schema = json.load(f)
+        if self._schema["version"] != pcolumnar.VERSION:
+            raise ValueError("%s is not a version %d columnar dir" % (save_dir, pcolumnar.VERSION))
+        self._columns = [_Column(save_dir, column, self._schema["num_examples"])
+                         for column in self._schema["columns"]]
+
+    def __len__(self):
+        return self._schema["num_examples"]
+
+    @property
+    def names(self):
+        return [column.name for column in self._columns]
+
+    @property
+    def lists_stats(self):
+        return [ListStat.from_dict(column) for column in self._schema["columns"]]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("example index out of range")
+        return tuple(column.get(i) for column in self._columns)
+
+    def get_batch(self, start, stop):
+        """
+        Examples [start, stop) as one view per column: (batch, ...) for
+        fixed columns, (values, offsets) for is_seq columns, offsets being
+        the stop - start + 1 item offsets into values
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return tuple(column.get_batch(start, max(start, stop)) for column in self._columns)
+
+    def iter_examples(self, shuffle=False, seed=None):
+        indices = range(len(self))
+        if shuffle:
+            indices = np.random.RandomState(seed).permutation(len(self))
+        for i in indices:
+            yield self[int(i)]
+
+
+class _Column:
+    def __init__(self, save_dir, column, num_examples):
+        self.name = column["name"]
+        self._is_seq = column["is_seq"]
+        self._is_word = column["dtype"] == "utf-8"
+        inner_shape = tuple(column["inner_shape"])
+        self._inner_shape = inner_shape
+        self._inner_size = int(np.prod(inner_shape))
+        num_items = column["num_items"]
+        path_f = lambda kind: os.path.join(save_dir, "%s.%s.bin" % (self.name, kind))
+        if self._is_word:
+            self._values = _map(path_f("values"), np.uint8)
+            self._token_offsets = _map(path_f("token_offsets"), np.int64)
+        else:
+            self._values = _map(path_f("values"), np.dtype(column["dtype"])).reshape(
+                (num_items,) + inner_shape)
+        if self._is_seq:
+            self._offsets = _map(path_f("offsets"), np.int64)
+
+    def _get_range(self, start, stop):
+        if self._is_seq:
+            return self._offsets[start], self._offsets[stop]
+        return start, stop
+
+    def get(self, i):
+        item_start, item_stop = self._get_range(i, i + 1)
+        if self._is_word:
+            tokens = self._decode(item_start, item_stop)
+            if not self._is_seq:
+                tokens = tokens[0]
+            return tokens
+        if self._is_seq:
+            return self._values[item_start:item_stop]
+        return self._values[i]
+
+    def get_batch(self, start, stop):
+        item_start, item_stop = self._get_range(start, stop)
+        if self._is_word:
+            values = self._decode(item_start, item_stop)
+        else:
+            values = self._values[item_start:item_stop]
+        if self._is_seq:
+            return values, self._offsets[start:stop + 1] - item_start
+        return values
+
+    def _decode(self, item_start, item_stop):
+        """
+        items [item_start, item_stop) as lists of str nested as inner_shape
+        """
+        token_offsets = self._token_offsets[item_start * self._inner_size:
+                                            item_stop * self._inner_size + 1].tolist()
+        values = self._values
+        tokens = [values[token_start:token_stop].tobytes().decode("utf-8")
+                  for token_start, token_stop in zip(token_offsets, token_offsets[1:])]
+        for dim in reversed(self._inner_shape):
+            tokens = [tokens[j:j + dim] for j in range(0, len(tokens), dim)]
+        return tokens
+
+
+def _map(path, dtype):
+    if os.path.getsize(path) == 0:
+        # mmap can't map empty files
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
@@ -1,15 +1,24 @@
 import tensorflow as tf
 
 
-def create_word2vec_parse_f():
+def create_word2vec_parse_f(num_negatives=0):
+    """
+    num_negatives: of Word2vecTransformer, parses (center, context, negatives)
+    """
+    context_features = {
+        "center": tf.FixedLenFeature([], dtype=tf.int64),
+        "context": tf.FixedLenFeature([], dtype=tf.int64)
+    }
+    if num_negatives:
+        context_features["negatives"] = tf.FixedLenFeature([num_negatives], dtype=tf.int64)
+
     def word2vec_parse(example_proto):
         context, sequence = tf.parse_single_sequence_example(
             serialized=example_proto,
-            context_features={
-                "center": tf.FixedLenFeature([], dtype=tf.int64),
-                "context": tf.FixedLenFeature([], dtype=tf.int64)
-            },
+            context_features=context_features,
             sequence_features={}
         )
+        if num_negatives:
+            return context["center"], context["context"], context["negatives"]
         return context["center"], context["context"]
     return word2vec_parse
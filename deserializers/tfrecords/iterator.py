@@ -1,32 +1,71 @@
+import os
 import tensorflow as tf
+import plp.utils.file as pfile
+from plp.serializers.tfrecords import read_manifest
 
 
-def simple_iterator(tfrecords_path, parse_f):
-    dataset = tf.data.TFRecordDataset(tfrecords_path)
+def create_dataset(tfrecords_path, compression_type=None):
+    """
+    compression_type: GZIP, ZLIB or "", by default given by the path extension
+    """
+    if compression_type is None:
+        compression_type = pfile.get_tfrecords_compression_type(tfrecords_path)
+    return tf.data.TFRecordDataset(tfrecords_path, compression_type=compression_type)
+
+
+def simple_iterator(tfrecords_path, parse_f, compression_type=None):
+    dataset = create_dataset(tfrecords_path, compression_type)
     dataset = dataset.map(parse_f)
     iterator = dataset.make_initializable_iterator()
     return iterator.initializer, iterator.get_next()
 
 
-def batched_iterator(tfrecords_path, parse_f, batch_size):
-    dataset = tf.data.TFRecordDataset(tfrecords_path)
+def batched_iterator(tfrecords_path, parse_f, batch_size, compression_type=None):
+    dataset = create_dataset(tfrecords_path, compression_type)
     dataset = dataset.map(parse_f)
     dataset = dataset.batch(batch_size)
     iterator = dataset.make_initializable_iterator()
     return iterator.initializer, iterator.get_next()
 
 
-def batched_drop_ramainder_iterator(tfrecords_path, parse_f, batch_size):
-    dataset = tf.data.TFRecordDataset(tfrecords_path)
+def batched_drop_ramainder_iterator(tfrecords_path, parse_f, batch_size, compression_type=None):
+    dataset = create_dataset(tfrecords_path, compression_type)
     dataset = dataset.map(parse_f)
     dataset = dataset.apply(tf.contrib.data.batch_and_drop_remainder(batch_size))
     iterator = dataset.make_initializable_iterator()
     return iterator.initializer, iterator.get_next()
 
 
-def batched_drop_remainder_dataset(tfrecords_path, parse_f, batch_size):
-    dataset = tf.data.TFRecordDataset(tfrecords_path)
+def batched_drop_remainder_dataset(tfrecords_path, parse_f, batch_size, compression_type=None):
+    dataset = create_dataset(tfrecords_path, compression_type)
     dataset = dataset.map(parse_f)
     dataset = dataset.apply(tf.contrib.data.batch_and_drop_remainder(batch_size))
     return dataset
 
+
+def sharded_dataset(manifest_path, parse_f, cycle_length=None,
+                    shuffle_shards=False, seed=None, num_parallel_calls=None):
+    """
+    Records of the shards listed in the manifest, cycle_length shards read
+    in parallel and interleaved one record at a time
+    """
+    manifest = read_manifest(manifest_path)
+    compression_type = manifest.get("compression_type", "")
+    shard_paths = [shard["path"] for shard in manifest["shards"]]
+    if cycle_length is None:
+        cycle_length = min(len(shard_paths), os.cpu_count())
+    dataset = tf.data.Dataset.from_tensor_slices(shard_paths)
+    if shuffle_shards:
+        dataset = dataset.shuffle(len(shard_paths), seed=seed)
+    dataset = dataset.apply(tf.contrib.data.parallel_interleave(
+        lambda shard_path: tf.data.TFRecordDataset(shard_path, compression_type=compression_type),
+        cycle_length=cycle_length, sloppy=shuffle_shards))
+    return dataset.map(parse_f, num_parallel_calls=num_parallel_calls)
+
+
+def sharded_iterator(manifest_path, parse_f, batch_size=None, cycle_length=None):
+    dataset = sharded_dataset(manifest_path, parse_f, cycle_length)
+    if batch_size is not None:
+        dataset = dataset.batch(batch_size)
+    iterator = dataset.make_initializable_iterator()
+    return iterator.initializer, iterator.get_next()
@@ -0,0 +1,15 @@
+import tensorflow as tf
+
+
+def create_packed_lang_model_parse_f():
+    def packed_lang_model_parse(example_proto):
+        context, sequence = tf.parse_single_sequence_example(
+            serialized=example_proto,
+            context_features={},
+            sequence_features={
+                "input": tf.FixedLenSequenceFeature([], dtype=tf.int64),
+                "target": tf.FixedLenSequenceFeature([], dtype=tf.int64)
+            }
+        )
+        return sequence["input"], sequence["target"]
+    return packed_lang_model_parse
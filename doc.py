@@ -1,23 +1,43 @@
 import os
+import json
+import random
 import plp.token as ptoken
+import plp.pipeline as ppipeline
 import plp.vocab as pvocab
 import plp.serializers.txt as ptxt
+import plp.serializers.token_cache as ptoken_cache
+import plp.utils.parallel as pparallel
 import pdb
 import glob
 
+DEFAULT_CHUNK_SIZE = 4096
+
 
 class Document(object):
     @classmethod
     def create_from_txt(cls, txt_path, token_type, gen_eol_type,
-                        vocab_reader=None, isolating_tokens=None):
+                        vocab_reader=None, isolating_tokens=None, cache_dir=None):
         """
         isolating_tokens: E.g. "hi\tmy" where tab needs to be identified as 
         special flag token later
+        cache_dir: if given, the txt is tokenized once into a binary token
+        cache there, and later iterations stream from the cache
         """
         ptoken.assert_type_doc_valid(token_type)
         if not os.path.exists(txt_path):
             raise IOError(txt_path + " file not found")
         flag_tokens = []
+        if cache_dir is not None:
+            doc_gen_f = ptoken_cache.doc_gen_f_cached(
+                txt_path, token_type, gen_eol_type, isolating_tokens, cache_dir)
+            doc_chunk_gen_f = ptoken_cache.doc_chunk_gen_f_cached(
+                txt_path, token_type, gen_eol_type, isolating_tokens, cache_dir)
+            if gen_eol_type == "keep_eol_nl":
+                flag_tokens.append("\n")
+            doc = cls(doc_gen_f, token_type, flag_tokens, vocab_reader, txt_path,
+                      doc_chunk_gen_f)
+            doc._src_key = [gen_eol_type, isolating_tokens]
+            return doc
         if gen_eol_type == "yield_eol":
             doc_gen_f = ptxt.doc_gen_f_yield_eol(txt_path, token_type, isolating_tokens)
         elif gen_eol_type == "ignore_eol":
@@ -27,11 +47,33 @@ class Document(object):
             flag_tokens.append("\n")
         else:
             raise ValueError("Non existing end of line type")
-        return cls(doc_gen_f, token_type, flag_tokens, vocab_reader, txt_path)
+        doc_chunk_gen_f = ptxt.doc_chunk_gen_f(
+            txt_path, token_type, gen_eol_type, isolating_tokens)
+        doc = cls(doc_gen_f, token_type, flag_tokens, vocab_reader, txt_path,
+                  doc_chunk_gen_f)
+        doc._src_key = [gen_eol_type, isolating_tokens]
+        return doc
     
+    @classmethod
+    def create_from_tokens(cls, tokens, token_type,
+                           flag_tokens=None, vocab_reader=None, src_path=None):
+        """
+        Document over an already materialized token list
+        """
+        def tokens_iter_f():
+            return iter(tokens)
+
+        def tokens_chunk_iter_f(chunk_size):
+            for i in range(0, len(tokens), chunk_size):
+                yield tokens[i:i + chunk_size]
+        doc = cls(tokens_iter_f, token_type, flag_tokens, vocab_reader, src_path,
+                  tokens_chunk_iter_f)
+        doc._doc_len = len(tokens)
+        return doc
+
     def save_as_txt(self, txt_path, num_tokens_per_line=None):
         if num_tokens_per_line is None:
-            ptxt.doc_save(txt_path, iter(self))
+            ptxt.doc_save_chunks(txt_path, self.iter_chunks())
         else:
             ptxt.doc_save_by_line(txt_path, iter(self), num_tokens_per_line, self.token_type)
     
@@ -46,14 +88,29 @@ class Document(object):
                 assert token_type == doc_.token_type
                 for item in iter(doc_):
                     yield item
-        return cls(merged_iter_f, token_type)  # TODO handle vocab
+
+        def merged_chunk_iter_f(chunk_size):
+            for doc_ in docs:
+                assert token_type == doc_.token_type
+                for chunk in doc_.iter_chunks(chunk_size):
+                    yield chunk
+        return cls(merged_iter_f, token_type,
+                   src_chunk_gen_f=merged_chunk_iter_f)  # TODO handle vocab
 
     def __init__(self, src_gen_f, token_type,
-                 flag_tokens=None, vocab_reader=None, src_path=None):
+                 flag_tokens=None, vocab_reader=None, src_path=None,
+                 src_chunk_gen_f=None):
+        """
+        src_chunk_gen_f: optional f(chunk_size) yielding lists of tokens,
+        used by iter_chunks instead of chunking src_gen_f
+        """
         self._src_gen_f = src_gen_f
+        self._src_chunk_gen_f = src_chunk_gen_f
         self._src_path = src_path
+        # txt options the tokens were read with, see compute_docs_lens
+        self._src_key = None
         self._f_name = os.path.basename(src_path) if src_path else None
-        self._gen_fs = []
+        self._ops = []
         self._token_type = token_type
         self._vocab_reader = vocab_reader
         self._label_dict = {}
@@ -62,14 +119,22 @@ class Document(object):
         self._is_locked = False
 
     def __iter__(self):
-        token_iter = self._src_gen_f()
-        for gen_f in self._gen_fs:
-            token_iter = gen_f(token_iter)
-        return token_iter
+        return ppipeline.run_ops(self._src_gen_f(), self._ops)
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Same tokens as iter(doc), yielded as lists of about chunk_size tokens.
+        Map ops run per chunk, context window ops carry across chunks
+        """
+        if self._src_chunk_gen_f is not None:
+            chunk_iter = self._src_chunk_gen_f(chunk_size)
+        else:
+            chunk_iter = ppipeline.iter_token_chunks(self._src_gen_f(), chunk_size)
+        return ppipeline.run_chunked_ops(chunk_iter, self._ops, chunk_size)
 
     def __len__(self):
         if not self._doc_len:
-            self._doc_len = sum(1 for _ in iter(self))
+            self._doc_len = sum(len(chunk) for chunk in self.iter_chunks())
         return self._doc_len
 
     @property
@@ -139,50 +204,46 @@ class Document(object):
         max_num_left, max_num_right = ptoken.get_transformers_max_num_tokens(
             annotation_transformers
         )
-        left, right = [], []
-        token_iter = iter(self)
-        try:
-            center = next(token_iter)
-        except StopIteration:
-            return
-        while center is not None:
+        window = ptoken.ContextWindow(iter(self), max_num_left, max_num_right)
+        left, right = window.left, window.right
+        left_buf, right_buf = window.left_buf, window.right_buf
+        while window.has_center:
+            center = window.center
             annotation = None
-            if len(left) == max_num_left and len(right) == max_num_right:
+            if len(left_buf) == max_num_left and len(right_buf) == max_num_right:
                 for transformer in annotation_transformers:
                     annotation = transformer[left, center, right]
                     if annotation is not None:
                         break
             else:
                 for transformer in annotation_transformers:
-                    if transformer.is_applicable(len(left), len(right)):
+                    if transformer.is_applicable(len(left_buf), len(right_buf)):
                         annotation = transformer[left, center, right]
                         if annotation is not None:
                             break
                 if annotation is None:
-                    if len(right) < max_num_right:
-                        try:
-                            right.append(next(token_iter))
-                            continue
-                        except StopIteration:
-                            pass
+                    if window.extend_right():
+                        continue
             yield center, annotation
-            center = ptoken.shift_context_center_tokens(
-                (left, center, right),
-                token_iter, max_num_left)
+            window.shift()
 
-    ############################################
-    # State Changing methods, Wrap by f_gen_fs #
-    ############################################
+    ########################################
+    # State Changing methods, Wrap by _ops #
+    ########################################
     def toggle_word_id(self):
         assert self._vocab_reader is not None
         self._assert_not_locked("toggle_word_id")
         if self._token_type == "word_type":
-            self._gen_fs.append(ptoken.create_word2id_gen_f(
-                self._vocab_reader, self._applied_flag_tokens))
+            self._ops.append(ppipeline.MapOp(
+                "word2id",
+                ptoken.create_word2id_f(self._vocab_reader, self._applied_flag_tokens),
+                ptoken.create_words2ids_f(self._vocab_reader, self._applied_flag_tokens)))
             self._token_type = "id_type"
         elif self._token_type == "id_type":
-            self._gen_fs.append(ptoken.create_id2word_gen_f(
-                self._vocab_reader, self._applied_flag_tokens))
+            self._ops.append(ppipeline.MapOp(
+                "id2word",
+                ptoken.create_id2word_f(self._vocab_reader, self._applied_flag_tokens),
+                ptoken.create_ids2words_f(self._vocab_reader, self._applied_flag_tokens)))
             self._token_type = "word_type"
         else:
             raise ValueError("Curr token type does not support toggle word/id")
@@ -191,12 +252,18 @@ class Document(object):
         assert self._vocab_reader is not None
         self._assert_not_locked("convert embed")
         if self._token_type == "word_type":
-            self._gen_fs.append(ptoken.create_word2embed_gen_f(
-                self._vocab_reader, self._applied_flag_tokens))
+            self._ops.append(ppipeline.MapOp(
+                "word2embed",
+                ptoken.create_word2embed_f(self._vocab_reader, self._applied_flag_tokens),
+                ptoken.create_words2embeds_f(self._vocab_reader, self._applied_flag_tokens),
+                memoize=False))
             self._token_type = "embed_type"
         elif self._token_type == "id_type":
-            self._gen_fs.append(ptoken.create_id2embed_gen_f(
-                self._vocab_reader, self._applied_flag_tokens))
+            self._ops.append(ppipeline.MapOp(
+                "id2embed",
+                ptoken.create_id2embed_f(self._vocab_reader, self._applied_flag_tokens),
+                ptoken.create_ids2embeds_f(self._vocab_reader, self._applied_flag_tokens),
+                memoize=False))
             self._token_type = "embed_type"
         else:
             raise ValueError("Curr token type does not support toggle word/id")
@@ -205,29 +272,32 @@ class Document(object):
         assert self.token_type == "word_type"
         self._assert_not_locked("strip_tokens")
 
-        def strip_tokens_gen(token_iter):
-            for token in token_iter:
-                if token not in self.applied_flag_tokens:
-                    yield token.strip()
-                else:
-                    yield token
-        self._gen_fs.append(strip_tokens_gen)
+        flag_tokens = self.applied_flag_tokens
+
+        def strip_token(token):
+            if token not in flag_tokens:
+                return token.strip()
+            return token
+        self._ops.append(ppipeline.MapOp("strip_tokens", strip_token))
 
-    def skip_tokens(self, bool_token_transformers):
+    def skip_tokens(self, bool_token_transformers, cache_key=None):
+        """
+        cache_key: json-able identity of the transformers, without it the
+        doc len isn't stored in compute_docs_lens's lens file
+        """
         max_num_left, max_num_right = ptoken.get_transformers_max_num_tokens(
             bool_token_transformers
         )
         self._assert_not_locked("skip_tokens")
 
         def skip_tokens_gen(token_iter):
-            left, right = [], []
-            try:
-                center = next(token_iter)
-            except StopIteration:
-                return
-            while center is not None:
+            window = ptoken.ContextWindow(token_iter, max_num_left, max_num_right)
+            left, right = window.left, window.right
+            left_buf, right_buf = window.left_buf, window.right_buf
+            while window.has_center:
+                center = window.center
                 skip_flag = False
-                if len(left) == max_num_left and len(right) == max_num_right:
+                if len(left_buf) == max_num_left and len(right_buf) == max_num_right:
                     for transformer in bool_token_transformers:
                         skip_flag = transformer[left, center, right]
                         if skip_flag:
@@ -236,82 +306,71 @@ class Document(object):
                         yield center
                 else:
                     for transformer in bool_token_transformers:
-                        if transformer.is_applicable(len(left), len(right)):
+                        if transformer.is_applicable(len(left_buf), len(right_buf)):
                             skip_flag = transformer[left, center, right]
                             if skip_flag:
                                 break
                     if not skip_flag:
-                        if len(right) < max_num_right:
-                            try:
-                                right.append(next(token_iter))
-                                continue
-                            except StopIteration:
-                                pass
+                        if window.extend_right():
+                            continue
                         yield center
-                center = ptoken.shift_context_center_tokens(
-                    (left, center, right),
-                    token_iter, max_num_left)
-        self._gen_fs.append(skip_tokens_gen)
+                window.shift()
+        self._ops.append(ppipeline.GenOp("skip_tokens", skip_tokens_gen, cache_key))
 
-    def transform_tokens(self, token_transformers):
+    def transform_tokens(self, token_transformers, cache_key=None):
+        """
+        cache_key: see skip_tokens
+        """
         max_num_left, max_num_right = ptoken.get_transformers_max_num_tokens(
             token_transformers
         )
         self._assert_not_locked("transform_tokens")
 
         def transform_tokens_gen(token_iter):
-            left, right = [], []
-            try:
-                center = next(token_iter)
-            except StopIteration:
-                return
-            while center is not None:
+            window = ptoken.ContextWindow(token_iter, max_num_left, max_num_right)
+            left, right = window.left, window.right
+            left_buf, right_buf = window.left_buf, window.right_buf
+            while window.has_center:
+                center = window.center
                 new_tokens = None
-                if len(left) == max_num_left and len(right) == max_num_right:
+                if len(left_buf) == max_num_left and len(right_buf) == max_num_right:
                     for transformer in token_transformers:
                         new_tokens = transformer[left, center, right]
                         if new_tokens is not None:
                             break
                 else:
                     for transformer in token_transformers:
-                        if transformer.is_applicable(len(left), len(right)):
+                        if transformer.is_applicable(len(left_buf), len(right_buf)):
                             new_tokens = transformer[left, center, right]
                             if new_tokens is not None:
                                 break
                     if new_tokens is None:
-                        if len(right) < max_num_right:
-                            try:
-                                right.append(next(token_iter))
-                                continue
-                            except StopIteration:
-                                pass
+                        if window.extend_right():
+                            continue
                 if new_tokens is None:
                     yield center
                 else:
                     for new_token in new_tokens:
                         yield new_token
-                # pdb.set_trace()
-                center = ptoken.shift_context_center_tokens(
-                    (left, center, right),
-                    token_iter, max_num_left)
-        self._gen_fs.append(transform_tokens_gen)
+                window.shift()
+        self._ops.append(ppipeline.GenOp("transform_tokens", transform_tokens_gen,
+                                         cache_key))
 
     def mask_unk(self):
         assert self._vocab_reader is not None
         self._assert_not_locked("mask_unk")
 
-        def mask_unk_gen_f(token_iter):
-            if self.token_type == "word_type":
-                unk_signature = pvocab.UNK
-                unk_check_f = self._vocab_reader.check_word_exist
-            else:
-                raise NotImplementedError("Not implemented yet")
-            for token in token_iter:
-                if not unk_check_f(token):
-                    yield unk_signature
-                else:
-                    yield token
-        self._gen_fs.append(mask_unk_gen_f)
+        if self.token_type == "word_type":
+            unk_signature = pvocab.UNK
+            unk_check_f = self._vocab_reader.check_word_exist
+        else:
+            raise NotImplementedError("Not implemented yet")
+
+        def mask_unk_token(token):
+            if not unk_check_f(token):
+                return unk_signature
+            return token
+        self._ops.append(ppipeline.MapOp("mask_unk", mask_unk_token))
 
 
 def sort_docs_by_len(docs):
@@ -319,53 +378,178 @@ def sort_docs_by_len(docs):
     return sorted(doc_len_tuples, key=lambda x: x[1])
 
 
-def batch_docs_by_len(batch_size, batch_seq_len, docs):
-    sorted_doc_len_tuples = sort_docs_by_len(docs)
-    # pdb.set_trace()
-    doc_len_iter = iter(sorted_doc_len_tuples)
-    items = []
-    item_lens = []
-    while True:
-        try:
-            doc, doc_len = next(doc_len_iter)
-            items.append(doc)
-            item_lens.append(doc_len)
-        except StopIteration:
-            break
-
-        if (item_lens[-1]-1)//batch_seq_len != (item_lens[0]-1)//batch_seq_len:
-            yield items[:-1], item_lens[:-1]
-            items = [items[-1]]
-            item_lens = [item_lens[-1]]
-
-        if len(items) == batch_size:
-            yield items, item_lens
-            items = []
-            item_lens = []
+def compute_docs_lens(docs, num_workers=1, lens_f_path=None):
+    """
+    len(doc) of each doc, the docs iterated in num_workers forked processes.
+    lens_f_path: optional json sidecar of the lens of txt docs, keyed by the
+    file stat, the txt options (gen_eol_type, isolating_tokens) and the
+    recorded pipeline, read before and updated after. Map ops don't change
+    the len, gen ops are keyed by their cache_key: docs with a gen op
+    without one are always iterated.
+    """
+    docs = list(docs)
+    stored_lens = {}
+    if lens_f_path is not None and os.path.exists(lens_f_path):
+        with open(lens_f_path) as f:
+            stored_lens = json.load(f)
+    lens = [None] * len(docs)
+    keys = [None] * len(docs)
+    for i, doc in enumerate(docs):
+        if doc._doc_len:
+            lens[i] = doc._doc_len
+            continue
+        if lens_f_path is not None:
+            keys[i] = _doc_len_key(doc)
+            lens[i] = stored_lens.get(keys[i])
+    missing = [i for i, doc_len in enumerate(lens) if doc_len is None]
+    # docs aren't picklable, forked workers get them by index
+    for i, doc_len in zip(missing, pparallel.ordered_bounded_map(
+            lambda i: len(docs[i]), missing, num_workers)):
+        lens[i] = doc_len
+    for doc, doc_len in zip(docs, lens):
+        doc._doc_len = doc_len
+    if lens_f_path is not None and any(keys[i] is not None for i in missing):
+        stored_lens.update((keys[i], lens[i]) for i in missing if keys[i] is not None)
+        temp_path = lens_f_path + ".temp" + str(os.getpid())
+        with open(temp_path, "w") as f:
+            json.dump(stored_lens, f)
+        os.replace(temp_path, lens_f_path)
+    return lens
+
+
+def _doc_len_key(doc):
+    """
+    None if the doc len can't be identified
+    """
+    if doc._src_key is None:
+        return None
+    ops_key = []
+    for op in doc._ops:
+        if isinstance(op, ppipeline.GenOp):
+            if op.key is None:
+                return None
+            ops_key.append([op.name, op.key])
+        else:
+            ops_key.append(op.name)
+    stat = os.stat(doc.src_path)
+    return json.dumps([os.path.abspath(doc.src_path), stat.st_mtime, stat.st_size,
+                       doc.token_type, doc.applied_flag_tokens, doc._src_key, ops_key])
+
+
+def bucket_docs_by_len(docs, doc_lens, bucket_f, shuffle_seed=None):
+    """
+    (bucket, docs, lens) in increasing bucket order, the docs are assigned in
+    one pass and keep their order in a bucket unless shuffled with the seed
+    """
+    buckets = {}
+    for doc, doc_len in zip(docs, doc_lens):
+        bucket_docs, bucket_lens = buckets.setdefault(bucket_f(doc_len), ([], []))
+        bucket_docs.append(doc)
+        bucket_lens.append(doc_len)
+    rng = random.Random(shuffle_seed) if shuffle_seed is not None else None
+    for bucket in sorted(buckets):
+        bucket_docs, bucket_lens = buckets.pop(bucket)
+        if rng is not None:
+            order = list(range(len(bucket_docs)))
+            rng.shuffle(order)
+            bucket_docs = [bucket_docs[i] for i in order]
+            bucket_lens = [bucket_lens[i] for i in order]
+        yield bucket, bucket_docs, bucket_lens
+
+
+def batch_docs_by_len(batch_size, batch_seq_len, docs,
+                      num_workers=1, lens_f_path=None, shuffle_seed=None):
+    """
+    Batches of at most batch_size docs of the same (len-1)//batch_seq_len
+    bucket, smaller buckets first
+    """
+    docs = list(docs)
+    doc_lens = compute_docs_lens(docs, num_workers, lens_f_path)
+    for _, bucket_docs, bucket_lens in bucket_docs_by_len(
+            docs, doc_lens, lambda doc_len: (doc_len - 1) // batch_seq_len, shuffle_seed):
+        for start in range(0, len(bucket_docs), batch_size):
+            yield bucket_docs[start:start + batch_size], bucket_lens[start:start + batch_size]
+
+
+def batch_docs_by_token_budget(max_batch_tokens, batch_seq_len, docs, max_doc_len=None,
+                               num_workers=1, lens_f_path=None, shuffle_seed=None):
+    """
+    Batches docs with the same number of batch_seq_len seqs (the len bucket)
+    so that num_docs * padded doc len stays within max_batch_tokens, a single
+    doc is always batched even if it is over the budget
+    """
+    max_num_seqs = None
+    if max_doc_len is not None:
+        max_num_seqs = max(-(-max_doc_len // batch_seq_len), 1)
+
+    def num_seqs_f(doc_len):
+        num_seqs = max(-(-doc_len // batch_seq_len), 1)
+        return num_seqs if max_num_seqs is None else min(num_seqs, max_num_seqs)
+
+    docs = list(docs)
+    doc_lens = compute_docs_lens(docs, num_workers, lens_f_path)
+    for num_seqs, bucket_docs, bucket_lens in bucket_docs_by_len(
+            docs, doc_lens, num_seqs_f, shuffle_seed):
+        num_docs = max(max_batch_tokens // (num_seqs * batch_seq_len), 1)
+        for start in range(0, len(bucket_docs), num_docs):
+            yield bucket_docs[start:start + num_docs], bucket_lens[start:start + num_docs]
 
 
 def create_from_txt_dir(txt_dir, token_type, gen_eol_type,
-                        vocab_reader=None, isolating_tokens=None):
+                        vocab_reader=None, isolating_tokens=None, cache_dir=None):
     docs = []
     for f_path in sorted(glob.iglob(os.path.join(txt_dir, "*.txt"))):
         doc = Document.create_from_txt(
-                f_path, "word_type", gen_eol_type, vocab_reader, isolating_tokens
+                f_path, "word_type", gen_eol_type, vocab_reader, isolating_tokens,
+                cache_dir
                 )
         docs.append(doc)
     return docs
 
 
 def gen_from_txt_dir(txt_dir, token_type, gen_eol_type,
-                      vocab_reader=None, isolating_tokens=None):
+                      vocab_reader=None, isolating_tokens=None, cache_dir=None):
     for f_path in sorted(glob.iglob(os.path.join(txt_dir, "*.txt"))):
         doc = Document.create_from_txt(
-                f_path, "word_type", gen_eol_type, vocab_reader, isolating_tokens
+                f_path, "word_type", gen_eol_type, vocab_reader, isolating_tokens,
+                cache_dir
                 )
         yield doc
 
 
+def gen_from_txt_dir_parallel(txt_dir, token_type, gen_eol_type,
+                              vocab_reader=None, isolating_tokens=None, cache_dir=None,
+                              prepare_doc_f=None, num_workers=None, max_in_flight=None):
+    """
+    Like gen_from_txt_dir, but each doc is tokenized and run through its
+    pipeline in a worker process.
+    prepare_doc_f(doc): records the pipeline (toggle_word_id, skip_tokens...)
+    and labels on each freshly created doc, it is run inside the workers.
+    Yields docs over the materialized tokens, in sorted path order, with at
+    most max_in_flight docs held at a time.
+    """
+    def load_doc(f_path):
+        doc = Document.create_from_txt(
+            f_path, "word_type", gen_eol_type, vocab_reader, isolating_tokens, cache_dir)
+        if prepare_doc_f is not None:
+            prepare_doc_f(doc)
+        tokens = [token for chunk in doc.iter_chunks() for token in chunk]
+        return tokens, doc.token_type, doc.applied_flag_tokens, doc._label_dict
+
+    f_paths = sorted(glob.iglob(os.path.join(txt_dir, "*.txt")))
+    loaded_iter = pparallel.ordered_bounded_map(
+        load_doc, f_paths, num_workers, max_in_flight)
+    for f_path, (tokens, doc_token_type, flag_tokens, label_dict) in zip(f_paths, loaded_iter):
+        doc = Document.create_from_tokens(
+            tokens, doc_token_type, flag_tokens, vocab_reader, f_path)
+        for key, val in label_dict.items():
+            doc.set_label(key, val)
+        yield doc
 
 
-
-
-
+def create_from_txt_dir_parallel(txt_dir, token_type, gen_eol_type,
+                                 vocab_reader=None, isolating_tokens=None, cache_dir=None,
+                                 prepare_doc_f=None, num_workers=None, max_in_flight=None):
+    return list(gen_from_txt_dir_parallel(
+        txt_dir, token_type, gen_eol_type, vocab_reader, isolating_tokens, cache_dir,
+        prepare_doc_f, num_workers, max_in_flight))
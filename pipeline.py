@@ -0,0 +1,206 @@
+import itertools
+
+_MISSING = object()
+# distinct tokens memoized by a FusedMapOp before the memo is cleared
+MEMO_MAX_SIZE = 1 << 16
+
+
+class MapOp:
+    """
+    Stateless per-token op: token -> token.
+    Runs of consecutive MapOps are fused into a single pass at iteration time.
+    chunk_f: optional vectorized version, token chunk -> token chunk
+    memoize: False if the results shouldn't be held per distinct token,
+    e.g. embeddings
+    """
+    def __init__(self, name, token_f, chunk_f=None, memoize=True):
+        self._name = name
+        self._token_f = token_f
+        self._chunk_f = chunk_f
+        self._memoize = memoize
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def token_f(self):
+        return self._token_f
+
+    @property
+    def chunk_f(self):
+        return self._chunk_f
+
+    @property
+    def memoize(self):
+        return self._memoize
+
+    def __call__(self, token_iter):
+        return map(self._token_f, token_iter)
+
+    def iter_chunks(self, chunk_iter, chunk_size):
+        if self._chunk_f is not None:
+            return map(self._chunk_f, chunk_iter)
+        token_f = self._token_f
+        return ([token_f(token) for token in chunk] for chunk in chunk_iter)
+
+
+class GenOp:
+    """
+    Stateful op over the token stream (context windows, skipping, expanding)
+    gen_f: token_iter -> token_iter
+    key: optional json-able identity of the gen_f params, see
+    pdoc.compute_docs_lens
+    """
+    def __init__(self, name, gen_f, key=None):
+        self._name = name
+        self._gen_f = gen_f
+        self._key = key
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def key(self):
+        return self._key
+
+    def __call__(self, token_iter):
+        return self._gen_f(token_iter)
+
+    def iter_chunks(self, chunk_iter, chunk_size):
+        """
+        The gen_f runs once over the whole flattened stream, so context
+        windows carry over chunk boundaries, then output is re-chunked
+        """
+        token_iter = self._gen_f(itertools.chain.from_iterable(chunk_iter))
+        return iter_token_chunks(token_iter, chunk_size)
+
+
+class FusedMapOp(MapOp):
+    """
+    Several MapOps applied in one pass. Since map ops are stateless, the
+    result per distinct token is memoized for the duration of one iteration,
+    unless an op opts out. The memo is cleared past MEMO_MAX_SIZE tokens
+    """
+    def __init__(self, map_ops):
+        self._map_ops = map_ops
+        token_fs = [op.token_f for op in map_ops]
+
+        def fused_token_f(token):
+            for token_f in token_fs:
+                token = token_f(token)
+            return token
+        super(FusedMapOp, self).__init__(
+            "+".join(op.name for op in map_ops), fused_token_f,
+            memoize=all(op.memoize for op in map_ops))
+
+    @property
+    def map_ops(self):
+        return self._map_ops
+
+    def __call__(self, token_iter):
+        token_f = self._token_f
+        if not self._memoize:
+            return map(token_f, token_iter)
+        return self._memoized_gen(token_iter)
+
+    def _memoized_gen(self, token_iter):
+        token_f = self._token_f
+        memo = {}
+        for token in token_iter:
+            try:
+                new_token = memo.get(token, _MISSING)
+            except TypeError:
+                # unhashable tokens, e.g. embeddings
+                yield token_f(token)
+                continue
+            if new_token is _MISSING:
+                new_token = token_f(token)
+                if len(memo) >= MEMO_MAX_SIZE:
+                    memo.clear()
+                memo[token] = new_token
+            yield new_token
+
+    def iter_chunks(self, chunk_iter, chunk_size):
+        if not self._memoize:
+            return super(FusedMapOp, self).iter_chunks(chunk_iter, chunk_size)
+        return self._memoized_chunks(chunk_iter)
+
+    def _memoized_chunks(self, chunk_iter):
+        token_f = self._token_f
+        memo = {}
+        for chunk in chunk_iter:
+            if len(memo) >= MEMO_MAX_SIZE:
+                memo.clear()
+            try:
+                new_tokens = set(chunk).difference(memo)
+            except TypeError:
+                yield [token_f(token) for token in chunk]
+                continue
+            for token in new_tokens:
+                memo[token] = token_f(token)
+            yield list(map(memo.__getitem__, chunk))
+
+
+def compile_ops(ops):
+    """
+    Merges each run of consecutive MapOps into one FusedMapOp
+    """
+    stages = []
+    map_run = []
+    for op in ops:
+        if isinstance(op, MapOp):
+            map_run.append(op)
+            continue
+        if map_run:
+            stages.append(FusedMapOp(map_run))
+            map_run = []
+        stages.append(op)
+    if map_run:
+        stages.append(FusedMapOp(map_run))
+    return stages
+
+
+def run_ops(token_iter, ops):
+    for stage in compile_ops(ops):
+        token_iter = stage(token_iter)
+    return token_iter
+
+
+def compile_chunked_ops(ops):
+    """
+    Like compile_ops, but MapOps with a vectorized chunk_f run on their own
+    """
+    stages = []
+    for stage in compile_ops(ops):
+        if not isinstance(stage, FusedMapOp):
+            stages.append(stage)
+            continue
+        map_run = []
+        for op in stage.map_ops:
+            if op.chunk_f is None:
+                map_run.append(op)
+                continue
+            if map_run:
+                stages.append(FusedMapOp(map_run))
+                map_run = []
+            stages.append(op)
+        if map_run:
+            stages.append(FusedMapOp(map_run))
+    return stages
+
+
+def run_chunked_ops(chunk_iter, ops, chunk_size):
+    for stage in compile_chunked_ops(ops):
+        chunk_iter = stage.iter_chunks(chunk_iter, chunk_size)
+    return chunk_iter
+
+
+def iter_token_chunks(token_iter, chunk_size):
+    token_iter = iter(token_iter)
+    while True:
+        chunk = list(itertools.islice(token_iter, chunk_size))
+        if not chunk:
+            return
+        yield chunk
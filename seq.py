@@ -1,3 +1,5 @@
+import collections
+import itertools
 import plp.token as ptoken
 import plp.vocab as pvocab
 import plp.serializers.txt as ptxt
@@ -9,18 +11,15 @@ class SeqDocument(object):
         assert not doc.is_flag_token_applied
 
         def fixed_len_gen(token_iter):
-            seq_list = []
-            try:
-                for _ in range(fixed_len):
-                    seq_list.append(next(token_iter))
-            except:
+            seq_buf = collections.deque(itertools.islice(token_iter, fixed_len),
+                                        maxlen=fixed_len)
+            if len(seq_buf) < fixed_len:
                 return
             while True:
-                yield tuple(seq_list), fixed_len
+                yield tuple(seq_buf), fixed_len
                 try:
-                    seq_list.pop(0)
-                    seq_list.append(next(token_iter))
-                except:
+                    seq_buf.append(next(token_iter))
+                except StopIteration:
                     break
         return cls(doc, fixed_len_gen)
 
@@ -56,7 +55,8 @@ class SeqDocument(object):
             while True:
                 try:
                     item = next(token_iter)
-                    if item in doc.applied_flag_tokens:
+                    # flag tokens are str, embed tokens can't be compared with ==
+                    if isinstance(item, str) and item in doc.applied_flag_tokens:
                         yield seq_list, item
                         seq_list = []
                     else:
@@ -126,55 +126,40 @@ class SeqDocument(object):
         )
 
         def transform_flags_gen(seq_flag_iter):
-            left_seq_list, right_seq_list = [], []
-            left_flag_list, right_flag_list = [], []
-            try:
-                seq, center = next(seq_flag_iter)
-            except StopIteration:
-                return
-            while center is not None:
+            # window over (seq, flag) pairs, transformers only see the flags
+            window = ptoken.ContextWindow(seq_flag_iter, max_num_left, max_num_right, field=1)
+            left_flags, right_flags = window.left, window.right
+            left_buf, right_buf = window.left_buf, window.right_buf
+            while window.has_center:
+                seq, center = window.center
                 new_center = None
-                if len(left_flag_list) == max_num_left and len(right_flag_list) == max_num_right:
+                if len(left_buf) == max_num_left and len(right_buf) == max_num_right:
                     for transformer in flag_token_transformers:
-                        new_center = transformer[left_flag_list, center, right_flag_list,]
+                        new_center = transformer[left_flags, center, right_flags]
                         # if one successfully transformed the flag, stop checking the rest
                         if new_center is not None:
                             break
                 else:
                     for transformer in flag_token_transformers:
-                        if transformer.is_applicable(len(left_flag_list), len(right_flag_list)):
-                            new_center = transformer[left_flag_list, center, right_flag_list]
+                        if transformer.is_applicable(len(left_buf), len(right_buf)):
+                            new_center = transformer[left_flags, center, right_flags]
                             # if one successfully transformed the flag, stop checking the rest
                             if new_center is not None:
                                 break
                     # If none of the transformer was applicable or transforming the token
                     # Expand right flag list until max
                     if new_center is None:
-                        if len(right_flag_list) < max_num_right:
-                            try:
-                                right_seq, right_flag = next(seq_flag_iter)
-                                right_seq_list.append(right_seq)
-                                right_flag_list.append(right_flag)
-                                continue
-                            except StopIteration:
-                                pass
+                        if window.extend_right():
+                            continue
                 if new_center is None:
                     yield seq, center
                 else:
                     yield seq, new_center
-                seq, center = ptoken.shift_context_center_tokens(
-                    (
-                        [left_seq_list, left_flag_list],
-                        [seq, center],
-                        [right_seq_list, right_flag_list]
-                    ),
-                    seq_flag_iter, max_num_left
-                )
-                # seq, center will have None if right len is zero and no more elements are iter
+                window.shift()
         self._seq_flag_gen_fs.append(transform_flags_gen)
 
     def __getattr__(self, attr):
-        if attr in ["token_type", "embed_size", "get_label"]:
+        if attr in ["token_type", "embed_size", "pad_embedding", "get_label"]:
             return getattr(self._doc, attr)
         else:
             raise ValueError("SeqDocument doesn't have attr " + attr)
@@ -0,0 +1,47 @@
+import os
+import json
+from plp.utils.file import AtomicWriteOpen
+
+
+def resumable_save(docs, save_shard_f, checkpoint_path, docs_per_shard, size=None):
+    """
+    Saves docs[i * docs_per_shard:(i + 1) * docs_per_shard] as shard i with
+    save_shard_f(shard_i, shard_docs, size) -> (shard_paths, num_records),
+    which must commit its files atomically.
+    After each shard the checkpoint json records the docs it covered, a
+    restart with the same checkpoint_path skips the completed shards, so
+    their docs are not transformed again.
+    size, if given, bounds the total num of records over all the shards.
+    Returns the completed shard entries.
+    """
+    doc_keys = [doc.src_path for doc in docs]
+    shards = []
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint["docs_per_shard"] != docs_per_shard:
+            raise ValueError(checkpoint_path + " was saved with another docs_per_shard")
+        shards = checkpoint["shards"]
+        for shard in shards:
+            if shard["doc_keys"] != doc_keys[shard["doc_start"]:shard["doc_end"]]:
+                raise ValueError(checkpoint_path + " doesn't match the docs")
+    num_records = sum(shard["num_records"] for shard in shards)
+    for shard_i, doc_start in enumerate(range(0, len(docs), docs_per_shard)):
+        if shard_i < len(shards):
+            continue
+        if size is not None and num_records >= size:
+            break
+        doc_end = min(doc_start + docs_per_shard, len(docs))
+        shard_paths, shard_num_records = save_shard_f(
+            shard_i, docs[doc_start:doc_end], None if size is None else size - num_records)
+        shards.append({
+            "paths": list(shard_paths),
+            "num_records": shard_num_records,
+            "doc_start": doc_start,
+            "doc_end": doc_end,
+            "doc_keys": doc_keys[doc_start:doc_end]
+        })
+        num_records += shard_num_records
+        with AtomicWriteOpen(checkpoint_path) as fs:
+            json.dump({"docs_per_shard": docs_per_shard, "shards": shards}, fs[0])
+    return shards
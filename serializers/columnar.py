@@ -0,0 +1,135 @@
+import os
+import json
+import shutil
+import itertools
+from array import array
+import numpy as np
+from plp.utils.iterator import limit_iter
+
+VERSION = 1
+SCHEMA_F_NAME = "schema.json"
+_DTYPES = {
+    "id_type": np.int64,
+    "value_int_type": np.int64,
+    "value_float_type": np.float32
+}
+
+
+def docs_transformed_save(doc_transform_state, save_dir):
+    iterator = doc_transform_state.transformer.transform_docs(
+        *doc_transform_state.docs
+    )
+    lists_stats = doc_transform_state.transformer.get_lists_stats(
+        *doc_transform_state.docs
+    )
+    return _transformed_save(iterator, lists_stats, save_dir, doc_transform_state.size)
+
+
+def seq_docs_transformed_save(doc_transform_state, save_dir):
+    iterator = doc_transform_state.transformer.transform_seq_docs(
+        *doc_transform_state.docs
+    )
+    lists_stats = doc_transform_state.transformer.get_lists_stats(
+        *doc_transform_state.docs
+    )
+    return _transformed_save(iterator, lists_stats, save_dir, doc_transform_state.size)
+
+
+def _transformed_save(lists_iter, lists_stats, save_dir, size):
+    """
+    Each list stat is a column saved in save_dir as raw typed arrays:
+      <name>.values.bin   the examples back to back, (num_items, *inner_shape)
+      <name>.offsets.bin  int64[num_examples + 1] item offsets, is_seq only
+      <name>.token_offsets.bin  int64[num_tokens + 1] byte offsets of the
+                                utf-8 tokens in values, word_type only
+    and described in schema.json, see pdcolumnar.ColumnarDataset.
+    The dir is written next to save_dir and renamed once complete.
+    Returns the schema dict.
+    """
+    temp_dir = save_dir.rstrip(os.sep) + ".temp" + str(os.getpid())
+    os.makedirs(temp_dir)
+    try:
+        writers = [_ColumnWriter(temp_dir, list_stat) for list_stat in lists_stats]
+        if size is not None:
+            lists_iter = limit_iter(lists_iter, size)
+        num_examples = 0
+        try:
+            for lists in lists_iter:
+                for writer, t_list in zip(writers, lists):
+                    writer.append(t_list)
+                num_examples += 1
+        finally:
+            columns = [writer.close() for writer in writers]
+        schema = {
+            "version": VERSION,
+            "num_examples": num_examples,
+            "columns": columns
+        }
+        with open(os.path.join(temp_dir, SCHEMA_F_NAME), "w") as f:
+            json.dump(schema, f, indent=2)
+        if os.path.exists(save_dir):
+            shutil.rmtree(save_dir)
+        os.replace(temp_dir, save_dir)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    return schema
+
+
+class _ColumnWriter:
+    def __init__(self, save_dir, list_stat):
+        self._list_stat = list_stat
+        token_type = (list_stat.sub_list_stat or list_stat).token_type
+        self._is_word = token_type == "word_type"
+        if not self._is_word and token_type not in _DTYPES:
+            raise ValueError("not supported type " + token_type)
+        self._dtype = object if self._is_word else _DTYPES[token_type]
+        self._is_seq = list_stat.is_seq
+        self._inner_shape = None
+        self._num_items = 0
+        self._offsets = array("q", [0])
+        self._token_offsets = array("q", [0])
+        self._save_dir = save_dir
+        self._values_f = open(self._get_path("values"), "wb")
+
+    def _get_path(self, kind):
+        return os.path.join(self._save_dir, "%s.%s.bin" % (self._list_stat.name, kind))
+
+    def append(self, t_list):
+        arr = np.asarray(t_list, dtype=self._dtype)
+        if self._is_seq:
+            if arr.ndim == 0:
+                raise ValueError(self._list_stat.name + " is a seq, got a single token")
+            num_items, inner_shape = arr.shape[0], arr.shape[1:]
+        else:
+            num_items, inner_shape = 1, arr.shape
+        if num_items > 0:
+            if self._inner_shape is None:
+                self._inner_shape = inner_shape
+            elif inner_shape != self._inner_shape:
+                raise ValueError("%s shape %s doesn't match %s" % (
+                    self._list_stat.name, inner_shape, self._inner_shape))
+        if self._is_word:
+            encoded_tokens = [str(token).encode("utf-8") for token in arr.ravel()]
+            self._values_f.write(b"".join(encoded_tokens))
+            self._token_offsets.extend(itertools.islice(itertools.accumulate(
+                map(len, encoded_tokens), initial=self._token_offsets[-1]), 1, None))
+        else:
+            self._values_f.write(np.ascontiguousarray(arr).tobytes())
+        self._num_items += num_items
+        if self._is_seq:
+            self._offsets.append(self._num_items)
+
+    def close(self):
+        self._values_f.close()
+        column = self._list_stat.to_dict()
+        column["dtype"] = "utf-8" if self._is_word else np.dtype(self._dtype).str
+        column["inner_shape"] = list(self._inner_shape or ())
+        column["num_items"] = self._num_items
+        if self._is_seq:
+            with open(self._get_path("offsets"), "wb") as f:
+                self._offsets.tofile(f)
+        if self._is_word:
+            with open(self._get_path("token_offsets"), "wb") as f:
+                self._token_offsets.tofile(f)
+        return column
@@ -0,0 +1,222 @@
+"""
+TFRecord files without TensorFlow. Each record is framed as
+  uint64 length, uint32 masked crc32c of the length,
+  data, uint32 masked crc32c of the data
+(little endian). GZIP and ZLIB files are the framed records compressed as
+a single gzip / zlib stream, as tf.python_io.TFRecordWriter writes them.
+"""
+import zlib
+import struct
+import functools
+import numpy as np
+
+COMPRESSION_TYPES = ("", "GZIP", "ZLIB")
+_WBITS = {"GZIP": 16 + zlib.MAX_WBITS, "ZLIB": zlib.MAX_WBITS}
+_CRC32C_POLY = 0x82F63B78
+_MASK_DELTA = 0xa282ead8
+# the numpy crc32c splits the datas in chunks of _CHUNK_SIZE bytes, datas
+# longer than _MAX_BATCHED_LEN are done one by one
+_CHUNK_SIZE = 64
+_MAX_BATCHED_LEN = 16384
+
+
+def _create_crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ (_CRC32C_POLY if crc & 1 else 0)
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _create_crc32c_table()
+
+
+def _crc32c(data):
+    crc = 0xffffffff
+    table = _CRC32C_TABLE
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xff] ^ (crc >> 8)
+    return crc ^ 0xffffffff
+
+
+_CRC32C_NP_TABLE = np.array(_CRC32C_TABLE, dtype=np.uint32)
+
+
+@functools.lru_cache(maxsize=None)
+def _zeros_tables(num_bytes):
+    """
+    The crc register after num_bytes zero bytes is linear in the register
+    before them, as 4 x 256 tables of its bytes (see _apply_tables).
+    num_bytes is a power of 2
+    """
+    if num_bytes > 1:
+        half = _zeros_tables(num_bytes // 2)
+        return _apply_tables(half, half)
+    regs = (np.arange(256, dtype=np.uint32)[np.newaxis, :]
+            << (8 * np.arange(4, dtype=np.uint32))[:, np.newaxis])
+    return _CRC32C_NP_TABLE[regs & 0xff] ^ (regs >> 8)
+
+
+def _apply_tables(tables, regs):
+    return (tables[0][regs & 0xff] ^ tables[1][(regs >> 8) & 0xff]
+            ^ tables[2][(regs >> 16) & 0xff] ^ tables[3][regs >> 24])
+
+
+def _np_crc32cs(datas, chunk_size):
+    """
+    crc32c of datas of at least 4 bytes, vectorized over the chunks of all
+    the datas:
+      zero bytes in front of a data don't change its crc from a 0 register,
+      so each data is zero padded in front to whole chunks, and the initial
+      0xffffffff register is xored in its first 4 bytes instead
+      the chunks crcs of each data are combined pairwise,
+      crc(a + b) = zeros_tables(len(b)) applied to crc(a), xor crc(b)
+    """
+    lens = np.array([len(data) for data in datas], dtype=np.int64)
+    num_chunks = -(-lens // chunk_size)
+    pads = num_chunks * chunk_size - lens
+    zeros = bytes(chunk_size)
+    buf = bytearray(b"".join(piece for pad, data in zip(pads.tolist(), datas)
+                             for piece in (zeros[:pad], data)))
+    chunks = np.frombuffer(buf, dtype=np.uint8).reshape(-1, chunk_size)
+    first_chunks = np.cumsum(num_chunks) - num_chunks
+    starts = first_chunks * chunk_size + pads
+    chunks.reshape(-1)[starts[:, np.newaxis] + np.arange(4)] ^= 0xff
+
+    regs = np.zeros(len(chunks), dtype=np.uint32)
+    for i in range(chunk_size):
+        regs = _CRC32C_NP_TABLE[(regs ^ chunks[:, i]) & 0xff] ^ (regs >> 8)
+
+    # the chunks of each data right aligned in a row, zero registers in front
+    width = 1 << int(num_chunks.max() - 1).bit_length()
+    grid = np.zeros((len(datas), width), dtype=np.uint32)
+    rows = np.repeat(np.arange(len(datas)), num_chunks)
+    cols = (np.arange(len(chunks)) - np.repeat(first_chunks, num_chunks)
+            + np.repeat(width - num_chunks, num_chunks))
+    grid[rows, cols] = regs
+    span = chunk_size
+    while grid.shape[1] > 1:
+        grid = _apply_tables(_zeros_tables(span), grid[:, 0::2]) ^ grid[:, 1::2]
+        span *= 2
+    return (grid[:, 0] ^ 0xffffffff).tolist()
+
+
+try:
+    # C implementation
+    from crc32c import crc32c
+
+    def crc32cs(datas, chunk_size=_CHUNK_SIZE):
+        return [crc32c(data) for data in datas]
+except ImportError:
+    crc32c = _crc32c
+
+    def crc32cs(datas, chunk_size=_CHUNK_SIZE):
+        """
+        crc32c of each of datas, the pure python loop does ~3 MB/s so the
+        datas are done together with numpy. chunk_size (a power of 2) is
+        the zero padding granularity of the datas
+        """
+        crcs = [None] * len(datas)
+        batched = []
+        for i, data in enumerate(datas):
+            if len(data) < 4:
+                crcs[i] = _crc32c(data)
+            elif len(data) > _MAX_BATCHED_LEN:
+                crcs[i] = _np_crc32cs([data], chunk_size)[0]
+            else:
+                batched.append(i)
+        if batched:
+            batched_crcs = _np_crc32cs([datas[i] for i in batched], chunk_size)
+            for i, crc in zip(batched, batched_crcs):
+                crcs[i] = crc
+        return crcs
+
+
+def _mask(crc):
+    return (((crc >> 15) | (crc << 17)) + _MASK_DELTA) & 0xffffffff
+
+
+def masked_crc32c(data):
+    return _mask(crc32c(data))
+
+
+def _frame(records):
+    lengths = [struct.pack("<Q", len(record)) for record in records]
+    length_crcs = crc32cs(lengths, 8)
+    record_crcs = crc32cs(records)
+    return b"".join(piece for length, length_crc, record, record_crc
+                    in zip(lengths, length_crcs, records, record_crcs)
+                    for piece in (length, struct.pack("<I", _mask(length_crc)),
+                                  record, struct.pack("<I", _mask(record_crc))))
+
+
+class TFRecordWriter:
+    """
+    Same interface as tf.python_io.TFRecordWriter, compression_type is
+    one of COMPRESSION_TYPES. The records are framed buffer_size bytes or
+    max_buffered records at a time, so their crcs are done together
+    """
+    def __init__(self, path, compression_type="", buffer_size=1 << 20, max_buffered=4096):
+        if compression_type not in COMPRESSION_TYPES:
+            raise ValueError("not supported compression type " + compression_type)
+        self._compressor = None
+        if compression_type:
+            self._compressor = zlib.compressobj(wbits=_WBITS[compression_type])
+        self._f = open(path, "wb")
+        self._buffer_size = buffer_size
+        self._max_buffered = max_buffered
+        self._records = []
+        self._num_buffered_bytes = 0
+
+    def write(self, record):
+        self._records.append(record)
+        self._num_buffered_bytes += len(record)
+        if (self._num_buffered_bytes >= self._buffer_size
+                or len(self._records) >= self._max_buffered):
+            self.flush()
+
+    def flush(self):
+        if not self._records:
+            return
+        framed = _frame(self._records)
+        self._records = []
+        self._num_buffered_bytes = 0
+        if self._compressor is not None:
+            framed = self._compressor.compress(framed)
+        self._f.write(framed)
+
+    def close(self):
+        self.flush()
+        if self._compressor is not None:
+            self._f.write(self._compressor.flush())
+            self._compressor = None
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def iter_records(path, compression_type=""):
+    """
+    The records of a TFRecord file, the crcs are checked
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if compression_type:
+        data = zlib.decompress(data, _WBITS[compression_type])
+    pos = 0
+    while pos < len(data):
+        length, length_crc = struct.unpack_from("<QI", data, pos)
+        if length_crc != masked_crc32c(data[pos:pos + 8]):
+            raise ValueError("corrupted record length at %d in %s" % (pos, path))
+        record = data[pos + 12:pos + 12 + length]
+        (record_crc,) = struct.unpack_from("<I", data, pos + 12 + length)
+        if len(record) != length or record_crc != masked_crc32c(record):
+            raise ValueError("corrupted record at %d in %s" % (pos, path))
+        yield record
+        pos += 16 + length
@@ -1,62 +1,103 @@
-import tensorflow as tf
+import os
+import json
+import itertools
+import numpy as np
 import plp.token as ptoken
+import plp.utils.parallel as pparallel
+import plp.serializers.checkpoint as pcheckpoint
+import plp.serializers.tfrecord_writer as ptfrecord_writer
+import plp.utils.file as pfile
 from plp.utils.iterator import limit_iter
 from functools import partial
+import queue
+import threading
 import pdb
 
+_CONTEXT_TYPE, _FEATURE_LIST_TYPE = 0, 1
+# tags of the length delimited fields 1, 2 and 3, the Example and
+# SequenceExample protos are encoded directly, without TensorFlow
+_FIELD_1, _FIELD_2, _FIELD_3 = b"\x0a", b"\x12", b"\x1a"
+_UINT64_MASK = (1 << 64) - 1
+_VARINT_SHIFTS = np.arange(0, 70, 7, dtype=np.uint64)
+_VARINT_BOUNDS = np.array([1 << shift for shift in range(7, 70, 7)], dtype=np.uint64)
+_GROUP_IS = np.arange(len(_VARINT_SHIFTS))
+
+
+def _varint(value):
+    value &= _UINT64_MASK
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _varint_groups(values):
+    """
+    The int64 values as rows of 10 7-bit varint groups, continuation bits
+    set, and the number of groups used by each
+    """
+    values = np.asarray(values, dtype=np.int64).reshape(-1).view(np.uint64)
+    groups = ((values[:, None] >> _VARINT_SHIFTS) & 0x7f).astype(np.uint8)
+    lens = 1 + (values[:, None] >= _VARINT_BOUNDS).sum(axis=1)
+    groups[_GROUP_IS < lens[:, None] - 1] |= 0x80
+    return groups, lens
+
+
+def _varints(values):
+    groups, lens = _varint_groups(values)
+    return groups[_GROUP_IS < lens[:, None]].tobytes()
+
+
+def _int64_feature_list(values):
+    """
+    Same as _feature_list(values, _int64_feature), each feature being
+    0x0a n+4 0x1a n+2 0x0a n <n varint bytes>
+    """
+    groups, lens = _varint_groups(values)
+    rows = np.empty((len(lens), 6 + len(_GROUP_IS)), dtype=np.uint8)
+    rows[:, 0], rows[:, 2], rows[:, 4] = _FIELD_1[0], _FIELD_3[0], _FIELD_1[0]
+    rows[:, 1], rows[:, 3], rows[:, 5] = lens + 4, lens + 2, lens
+    rows[:, 6:] = groups
+    return rows[np.arange(rows.shape[1]) < lens[:, None] + 6].tobytes()
+
+
+def _field(tag, payload):
+    return tag + _varint(len(payload)) + payload
+
+
+def _packed_field(payload):
+    # empty packed fields aren't written
+    return _field(_FIELD_1, payload) if payload else b""
+
 
 def _bytes_feature(value):
-    return tf.train.Feature(
-        bytes_list=tf.train.BytesList(
-            value=[value.encode()]
-        )
-    )
+    return _field(_FIELD_1, _field(_FIELD_1, value.encode()))
 
 
 def _bytes_features(values):
-    return tf.train.Feature(
-        bytes_list=tf.train.BytesList(
-            value=[value.encode() for value in values]
-        )
-    )
+    return _field(_FIELD_1, b"".join(_field(_FIELD_1, value.encode()) for value in values))
 
 
 def _int64_feature(value):
-    return tf.train.Feature(
-        int64_list=tf.train.Int64List(
-            value=[value]
-        )
-    )
+    return _field(_FIELD_3, _field(_FIELD_1, _varint(int(value))))
 
 
 def _int64_features(values):
-    return tf.train.Feature(
-        int64_list=tf.train.Int64List(
-            value=values
-        )
-    )
+    return _field(_FIELD_3, _packed_field(_varints(values)))
 
 
 def _float64_feature(value):
-    return tf.train.Feature(
-        float_list=tf.train.FloatList(
-            value=[value]
-        )
-    )
+    return _field(_FIELD_2, _field(_FIELD_1, np.float32(value).tobytes()))
 
 
 def _float64_features(values):
-    return tf.train.Feature(
-        float_list=tf.train.FloatList(
-            value=values
-        )
-    )
+    return _field(_FIELD_2, _packed_field(np.asarray(values, dtype="<f4").tobytes()))
 
 
 def _feature_list(value_list, feature_func):
-    return tf.train.FeatureList(
-        feature=[feature_func(v) for v in value_list]
-    )
+    return b"".join(_field(_FIELD_1, feature_func(v)) for v in value_list)
 
 
 def _feature_dict(
@@ -99,50 +140,319 @@ def _feature_lists_dict(
     return feature_dict
 
 
+def _map(feature_dict):
+    # entries sorted by key, as TF's deterministic serialization writes them
+    return b"".join(_field(_FIELD_1, _field(_FIELD_1, key.encode()) + _field(_FIELD_2, val))
+                    for key, val in sorted(feature_dict.items()))
+
+
 def make_example(feature_dict):
-    ex = tf.train.Example(
-        features=tf.train.Features(
-            features=feature_dict
-        )
-    )
-    return ex
+    """
+    Serialized tf.train.Example
+    """
+    return _field(_FIELD_1, _map(feature_dict))
 
 
 def make_sequence_example(context_feature_dict, feature_list_dict):
-    ex = tf.train.SequenceExample(
-        context=tf.train.Features(
-            feature=context_feature_dict
-        ),
-        feature_lists=tf.train.FeatureLists(
-            feature_list=feature_list_dict
-        )
-    )
-    return ex
+    """
+    Serialized tf.train.SequenceExample
+    """
+    return _field(_FIELD_1, _map(context_feature_dict)) + \
+        _field(_FIELD_2, _map(feature_list_dict))
 
 
-def docs_transformed_save(doc_transform_state, save_path):
+def docs_transformed_save(doc_transform_state, save_path, compression_type=None):
     iterator = doc_transform_state.transformer.transform_docs(
         *doc_transform_state.docs
     )
     lists_stats = doc_transform_state.transformer.get_lists_stats(
         *doc_transform_state.docs
     )
-    _transformed_save(iterator, lists_stats, save_path, doc_transform_state.size)
+    _transformed_save(iterator, lists_stats, save_path, doc_transform_state.size,
+                      compression_type)
 
 
-def seq_docs_transformed_save(doc_transform_state, save_path):
+def seq_docs_transformed_save(doc_transform_state, save_path, compression_type=None):
     iterator = doc_transform_state.transformer.transform_seq_docs(
         *doc_transform_state.docs
     )
     lists_stats = doc_transform_state.transformer.get_lists_stats(
         *doc_transform_state.docs
     )
-    _transformed_save(iterator, lists_stats, save_path, doc_transform_state.size)
+    _transformed_save(iterator, lists_stats, save_path, doc_transform_state.size,
+                      compression_type)
+
+
+def docs_transformed_save_sharded(doc_transform_state, save_prefix, num_workers=None,
+                                  max_shard_records=None, max_shard_bytes=None,
+                                  compression_type=None):
+    """
+    See _transformed_save_sharded
+    """
+    return _transformed_save_sharded(
+        doc_transform_state, lambda transformer, docs: transformer.transform_docs(*docs),
+        save_prefix, num_workers, max_shard_records, max_shard_bytes, compression_type)
+
+
+def seq_docs_transformed_save_sharded(doc_transform_state, save_prefix, num_workers=None,
+                                      max_shard_records=None, max_shard_bytes=None,
+                                      compression_type=None):
+    return _transformed_save_sharded(
+        doc_transform_state, lambda transformer, docs: transformer.transform_seq_docs(*docs),
+        save_prefix, num_workers, max_shard_records, max_shard_bytes, compression_type)
+
+
+def get_manifest_path(save_prefix):
+    return save_prefix + ".manifest.json"
+
+
+def read_manifest(manifest_path):
+    """
+    manifest dict of a sharded save, with the shard paths made relative to
+    the current dir
+    """
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest_dir = os.path.dirname(manifest_path)
+    for shard in manifest["shards"]:
+        shard["path"] = os.path.join(manifest_dir, shard["path"])
+    return manifest
+
+
+def _transformed_save_sharded(doc_transform_state, transform_f, save_prefix, num_workers,
+                              max_shard_records, max_shard_bytes, compression_type):
+    """
+    The docs are split into num_workers contiguous parts, each transformed
+    and written by a forked worker, rolling over to a new shard after
+    max_shard_records records or max_shard_bytes (uncompressed) bytes.
+    size, if given, caps each part, then only the first size records in doc
+    order are kept, as in the single file save.
+    Shards are named save_prefix-00000-of-00032 and listed, with their
+    record counts, byte sizes and the lists stats, in the json manifest at
+    get_manifest_path(save_prefix). Returns the manifest dict.
+    """
+    docs = doc_transform_state.docs
+    transformer = doc_transform_state.transformer
+    lists_stats = transformer.get_lists_stats(*docs)
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    num_parts = max(min(num_workers, len(docs)), 1)
+    part_bounds = [len(docs) * i // num_parts for i in range(num_parts + 1)]
+
+    def save_part(part_i):
+        part_docs = docs[part_bounds[part_i]:part_bounds[part_i + 1]]
+        lists_iter = transform_f(transformer, part_docs) if part_docs else iter(())
+        if doc_transform_state.size is not None:
+            lists_iter = itertools.islice(lists_iter, doc_transform_state.size)
+        return _save_shards(lists_iter, lists_stats, "%s-part%05d" % (save_prefix, part_i),
+                            None, max_shard_records, max_shard_bytes, compression_type)
+
+    # docs aren't picklable, forked workers get them by part index
+    temp_shards = [shard for part_shards in pparallel.ordered_bounded_map(
+        save_part, range(num_parts), num_workers) for shard in part_shards]
+    if doc_transform_state.size is not None:
+        temp_shards = _trim_shards(temp_shards, doc_transform_state.size, compression_type)
+    shards = []
+    for i, (temp_path, num_records, num_bytes) in enumerate(temp_shards):
+        shard_path = "%s-%05d-of-%05d" % (save_prefix, i, len(temp_shards))
+        os.replace(temp_path, shard_path)
+        shards.append({"path": os.path.basename(shard_path),
+                       "num_records": num_records, "num_bytes": num_bytes})
+    return _write_manifest(save_prefix, shards, lists_stats, compression_type)
 
 
-def _transformed_save(lists_iter, lists_stats, save_path, size):
+def docs_transformed_save_resumable(doc_transform_state, save_prefix, docs_per_shard,
+                                    checkpoint_path=None, compression_type=None):
+    """
+    See _transformed_save_resumable
+    """
+    return _transformed_save_resumable(
+        doc_transform_state, lambda transformer, docs: transformer.transform_docs(*docs),
+        save_prefix, docs_per_shard, checkpoint_path, compression_type)
+
+
+def seq_docs_transformed_save_resumable(doc_transform_state, save_prefix, docs_per_shard,
+                                        checkpoint_path=None, compression_type=None):
+    return _transformed_save_resumable(
+        doc_transform_state, lambda transformer, docs: transformer.transform_seq_docs(*docs),
+        save_prefix, docs_per_shard, checkpoint_path, compression_type)
+
+
+def _transformed_save_resumable(doc_transform_state, transform_f, save_prefix,
+                                docs_per_shard, checkpoint_path, compression_type):
+    """
+    Every docs_per_shard docs are transformed on their own and saved as the
+    shard save_prefix-00003, renamed in place once complete. Completed
+    shards are recorded in checkpoint_path (default save_prefix.checkpoint.json)
+    and skipped on a restart. The manifest is written once all are done.
+    """
+    docs = doc_transform_state.docs
+    transformer = doc_transform_state.transformer
+    lists_stats = transformer.get_lists_stats(*docs)
+    if checkpoint_path is None:
+        checkpoint_path = save_prefix + ".checkpoint.json"
+
+    def save_shard(shard_i, shard_docs, size):
+        shard_path = "%s-%05d" % (save_prefix, shard_i)
+        shards = _save_shards(transform_f(transformer, shard_docs), lists_stats,
+                              shard_path, size, None, None, compression_type)
+        if not shards:
+            return [], 0
+        (temp_path, num_records, _), = shards
+        os.replace(temp_path, shard_path)
+        return [shard_path], num_records
+
+    completed_shards = pcheckpoint.resumable_save(
+        docs, save_shard, checkpoint_path, docs_per_shard, doc_transform_state.size)
+    shards = [{"path": os.path.basename(shard_path), "num_records": shard["num_records"],
+               "num_bytes": os.path.getsize(shard_path)}
+              for shard in completed_shards for shard_path in shard["paths"]]
+    return _write_manifest(save_prefix, shards, lists_stats, compression_type)
+
+
+def _write_manifest(save_prefix, shards, lists_stats, compression_type):
+    manifest = {
+        "compression_type": compression_type or "",
+        "num_records": sum(shard["num_records"] for shard in shards),
+        "num_bytes": sum(shard["num_bytes"] for shard in shards),
+        "shards": shards,
+        "lists_stats": [list_stat.to_dict() for list_stat in lists_stats]
+    }
+    manifest_path = get_manifest_path(save_prefix)
+    with open(manifest_path + ".temp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".temp", manifest_path)
+    return manifest
+
+
+def _trim_shards(shards, size, compression_type):
+    """
+    Keeps the first size records of the (path, num_records, num_bytes)
+    shards: the shards past them are removed, the one crossing size is
+    rewritten with its first records
+    """
+    trimmed_shards = []
+    num_left = size
+    for shard_path, num_records, num_bytes in shards:
+        if num_left == 0:
+            os.remove(shard_path)
+            continue
+        if num_records > num_left:
+            records = ptfrecord_writer.iter_records(shard_path, compression_type or "")
+            with _create_writer(shard_path + ".trim", compression_type) as writer:
+                for record in itertools.islice(records, num_left):
+                    writer.write(record)
+            os.replace(shard_path + ".trim", shard_path)
+            num_records = num_left
+        trimmed_shards.append((shard_path, num_records, os.path.getsize(shard_path)))
+        num_left -= num_records
+    return trimmed_shards
+
+
+def _save_shards(lists_iter, lists_stats, temp_prefix, size,
+                 max_shard_records, max_shard_bytes, compression_type):
+    feature_fs = _create_feature_fs(lists_stats)
+    if size is not None:
+        lists_iter = limit_iter(lists_iter, size)
+    shards = []
+    writer = None
+    for lists in lists_iter:
+        if writer is not None and (
+                (max_shard_records is not None and num_records >= max_shard_records) or
+                (max_shard_bytes is not None and num_bytes >= max_shard_bytes)):
+            writer.close()
+            shards.append((shard_path, num_records, os.path.getsize(shard_path)))
+            writer = None
+        if writer is None:
+            shard_path = "%s-%05d.temp" % (temp_prefix, len(shards))
+            writer = _create_writer(shard_path, compression_type)
+            num_records, num_bytes = 0, 0
+        record = _serialize_lists(lists, feature_fs)
+        writer.write(record)
+        num_records += 1
+        # length, length crc, data, data crc
+        num_bytes += len(record) + 16
+    if writer is not None:
+        writer.close()
+        shards.append((shard_path, num_records, os.path.getsize(shard_path)))
+    return shards
+
+
+def _create_writer(save_path, compression_type):
+    """
+    compression_type: GZIP or ZLIB, the records are then written and
+    compressed on a background thread
+    """
+    writer = ptfrecord_writer.TFRecordWriter(save_path, compression_type or "")
+    if not compression_type:
+        return writer
+    return _BackgroundRecordWriter(writer)
+
+
+class _BackgroundRecordWriter:
+    def __init__(self, writer, max_pending=1024):
+        self._writer = writer
+        self._error = None
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(record)
+
+    def _write_loop(self):
+        record = None
+        try:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                self._writer.write(record)
+        except Exception as e:
+            self._error = e
+            while record is not None:
+                record = self._queue.get()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _serialize_lists(lists, feature_fs):
+    context_feature_dict, feature_lists_dict = {}, {}
+    for t_list, feature_f_tuple in zip(lists, feature_fs):
+        if feature_f_tuple[1] == _CONTEXT_TYPE:
+            context_feature_dict[feature_f_tuple[2]] = feature_f_tuple[0](t_list)
+        else:
+            feature_lists_dict[feature_f_tuple[2]] = feature_f_tuple[0](t_list)
+    return make_sequence_example(context_feature_dict, feature_lists_dict)
+
+
+def _transformed_save(lists_iter, lists_stats, save_path, size, compression_type=None):
+    feature_fs = _create_feature_fs(lists_stats)
+    if compression_type is None:
+        compression_type = pfile.get_tfrecords_compression_type(save_path)
+    with _create_writer(save_path, compression_type) as writer:
+        if size is not None:
+            lists_iter = limit_iter(lists_iter, size)
+        for lists in lists_iter:
+            writer.write(_serialize_lists(lists, feature_fs))
+
+
+def _create_feature_fs(lists_stats):
     feature_fs = []
-    context_type, feature_list_type = 0, 1
+    context_type, feature_list_type = _CONTEXT_TYPE, _FEATURE_LIST_TYPE
     for list_stat in lists_stats:
         token_type = list_stat.token_type
         if token_type == "list_type":
@@ -164,7 +474,7 @@ def _transformed_save(lists_iter, lists_stats, save_path, size):
                 if token_type == "word_type":
                     feature_f = partial(_feature_list, feature_func=_bytes_feature)
                 elif token_type == "id_type" or token_type == "value_int_type":
-                    feature_f = partial(_feature_list, feature_func=_int64_feature)
+                    feature_f = _int64_feature_list
                 elif token_type == "value_float_type":
                     feature_f = partial(_feature_list, feature_func=_float64_features)
                 else:
@@ -189,16 +499,4 @@ def _transformed_save(lists_iter, lists_stats, save_path, size):
                         feature_fs.append((_float64_feature, context_type, list_stat.name))
                     else:
                         raise ValueError("not supported")
-
-    with tf.python_io.TFRecordWriter(save_path) as writer:
-        if size is not None:
-            lists_iter = limit_iter(lists_iter, size)
-        for lists in lists_iter:
-            context_feature_dict, feature_lists_dict = {}, {}
-            for t_list, feature_f_tuple in zip(lists, feature_fs):
-                if feature_f_tuple[1] == context_type:
-                    context_feature_dict[feature_f_tuple[2]] = feature_f_tuple[0](t_list)
-                else:
-                    feature_lists_dict[feature_f_tuple[2]] = feature_f_tuple[0](t_list)
-            seq_ex = make_sequence_example(context_feature_dict, feature_lists_dict)
-            writer.write(seq_ex.SerializeToString())
+    return feature_fs
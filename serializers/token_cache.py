@@ -0,0 +1,188 @@
+import os
+import json
+import hashlib
+from array import array
+import numpy as np
+import plp.serializers.txt as ptxt
+from plp.utils.file import open_read
+
+CACHE_VERSION = 1
+
+
+##############
+# Gen module #
+##############
+
+
+def doc_gen_f_cached(doc_path, token_type, gen_eol_type,
+                     isolating_tokens=None, cache_dir=None):
+    """
+    Same tokens as ptxt.doc_gen_f_*, but the txt file is only parsed once.
+    Subsequent iterations stream from the memory-mapped id array.
+    """
+    eol = ptxt.get_eol(token_type, gen_eol_type)
+
+    def doc_gen():
+        token_cache = TokenCache.load_or_build(
+            doc_path, gen_eol_type, isolating_tokens, cache_dir)
+        for tokens in token_cache.iter_lines():
+            for token in tokens:
+                yield token
+            if eol is not None:
+                yield eol
+    return doc_gen
+
+
+def doc_chunk_gen_f_cached(doc_path, token_type, gen_eol_type,
+                           isolating_tokens=None, cache_dir=None):
+    eol = ptxt.get_eol(token_type, gen_eol_type)
+
+    def chunk_gen(chunk_size):
+        token_cache = TokenCache.load_or_build(
+            doc_path, gen_eol_type, isolating_tokens, cache_dir)
+        chunk = []
+        for tokens in token_cache.iter_lines(block_size=max(chunk_size, 1024)):
+            chunk.extend(tokens)
+            if eol is not None:
+                chunk.append(eol)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    return chunk_gen
+
+
+################
+# Cache module #
+################
+
+
+class TokenCache:
+    """
+    On disk: <prefix>.meta.json  (validation key + interned token table)
+             <prefix>.ids.npy    (int32 token ids of the whole doc)
+             <prefix>.lines.npy  (int64 line offsets into ids, n_lines+1)
+    """
+    @classmethod
+    def load_or_build(cls, doc_path, gen_eol_type,
+                      isolating_tokens=None, cache_dir=None):
+        prefix = cache_prefix(doc_path, cache_dir)
+        key = cache_key(doc_path, gen_eol_type, isolating_tokens)
+        token_cache = cls.load(prefix, key)
+        if token_cache is None:
+            build_token_cache(doc_path, prefix, key, isolating_tokens)
+            token_cache = cls.load(prefix, key)
+        return token_cache
+
+    @classmethod
+    def load(cls, prefix, key):
+        meta_path = prefix + ".meta.json"
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("key") != key:
+            return None
+        try:
+            ids = np.load(prefix + ".ids.npy", mmap_mode="r")
+            line_offsets = np.load(prefix + ".lines.npy", mmap_mode="r")
+        except (IOError, ValueError):
+            return None
+        return cls(meta["tokens"], ids, line_offsets)
+
+    def __init__(self, tokens, ids, line_offsets):
+        self._tokens = tokens
+        self._ids = ids
+        self._line_offsets = line_offsets
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    @property
+    def num_lines(self):
+        return len(self._line_offsets) - 1
+
+    def __len__(self):
+        return len(self._ids)
+
+    def iter_lines(self, block_size=65536):
+        """
+        Yields the token list of each line, decoding ~block_size ids at a time
+        """
+        table = self._tokens
+        offsets = self._line_offsets
+        num_lines = self.num_lines
+        line_i = 0
+        while line_i < num_lines:
+            start = int(offsets[line_i])
+            line_j = int(np.searchsorted(offsets, start + block_size, side="right")) - 1
+            line_j = min(max(line_j, line_i + 1), num_lines)
+            block_offsets = [offset - start for offset in offsets[line_i:line_j + 1].tolist()]
+            block = [table[i] for i in self._ids[start:start + block_offsets[-1]].tolist()]
+            for k in range(len(block_offsets) - 1):
+                yield block[block_offsets[k]:block_offsets[k + 1]]
+            line_i = line_j
+
+
+def cache_prefix(doc_path, cache_dir=None):
+    abs_path = os.path.abspath(doc_path)
+    if cache_dir is None:
+        cache_dir = os.path.dirname(abs_path)
+    path_hash = hashlib.sha1(abs_path.encode()).hexdigest()[:16]
+    return os.path.join(
+        cache_dir, os.path.basename(abs_path) + "." + path_hash + ".tokcache")
+
+
+def cache_key(doc_path, gen_eol_type, isolating_tokens=None):
+    stat = os.stat(doc_path)
+    return {
+        "version": CACHE_VERSION,
+        "path": os.path.abspath(doc_path),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "gen_eol_type": gen_eol_type,
+        "isolating_tokens": list(isolating_tokens) if isolating_tokens else None
+    }
+
+
+def build_token_cache(doc_path, prefix, key, isolating_tokens=None):
+    cache_dir = os.path.dirname(prefix)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    token2id = {}
+    tokens = []
+    ids = array("i")
+    line_offsets = array("q", [0])
+    with open_read(doc_path) as f:
+        for line in f:
+            for token in ptxt.split_line_tokens(line, isolating_tokens):
+                token_id = token2id.get(token)
+                if token_id is None:
+                    token_id = len(tokens)
+                    token2id[token] = token_id
+                    tokens.append(token)
+                ids.append(token_id)
+            line_offsets.append(len(ids))
+
+    # meta is renamed last, it is what marks the cache as complete
+    temp_suffix = ".temp" + str(os.getpid())
+    _save_npy(prefix + ".ids.npy" + temp_suffix, _to_np(ids, np.int32))
+    _save_npy(prefix + ".lines.npy" + temp_suffix, _to_np(line_offsets, np.int64))
+    with open(prefix + ".meta.json" + temp_suffix, "w") as f:
+        json.dump({"key": key, "tokens": tokens}, f)
+    for suffix in (".ids.npy", ".lines.npy", ".meta.json"):
+        os.replace(prefix + suffix + temp_suffix, prefix + suffix)
+
+
+def _to_np(typed_array, dtype):
+    if len(typed_array) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.frombuffer(typed_array, dtype=dtype)
+
+
+def _save_npy(path, arr):
+    # through a file object so np.save doesn't append ".npy" to the temp name
+    with open(path, "wb") as f:
+        np.save(f, arr, allow_pickle=False)
@@ -1,6 +1,12 @@
 import plp.token as ptoken
 import plp.vocab as pvocab
-from plp.utils.file import MultiWriteOpen
+import os
+import itertools
+import functools
+import numpy as np
+import plp.serializers.checkpoint as pcheckpoint
+from plp.utils.file import MultiWriteOpen, AtomicWriteOpen, extend_path_basename, \
+    open_read, open_write
 from plp.utils.iterator import limit_iter
 import pdb
 
@@ -9,6 +15,10 @@ import pdb
 # GEN_KEEP_EOL_NL = "gen_keep_eol_nl" # "\n" will be preserved & iterated
                                     # However, it is "flag_token"
 
+DOC_TOKEN_TYPES = ("word_type", "id_type", "embed_type")
+# items per block of the save functions, each block is a single write per file
+WRITE_BLOCK_SIZE = 4096
+
 ##############
 # Gen module #
 ##############
@@ -42,7 +52,7 @@ def doc_gen_f_split_eol(doc_path, token_type, isolating_token=None):
             if token == "":
                 continue
             yield convert_f(token)
-    with open(doc_path) as f:
+    with open_read(doc_path) as f:
         gen_fs = [gen_f(line) for line in f]
     return gen_fs
 
@@ -51,23 +61,67 @@ def _doc_gen_f(doc_path, token_type, eol=None, isolating_tokens=None):
     def doc_gen():
         # token type check?
         convert_f = get_convert_f(token_type)
-        with open(doc_path) as f:
+        with open_read(doc_path) as f:
             for line in f:
-                if isolating_tokens:
-                    for isolating_token in isolating_tokens:
-                        # slow, not efficient here for now :(
-                        line = line.replace(isolating_token, " " + isolating_token + " ")
-                tokens = line.strip().split(" ")
+                tokens = split_line_tokens(line, isolating_tokens)
                 for token in tokens:
-                    if token == "":
-                        continue
                     yield convert_f(token)
                 # Handle the end of line if the doc is language based
-                if (eol is not None) and len(tokens) > 0:
+                if eol is not None:
                     yield eol
     return doc_gen
 
 
+def doc_chunk_gen_f(doc_path, token_type, gen_eol_type, isolating_tokens=None):
+    """
+    Chunked counterpart of doc_gen_f_*: chunk_gen(chunk_size) yields lists of
+    at least chunk_size tokens (except the last one), split at line ends
+    """
+    eol = get_eol(token_type, gen_eol_type)
+
+    def chunk_gen(chunk_size):
+        convert_f = None if token_type in DOC_TOKEN_TYPES else get_convert_f(token_type)
+        chunk = []
+        with open_read(doc_path) as f:
+            for line in f:
+                tokens = split_line_tokens(line, isolating_tokens)
+                if convert_f is not None:
+                    tokens = [convert_f(token) for token in tokens]
+                chunk.extend(tokens)
+                if eol is not None:
+                    chunk.append(eol)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+    return chunk_gen
+
+
+def get_eol(token_type, gen_eol_type):
+    if gen_eol_type == "yield_eol":
+        if token_type == "word_type":
+            return pvocab.EOS
+        elif token_type == "id_type":
+            return pvocab.EOS_ID
+        else:
+            raise NotImplementedError("Not supported token type")
+    elif gen_eol_type == "ignore_eol":
+        return None
+    elif gen_eol_type == "keep_eol_nl":
+        return "\n"
+    else:
+        raise ValueError("Non existing end of line type")
+
+
+def split_line_tokens(line, isolating_tokens=None):
+    if isolating_tokens:
+        for isolating_token in isolating_tokens:
+            # slow, not efficient here for now :(
+            line = line.replace(isolating_token, " " + isolating_token + " ")
+    return [token for token in line.strip().split(" ") if token != ""]
+
+
 def get_convert_f(token_type):
     if token_type == "value_int_type" or \
        token_type == "value_id_type":
@@ -83,88 +137,185 @@ def get_convert_f(token_type):
 ###############
 
 
-def doc_save(doc_path, doc_iter):
-    with open(doc_path, "w") as f:
-        for token in doc_iter:
-            f.write(token)
-            if token != "\n":
-                f.write(" ")
+def doc_save(doc_path, doc_iter, compression=None):
+    doc_save_chunks(doc_path, _iter_blocks(doc_iter), compression)
 
 
-def doc_save_by_line(doc_path, doc_iter, num_tokens_per_line, token_type):
-    with open(doc_path, "w") as f:
-        for i, token in enumerate(doc_iter):
-            if token == "\n":
-                if token_type == ptoken.WORD_TYPE:
-                    f.write(pvocab.EOS)
-                elif token_type == ptoken.ID_TYPE:
-                    f.write(pvocab.EOS_ID)
-                else:
-                    raise ValueError("No such token type")
-            else:
-                f.write(token)
-            f.write(" ")
-            if i % num_tokens_per_line == 0:
-                f.write("\n")
-
-
-def seq_doc_save(seq_path, flag_path, seq_flag_iter):
-    with open(seq_path, "w") as seq_f, open(flag_path, "w") as flag_f:
-        for seq, flag in seq_flag_iter:
-            seq_f.write(" ".join([str(token) for token in seq]))
-            seq_f.write("\n")
-            if type(flag) == tuple:
-                print(seq, flag)
-            if flag == "\n":
-                flag_f.write("\\n")
-            elif flag == "\t":
-                flag_f.write("\\t")
-            else:
-                flag_f.write(flag)
-            flag_f.write("\n")
-
-
-def docs_transformed_save(doc_transform_state, save_paths):
+def doc_save_chunks(doc_path, chunk_iter, compression=None):
+    with open_write(doc_path, compression) as f:
+        for chunk in chunk_iter:
+            if chunk:
+                # each token followed by a space, except the "\n" flag tokens
+                f.write((" ".join(chunk) + " ").replace("\n ", "\n"))
+
+
+def doc_save_by_line(doc_path, doc_iter, num_tokens_per_line, token_type, compression=None):
+    if token_type == "word_type":
+        eos = pvocab.EOS
+    elif token_type == "id_type":
+        eos = str(pvocab.EOS_ID)
+    else:
+        raise ValueError("No such token type")
+    with open_write(doc_path, compression) as f:
+        i = 0
+        for block in _iter_blocks(doc_iter):
+            pieces = []
+            for token in block:
+                pieces.append(eos if token == "\n" else str(token))
+                pieces.append(" \n" if i % num_tokens_per_line == 0 else " ")
+                i += 1
+            f.write("".join(pieces))
+
+
+def seq_doc_save(seq_path, flag_path, seq_flag_iter, compression=None):
+    escaped_flags = {"\n": "\\n", "\t": "\\t"}
+    with open_write(seq_path, compression) as seq_f, \
+            open_write(flag_path, compression) as flag_f:
+        for block in _iter_blocks(seq_flag_iter):
+            seq_lines, flag_lines = [], []
+            for seq, flag in block:
+                seq_lines.append(_format_tokens(seq))
+                flag_lines.append(escaped_flags.get(flag, flag))
+            seq_f.write("\n".join(seq_lines) + "\n")
+            flag_f.write("\n".join(flag_lines) + "\n")
+
+
+def _iter_blocks(items, block_size=WRITE_BLOCK_SIZE):
+    items = iter(items)
+    while True:
+        block = list(itertools.islice(items, block_size))
+        if not block:
+            return
+        yield block
+
+
+def _format_tokens(tokens, is_int=False):
+    """
+    Space separated tokens, a non float numpy array is converted by a single
+    tolist, int tokens by a single %d format of the whole list, a single
+    token is kept whole. Float arrays are formatted per numpy scalar, str of
+    a python float would print float32 values at float64 precision
+    """
+    if isinstance(tokens, (str, int, float, np.generic)):
+        return str(tokens)
+    if isinstance(tokens, np.ndarray) and tokens.dtype.kind != "f":
+        tokens = tokens.tolist()
+    if is_int:
+        try:
+            return _get_int_format(len(tokens)) % tuple(tokens)
+        except TypeError:
+            # flag tokens in id lists
+            pass
+    return " ".join(map(str, tokens))
+
+
+@functools.lru_cache(maxsize=256)
+def _get_int_format(num_tokens):
+    return " ".join(["%d"] * num_tokens)
+
+
+def docs_transformed_save(doc_transform_state, save_paths, compression=None):
     iterator = doc_transform_state.transformer.transform_docs(
         *doc_transform_state.docs
     )
     lists_stats = doc_transform_state.transformer.get_lists_stats(
         *doc_transform_state.docs
     )
-    _transformed_save(iterator, lists_stats, save_paths, doc_transform_state.size)
+    _transformed_save(iterator, lists_stats, save_paths, doc_transform_state.size,
+                      compression)
 
 
-def seq_docs_transformed_save(doc_transform_state, save_paths):
+def seq_docs_transformed_save(doc_transform_state, save_paths, compression=None):
     iterator = doc_transform_state.transformer.transform_seq_docs(
         *doc_transform_state.docs
     )
     lists_stats = doc_transform_state.transformer.get_lists_stats(
         *doc_transform_state.docs
     )
-    _transformed_save(iterator, lists_stats, save_paths, doc_transform_state.size)
+    _transformed_save(iterator, lists_stats, save_paths, doc_transform_state.size,
+                      compression)
+
+
+def docs_transformed_save_resumable(doc_transform_state, save_paths, docs_per_shard,
+                                    checkpoint_path=None, compression=None):
+    """
+    See _transformed_save_resumable
+    """
+    return _transformed_save_resumable(
+        doc_transform_state, lambda transformer, docs: transformer.transform_docs(*docs),
+        save_paths, docs_per_shard, checkpoint_path, compression)
+
 
+def seq_docs_transformed_save_resumable(doc_transform_state, save_paths, docs_per_shard,
+                                        checkpoint_path=None, compression=None):
+    return _transformed_save_resumable(
+        doc_transform_state, lambda transformer, docs: transformer.transform_seq_docs(*docs),
+        save_paths, docs_per_shard, checkpoint_path, compression)
 
-def _transformed_save(lists_iter, lists_stats, save_paths, size):
+
+def _transformed_save_resumable(doc_transform_state, transform_f, save_paths, docs_per_shard,
+                                checkpoint_path, compression):
+    """
+    Every docs_per_shard docs are transformed on their own and saved as
+    shard files, e.g. question.txt -> question_00003.txt, renamed in place
+    once complete. Completed shards are recorded in checkpoint_path
+    (default next to save_paths[0]) and skipped on a restart.
+    Returns the completed shard entries, see pcheckpoint.resumable_save
+    """
+    docs = doc_transform_state.docs
+    transformer = doc_transform_state.transformer
+    lists_stats = transformer.get_lists_stats(*docs)
     if len(lists_stats) != len(save_paths):
         raise ValueError("seq gen num should match num of save paths")
-    with MultiWriteOpen(*save_paths) as fs:
-        for lists in limit_iter(lists_iter, size):
-            for f, (t_list, list_stat) in zip(fs, zip(lists, lists_stats)):
-                token_type = list_stat.token_type
-                if token_type == ptoken.LIST_TYPE:
-                    for sub_list in t_list:
-                        if list_stat.sub_list_stat.token_type == ptoken.LIST_TYPE:
-                            raise ValueError("Not supported")
-                        else:
-                            if list_stat.sub_list_stat.token_type == ptoken.WORD_TYPE:
-                                f.write(" ".join(sub_list))
-                            else:
-                                f.write(" ".join([str(token) for token in sub_list]))
-
-                        f.write("\t")
+    if checkpoint_path is None:
+        checkpoint_path = os.path.splitext(save_paths[0])[0] + ".checkpoint.json"
+
+    def save_shard(shard_i, shard_docs, size):
+        shard_paths = [extend_path_basename(save_path, "%05d" % shard_i)
+                       for save_path in save_paths]
+        lists_iter = transform_f(transformer, shard_docs)
+        if size is not None:
+            lists_iter = limit_iter(lists_iter, size)
+        with AtomicWriteOpen(*shard_paths, compression=compression) as fs:
+            num_records = _write_lists(fs, lists_iter, lists_stats)
+        return shard_paths, num_records
+
+    return pcheckpoint.resumable_save(
+        docs, save_shard, checkpoint_path, docs_per_shard, doc_transform_state.size)
+
+
+def _transformed_save(lists_iter, lists_stats, save_paths, size, compression=None):
+    if len(lists_stats) != len(save_paths):
+        raise ValueError("seq gen num should match num of save paths")
+    if size is not None:
+        lists_iter = limit_iter(lists_iter, size)
+    with MultiWriteOpen(*save_paths, compression=compression) as fs:
+        _write_lists(fs, lists_iter, lists_stats)
+
+
+def _write_lists(fs, lists_iter, lists_stats):
+    """
+    Lines are formatted per block of lists and written with one write per
+    file and block
+    """
+    num_lists = 0
+    for sub_list_stat in (list_stat.sub_list_stat for list_stat in lists_stats):
+        if sub_list_stat is not None and sub_list_stat.token_type == "list_type":
+            raise ValueError("Not supported")
+    is_list_types = [list_stat.token_type == "list_type" for list_stat in lists_stats]
+    is_ints = [(list_stat.sub_list_stat or list_stat).token_type in ("id_type", "value_int_type")
+               for list_stat in lists_stats]
+    for block in _iter_blocks(lists_iter):
+        lines = [[] for _ in fs]
+        for lists in block:
+            for f_lines, t_list, is_list_type, is_int in zip(
+                    lines, lists, is_list_types, is_ints):
+                if is_list_type:
+                    f_lines.append("".join([_format_tokens(sub_list, is_int) + "\t"
+                                            for sub_list in t_list]))
                 else:
-                    if token_type == ptoken.WORD_TYPE:
-                        f.write(" ".join(t_list))
-                    else:
-                        f.write(" ".join([str(token) for token in t_list]))
-                f.write("\n")
+                    f_lines.append(_format_tokens(t_list, is_int))
+        for f, f_lines in zip(fs, lines):
+            f.write("\n".join(f_lines) + "\n")
+        num_lists += len(block)
+    return num_lists
@@ -0,0 +1,164 @@
+import os
+import mmap
+import zlib
+import struct
+from array import array
+
+MAGIC = b"PLPVOCAB"
+VERSION = 1
+# magic, version, vocab_size, num_slots, has_counts, blob_size
+_HEADER = struct.Struct("<8sIIIIQ")
+_EMPTY_SLOT = -1
+
+
+def is_binary_vocab(vocab_f_path):
+    with open(vocab_f_path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def compile_vocab(vocab_f_path, out_bin_f_path, count_f_path=None):
+    """
+    Converts vocab (and count) txt files into a single binary vocab file:
+      header | offsets int64[n+1] | counts int64[n] | slots int32[num_slots] | blob
+    blob is the utf-8 words back to back, slots is an open addressing
+    (crc32, linear probing) word -> id table over the blob.
+    """
+    with open(vocab_f_path) as f:
+        words = f.read().strip().split()
+    counts = None
+    if count_f_path is not None:
+        with open(count_f_path) as count_f:
+            counts = [int(count) for count in count_f.read().strip().split()]
+        assert len(counts) == len(words)
+    write_binary_vocab(out_bin_f_path, words, counts)
+
+
+def write_binary_vocab(out_bin_f_path, words, counts=None):
+    encoded_words = [word.encode("utf-8") for word in words]
+    offsets = array("q", [0])
+    for encoded_word in encoded_words:
+        offsets.append(offsets[-1] + len(encoded_word))
+    num_slots = 1
+    while num_slots < 2 * len(words):
+        num_slots *= 2
+    mask = num_slots - 1
+    slots = array("i", [_EMPTY_SLOT]) * num_slots
+    for word_id, encoded_word in enumerate(encoded_words):
+        slot_i = zlib.crc32(encoded_word) & mask
+        while slots[slot_i] != _EMPTY_SLOT:
+            if encoded_words[slots[slot_i]] == encoded_word:
+                # duplicated word, last id wins as in the txt vocab dict
+                break
+            slot_i = (slot_i + 1) & mask
+        slots[slot_i] = word_id
+    count_array = array("q", counts if counts is not None else [0] * len(words))
+    blob = b"".join(encoded_words)
+
+    temp_path = out_bin_f_path + ".temp" + str(os.getpid())
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(words), num_slots,
+                             int(counts is not None), len(blob)))
+        f.write(offsets.tobytes())
+        f.write(count_array.tobytes())
+        f.write(slots.tobytes())
+        f.write(blob)
+    os.replace(temp_path, out_bin_f_path)
+
+
+class BinaryVocab:
+    """
+    Memory-mapped binary vocab, nothing is parsed at load time.
+    words: id -> word sequence view, word_ids: word -> id mapping view
+    """
+    def __init__(self, bin_f_path):
+        with open(bin_f_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, vocab_size, num_slots, has_counts, blob_size = \
+            _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d binary vocab" % (bin_f_path, VERSION))
+        self._vocab_size = vocab_size
+        self._has_counts = bool(has_counts)
+        view = memoryview(self._mmap)
+        start = _HEADER.size
+        self._offsets = view[start:start + 8 * (vocab_size + 1)].cast("q")
+        start += 8 * (vocab_size + 1)
+        self._counts = view[start:start + 8 * vocab_size].cast("q")
+        start += 8 * vocab_size
+        self._slots = view[start:start + 4 * num_slots].cast("i")
+        start += 4 * num_slots
+        self._blob_start = start
+        self._mask = num_slots - 1
+        self._words = _Words(self)
+        self._word_ids = _WordIds(self)
+
+    def __len__(self):
+        return self._vocab_size
+
+    def id2word(self, id_token):
+        start = self._blob_start
+        return self._mmap[start + self._offsets[id_token]:
+                          start + self._offsets[id_token + 1]].decode("utf-8")
+
+    def word2id(self, word_token, default=None):
+        encoded_word = word_token.encode("utf-8")
+        offsets, slots, mm, start = self._offsets, self._slots, self._mmap, self._blob_start
+        slot_i = zlib.crc32(encoded_word) & self._mask
+        while True:
+            word_id = slots[slot_i]
+            if word_id == _EMPTY_SLOT:
+                return default
+            if mm[start + offsets[word_id]:start + offsets[word_id + 1]] == encoded_word:
+                return word_id
+            slot_i = (slot_i + 1) & self._mask
+
+    @property
+    def words(self):
+        return self._words
+
+    @property
+    def word_ids(self):
+        return self._word_ids
+
+    @property
+    def counts(self):
+        """
+        list of counts, None if compiled without a count file
+        """
+        return self._counts.tolist() if self._has_counts else None
+
+
+class _Words:
+    def __init__(self, bin_vocab):
+        self._bin_vocab = bin_vocab
+
+    def __len__(self):
+        return len(self._bin_vocab)
+
+    def __getitem__(self, id_token):
+        return self._bin_vocab.id2word(id_token)
+
+    def __iter__(self):
+        for id_token in range(len(self._bin_vocab)):
+            yield self._bin_vocab.id2word(id_token)
+
+
+class _WordIds:
+    """
+    Hash table probes are memoized, so repeated words cost a dict lookup
+    """
+    def __init__(self, bin_vocab):
+        self._bin_vocab = bin_vocab
+        self._memo = {}
+
+    def get(self, word_token, default=None):
+        word_id = self._memo.get(word_token)
+        if word_id is None:
+            word_id = self._bin_vocab.word2id(word_token)
+            if word_id is None:
+                return default
+            self._memo[word_token] = word_id
+        return word_id
+
+    def __contains__(self, word_token):
+        return self.get(word_token) is not None
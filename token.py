@@ -1,5 +1,9 @@
 
 
+import collections
+import itertools
+
+
 def assert_type_valid(token_type):
     assert token_type == "word_type" or token_type == "id_type" \
         or token_type == "value_int_type" or token_type == "embed_type" \
@@ -15,43 +19,127 @@ def is_num(token):
     return token.lstrip('-').replace('.', '', 1).isdigit()
 
 
+def create_word2id_f(vocab_reader, flag_tokens):
+    def word2id(word_token):
+        if word_token in flag_tokens:
+            return word_token
+        return vocab_reader.word2id(word_token)
+    return word2id
+
+
+def create_id2word_f(vocab_reader, flag_tokens):
+    def id2word(id_token):
+        if id_token in flag_tokens:
+            return id_token
+        return vocab_reader.id2word(id_token)
+    return id2word
+
+
+def create_word2embed_f(embed_reader, flag_tokens):
+    def word2embed(word_token):
+        if word_token in flag_tokens:
+            return word_token
+        return embed_reader.word2embed_lookup(word_token)
+    return word2embed
+
+
+def create_id2embed_f(embed_reader, flag_tokens):
+    def id2embed(id_token):
+        if id_token in flag_tokens:
+            return id_token
+        return embed_reader.id2embed_lookup(id_token)
+    return id2embed
+
+
+def create_words2ids_f(vocab_reader, flag_tokens):
+    """
+    Chunked word2id, np.int32 array, or a list if flag tokens are kept
+    """
+    def words2ids(word_chunk):
+        ids = vocab_reader.words2ids(word_chunk)
+        if flag_tokens:
+            return _restore_flag_tokens(word_chunk, ids.tolist(), flag_tokens)
+        return ids
+    return words2ids
+
+
+def create_ids2words_f(vocab_reader, flag_tokens):
+    def ids2words(id_chunk):
+        if flag_tokens:
+            # any valid id as placeholder, flags are put back afterwards
+            flag_free_chunk = [0 if token in flag_tokens else token
+                               for token in id_chunk]
+            return _restore_flag_tokens(
+                id_chunk, vocab_reader.ids2words(flag_free_chunk), flag_tokens)
+        return vocab_reader.ids2words(id_chunk)
+    return ids2words
+
+
+def create_words2embeds_f(embed_reader, flag_tokens):
+    word2embed = create_word2embed_f(embed_reader, flag_tokens)
+
+    def words2embeds(word_chunk):
+        if flag_tokens:
+            return [word2embed(token) for token in word_chunk]
+        return embed_reader.words2embeds(word_chunk)
+    return words2embeds
+
+
+def create_ids2embeds_f(embed_reader, flag_tokens):
+    id2embed = create_id2embed_f(embed_reader, flag_tokens)
+
+    def ids2embeds(id_chunk):
+        if flag_tokens:
+            return [id2embed(token) for token in id_chunk]
+        return embed_reader.ids2embeds(id_chunk)
+    return ids2embeds
+
+
+def _restore_flag_tokens(tokens, new_tokens, flag_tokens):
+    """
+    Puts flag tokens back at their positions in new_tokens, in-place
+    """
+    tokens = tokens if isinstance(tokens, list) else list(tokens)
+    for flag_token in flag_tokens:
+        i = -1
+        try:
+            while True:
+                i = tokens.index(flag_token, i + 1)
+                new_tokens[i] = flag_token
+        except ValueError:
+            pass
+    return new_tokens
+
+
 def create_word2id_gen_f(vocab_reader, flag_tokens):
+    word2id = create_word2id_f(vocab_reader, flag_tokens)
+
     def word2id_gen(token_iter):
-        for word_token in token_iter:
-            if word_token in flag_tokens:
-                yield word_token
-            else:
-                yield vocab_reader.word2id(word_token)
+        return map(word2id, token_iter)
     return word2id_gen
 
 
 def create_id2word_gen_f(vocab_reader, flag_tokens):
+    id2word = create_id2word_f(vocab_reader, flag_tokens)
+
     def id2word_gen(token_iter):
-        for id_token in token_iter:
-            if id_token in flag_tokens:
-                yield id_token
-            else:
-                yield vocab_reader.id2word(id_token)
+        return map(id2word, token_iter)
     return id2word_gen
 
 
 def create_word2embed_gen_f(embed_reader, flag_tokens):
+    word2embed = create_word2embed_f(embed_reader, flag_tokens)
+
     def word2embed_gen(token_iter):
-        for word_token in token_iter:
-            if word_token in flag_tokens:
-                yield word_token
-            else:
-                yield embed_reader.word2embed_lookup_f(word_token)
+        return map(word2embed, token_iter)
     return word2embed_gen
 
 
 def create_id2embed_gen_f(embed_reader, flag_tokens):
+    id2embed = create_id2embed_f(embed_reader, flag_tokens)
+
     def id2embed_gen(token_iter):
-        for id_token in token_iter:
-            if id_token in flag_tokens:
-                yield id_token
-            else:
-                yield embed_reader.id2embed_lookup_f(id_token)
+        return map(id2embed, token_iter)
     return id2embed_gen
 
 
@@ -76,7 +164,7 @@ class TokenTransformer:
         left, center, right = tokens_tuple
         assert len(left) >= self._num_left_tokens
         assert len(right) >= self._num_right_tokens
-        left = left[len(left)-self._num_left_tokens-1:]
+        left = left[len(left)-self._num_left_tokens:]
         right = right[:self._num_right_tokens]
         return self._token_transformer_f(left, center, right)
 
@@ -97,61 +185,146 @@ def get_transformers_max_num_tokens(token_transformers):
     return max_num_left, max_num_right
 
 
-def shift_context_center_list_tokens(tokens_lists, token_gen, max_num_left):
+##################
+# Context Window #
+##################
+_END = object()
+
+
+class ContextWindow:
     """
-    changes left right in-place
-    right context must be initialized with correct dimension
-    if empty, center will be updated with iter, and right is not updated
+    left / center / right window sliding over a token iterator.
+    left and right are fixed capacity ring buffers (O(1) shift), left keeps
+    the max_num_left most recent centers, right is filled up to
+    max_num_right on demand (extend_right) and then kept full while shifting.
+    self.left / self.right are live zero-copy views, field picks one item of
+    tuple tokens (e.g. the flag of (seq, flag) pairs).
     """
-    left, center, right = tokens_lists
-    num_elem = len(left)
-    assert num_elem == len(center) and num_elem == len(right)
-    left_len, right_len = len(left[0]), len(right[0])
-    if max_num_left > 0:
-        for left_list, center_elem in zip(left, center):
-            left_list.append(center_elem)
-    if left_len > max_num_left:
-        for left_list in left:
-            left_list.pop(0)
-
-    if right_len == 0:
+    def __init__(self, token_iter, max_num_left, max_num_right, field=None):
+        self._token_iter = token_iter
+        self._max_num_left = max_num_left
+        self._max_num_right = max_num_right
+        self._left_buf = collections.deque(maxlen=max_num_left)
+        self._right_buf = collections.deque(maxlen=max_num_right)
+        self.left = WindowView(self._left_buf, field=field)
+        self.right = WindowView(self._right_buf, field=field)
+        self.has_center = False
+        self.center = None
+        self._next_center()
+
+    @property
+    def left_buf(self):
+        return self._left_buf
+
+    @property
+    def right_buf(self):
+        return self._right_buf
+
+    def _next_center(self):
         try:
-            center = next(token_gen)
+            self.center = next(self._token_iter)
+            self.has_center = True
         except StopIteration:
-            center = [None for _ in range(num_elem)]
-    else:
-        center = [right[i].pop(0) for i in range(num_elem)]
+            self.center = None
+            self.has_center = False
+
+    def extend_right(self):
+        """
+        Appends one more token to right, False if right is full or the
+        iterator is exhausted
+        """
+        if len(self._right_buf) >= self._max_num_right:
+            return False
         try:
-            right_elems = next(token_gen)
-            for right_list, right_elem in zip(right, right_elems):
-                right_list.append(right_elem)
+            self._right_buf.append(next(self._token_iter))
+            return True
         except StopIteration:
+            return False
+
+    def fill_right(self):
+        while self.extend_right():
             pass
-    return center
+        return len(self._right_buf) == self._max_num_right
 
+    def shift(self):
+        if self._max_num_left > 0:
+            self._left_buf.append(self.center)
+        if self._right_buf:
+            self.center = self._right_buf.popleft()
+            token = next(self._token_iter, _END)
+            if token is not _END:
+                self._right_buf.append(token)
+        else:
+            self._next_center()
+        return self.has_center
 
-def shift_context_center_tokens(tokens_list, token_gen, max_num_left):
+    def iter_centers(self):
+        """
+        Yields every remaining center, shifting once the consumer resumes.
+        Same as looping on has_center/shift(), without the per token method
+        calls, for loops that never extend_right themselves
+        """
+        left_append = self._left_buf.append
+        right_buf = self._right_buf
+        right_popleft, right_append = right_buf.popleft, right_buf.append
+        token_iter = self._token_iter
+        keep_left = self._max_num_left > 0
+        while self.has_center:
+            center = self.center
+            yield center
+            if keep_left:
+                left_append(center)
+            if right_buf:
+                self.center = right_popleft()
+                token = next(token_iter, _END)
+                if token is not _END:
+                    right_append(token)
+            else:
+                self._next_center()
+
+
+class WindowView:
     """
-    changes left right in-place
-    right context must be initialized with correct dimension
-    if empty, center will be updated with iter, and right is not updated
+    Read only view over [start, stop) of a ring buffer, without copying.
+    Slicing gives another view, indices follow list semantics.
     """
-    left, center, right = tokens_list
-    left_len, right_len = len(left), len(right)
-    if max_num_left > 0:
-        left.append(center)
-    if left_len > max_num_left:
-        left.pop(0)
-
-    if right_len == 0:
-        try:
-            center = next(token_gen)
-        except StopIteration:
-            center = None
-    else:
-        center = right.pop(0)
+    def __init__(self, buf, start=0, stop=None, field=None):
+        self._buf = buf
+        self._start = start
+        self._stop = stop
+        self._field = field
+
+    def _range(self):
+        return range(len(self._buf))[self._start:self._stop]
+
+    def __len__(self):
+        return len(self._range())
+
+    def __getitem__(self, key):
+        index_range = self._range()
+        if isinstance(key, slice):
+            sub_range = index_range[key]
+            if sub_range.step != 1:
+                return list(self)[key]
+            return WindowView(self._buf, sub_range.start, sub_range.stop, self._field)
+        item = self._buf[index_range[key]]
+        return item if self._field is None else item[self._field]
+
+    def __iter__(self):
+        index_range = self._range()
+        items = itertools.islice(self._buf, index_range.start, index_range.stop)
+        if self._field is None:
+            return items
+        return (item[self._field] for item in items)
+
+    def __eq__(self, other):
         try:
-            right.append(next(token_gen))
-        except StopIteration:
-            pass
-    return center
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __repr__(self):
+        return "WindowView(" + repr(list(self)) + ")"
@@ -1,3 +1,7 @@
+import weakref
+import collections
+import itertools
+import numpy as np
 from plp.transformers.interface import DocTransformer, ListStat
 import plp.token as ptoken
 import plp.utils as putils
@@ -5,15 +9,53 @@ import plp.vocab as pvocab
 
 
 class Word2vecTransformer(DocTransformer):
-    def __init__(self, window_size, round_iter=False):
+    """
+    subsample_threshold: t of Mikolov et al. subsampling, each token is kept
+        with probability min(1, sqrt(t / f) + t / f), f its vocab_reader
+        count frequency. Dropped tokens are removed before windowing.
+    dynamic_window: each center uses a window size drawn uniformly in
+        [1, window_size]
+    num_negatives: k negatives emitted with each pair, drawn from the
+        unigram^0.75 distribution of vocab_reader counts
+    seed: of the RandomStates used by each doc (seed + doc index)
+    """
+    def __init__(self, window_size, round_iter=False, subsample_threshold=None,
+                 dynamic_window=False, vocab_reader=None, seed=None, num_negatives=0):
         self._window_size = window_size
         self._round_iter = round_iter
+        self._subsample_threshold = subsample_threshold
+        self._dynamic_window = dynamic_window
+        self._vocab_reader = vocab_reader
+        self._seed = seed
+        self._keep_probs = None
+        if subsample_threshold is not None:
+            if vocab_reader is None or vocab_reader.vocab_counts_list is None:
+                raise ValueError("subsampling needs a vocab_reader with counts")
+            self._keep_probs = subsample_keep_probs(
+                vocab_reader.vocab_counts_list, subsample_threshold)
+        self._num_negatives = num_negatives
+        self._negative_table = None
+        if num_negatives:
+            if vocab_reader is None or vocab_reader.vocab_counts_list is None:
+                raise ValueError("negative sampling needs a vocab_reader with counts")
+            counts = np.asarray(vocab_reader.vocab_counts_list, dtype=np.float64)
+            self._negative_table = create_alias_table(counts ** 0.75)
+
+    @property
+    def _is_sampled(self):
+        return self._keep_probs is not None or self._dynamic_window
 
     def get_lists_stats(self, doc, *docs):
         token_type = doc.token_type
         if token_type != "word_type" and token_type != "id_type":
             raise NotImplementedError("not implemented type")
         DocTransformer.assert_docs_token_type(token_type, *docs)
+        if self._num_negatives:
+            return(
+                ListStat("center", token_type, 1),
+                ListStat("context", token_type, 1),
+                ListStat("negatives", token_type, self._num_negatives)
+            )
         return(
             ListStat("center", token_type, 1),
             ListStat("context", token_type, 1)
@@ -26,40 +68,169 @@ class Word2vecTransformer(DocTransformer):
         unk_token = pvocab.UNK if token_type == "word_type" else pvocab.UNK_ID
         DocTransformer.assert_docs_token_type(token_type, *docs)
         docs = [doc] + list(docs)
+        word2vec_iters = [self._word2vec_gen_from_chunks(doc.iter_chunks(), token_type,
+                                                         unk_token, self._create_rng(i))
+                          for i, doc in enumerate(docs)]
+        if self._num_negatives:
+            word2vec_iters = [self._negatives_gen(word2vec_iter, token_type,
+                                                  self._create_negative_rng(i))
+                              for i, word2vec_iter in enumerate(word2vec_iters)]
         if self._round_iter:
-            word2vec_iters = [self._word2vec_gen(iter(doc), unk_token) for doc in docs]
-            for center, context in putils.iterator.merged_round_iter(*word2vec_iters):
-                yield center, context
+            for lists in putils.iterator.merged_round_iter(*word2vec_iters):
+                yield lists
         else:
-            for doc in docs:
-                for center, context in self._word2vec_gen(iter(doc), unk_token):
-                    yield center, context
+            for word2vec_iter in word2vec_iters:
+                for lists in word2vec_iter:
+                    yield lists
 
+    def _create_rng(self, doc_i):
+        return np.random.RandomState(None if self._seed is None else self._seed + doc_i)
 
-    def _word2vec_gen(self, token_iter, unk_token):
-        try:
-            center_word = next(token_iter)
-        except StopIteration:
-            return
+    def _create_negative_rng(self, doc_i):
+        return np.random.RandomState(None if self._seed is None else [self._seed + doc_i, 1])
 
-        left_context_words = []
-        right_context_words = []
-        for _ in range(self._window_size):
-            try:
-                right_context_words.append(next(token_iter))
-            except StopIteration:
-                break
-        while center_word is not None:
-            context_words = left_context_words + right_context_words
+    def _sample_negatives(self, num_pairs, rng):
+        """
+        (num_pairs, num_negatives) ids, one uniform per draw so the drawn
+        sequence doesn't depend on how draws are batched
+        """
+        negatives = alias_sample(self._negative_table, num_pairs * self._num_negatives, rng)
+        return negatives.reshape(num_pairs, self._num_negatives)
+
+    def _negatives_gen(self, pair_iter, token_type, rng, block_size=4096):
+        """
+        Adds the negatives to each pair, sampled block_size pairs at a time
+        """
+        block = []
+        block_i = 0
+        for center, context in pair_iter:
+            if block_i == len(block):
+                negatives = self._sample_negatives(block_size, rng)
+                if token_type == "word_type":
+                    negatives = np.array(
+                        self._vocab_reader.ids2words(negatives.ravel()),
+                        dtype=object).reshape(negatives.shape)
+                if self._num_negatives == 1:
+                    block = negatives[:, 0].tolist()
+                else:
+                    block = negatives.tolist()
+                block_i = 0
+            yield center, context, block[block_i]
+            block_i += 1
+
+    def _word2vec_gen_from_chunks(self, chunk_iter, token_type, unk_token, rng):
+        if not self._is_sampled:
+            # chunks keep the source & map ops out of the per-token path
+            return self._word2vec_gen(itertools.chain.from_iterable(chunk_iter), unk_token)
+        radii = collections.deque()
+
+        def token_iter():
+            for tokens, chunk_radii in self._sample_chunks(chunk_iter, token_type, rng):
+                if chunk_radii is not None:
+                    radii.extend(chunk_radii.tolist())
+                for token in tokens:
+                    yield token
+        # tokens are read ahead of their centers, so their radius is queued
+        return self._word2vec_gen(
+            token_iter(), unk_token, radii if self._dynamic_window else None)
+
+    def _sample_chunks(self, chunk_iter, token_type, rng):
+        """
+        Yields (kept tokens, window radius of each kept token or None)
+        """
+        for chunk in chunk_iter:
+            if self._keep_probs is not None:
+                if token_type == "word_type":
+                    ids = self._vocab_reader.words2ids(chunk)
+                else:
+                    ids = np.asarray(chunk)
+                ids = np.where(ids >= len(self._keep_probs), pvocab.UNK_ID, ids)
+                keep = rng.random_sample(len(ids)) < self._keep_probs[ids]
+                if isinstance(chunk, np.ndarray):
+                    chunk = chunk[keep]
+                else:
+                    chunk = list(itertools.compress(chunk, keep.tolist()))
+            radii = None
+            if self._dynamic_window:
+                radii = rng.randint(1, self._window_size + 1, size=len(chunk))
+            yield chunk, radii
+
+    def _word2vec_gen(self, token_iter, unk_token, radii=None):
+        window = ptoken.ContextWindow(token_iter, self._window_size, self._window_size)
+        window.fill_right()
+        left_buf, right_buf = window.left_buf, window.right_buf
+        if radii is not None:
+            for center_word in window.iter_centers():
+                radius = radii.popleft()
+                if center_word != unk_token:
+                    left_start = max(len(left_buf) - radius, 0)
+                    for context_word in itertools.islice(left_buf, left_start, None):
+                        if context_word != unk_token:
+                            yield center_word, context_word
+                    for context_word in itertools.islice(right_buf, radius):
+                        if context_word != unk_token:
+                            yield center_word, context_word
+            return
+        for center_word in window.iter_centers():
             if center_word != unk_token:
-                for context_word in context_words:
+                # two plain loops, iterating deques directly is the cheapest
+                for context_word in left_buf:
                     if context_word != unk_token:
                         yield center_word, context_word
-            center_word = ptoken.shift_context_center_tokens(
-                (left_context_words, center_word, right_context_words),
-                token_iter,
-                self._window_size
-            )
+                for context_word in right_buf:
+                    if context_word != unk_token:
+                        yield center_word, context_word
+
+    def transform_docs_batched(self, doc, *docs):
+        """
+        id_type docs only, yields (centers, contexts) np.int32 array pairs,
+        same pairs in the same order as transform_docs, one block per chunk.
+        With num_negatives, (centers, contexts, negatives (n, num_negatives))
+        """
+        if self._round_iter:
+            raise NotImplementedError("round_iter not supported in batched mode")
+        DocTransformer.assert_docs_token_type("id_type", doc, *docs)
+        docs = [doc] + list(docs)
+        for i, doc in enumerate(docs):
+            chunk_iter = doc.iter_chunks()
+            if self._is_sampled:
+                chunk_iter = self._sample_chunks(chunk_iter, "id_type", self._create_rng(i))
+            else:
+                chunk_iter = ((chunk, None) for chunk in chunk_iter)
+            if not self._num_negatives:
+                for centers, contexts in self._word2vec_batch_gen(chunk_iter):
+                    yield centers, contexts
+                continue
+            negative_rng = self._create_negative_rng(i)
+            for centers, contexts in self._word2vec_batch_gen(chunk_iter):
+                yield centers, contexts, self._sample_negatives(len(centers), negative_rng)
+
+    def _word2vec_batch_gen(self, chunk_iter):
+        """
+        Keeps window_size ids on both sides of the current block of centers,
+        so the buffer ends are the doc edges or hold a full window
+        chunk_iter: (id chunk, radii or None)
+        """
+        window_size = self._window_size
+        buf = np.zeros(0, dtype=np.int32)
+        radii_buf = np.zeros(0, dtype=np.int64)
+        start = 0
+        for id_chunk, radii in chunk_iter:
+            buf = np.concatenate((buf, np.asarray(id_chunk, dtype=np.int32)))
+            if radii is not None:
+                radii_buf = np.concatenate((radii_buf, radii))
+            stop = len(buf) - window_size
+            if stop <= start:
+                continue
+            yield skipgram_pairs(buf, window_size, start, stop,
+                                 radii=radii_buf[start:stop] if radii is not None else None)
+            keep_from = max(stop - window_size, 0)
+            buf = buf[keep_from:]
+            radii_buf = radii_buf[keep_from:]
+            start = stop - keep_from
+        if len(buf) > start:
+            yield skipgram_pairs(buf, window_size, start, len(buf),
+                                 radii=radii_buf[start:] if self._dynamic_window else None)
 
     def transform_seq_docs(self, seq_doc, *seq_docs):
         token_type = seq_doc.token_type
@@ -68,29 +239,123 @@ class Word2vecTransformer(DocTransformer):
         unk_token = pvocab.UNK if token_type == "word_type" else pvocab.UNK_ID
         DocTransformer.assert_docs_token_type(token_type, *seq_docs)
         seq_docs = [seq_doc] + list(seq_docs)
-        for seq_doc in seq_docs:
-            for seq, _ in iter(seq_doc):
-                for center, context in self._word2vec_gen(iter(seq), unk_token):
-                    yield center, context
+        for i, seq_doc in enumerate(seq_docs):
+            rng = self._create_rng(i)
+            word2vec_iter = itertools.chain.from_iterable(
+                self._word2vec_gen_from_chunks([seq], token_type, unk_token, rng)
+                for seq, _ in iter(seq_doc))
+            if self._num_negatives:
+                word2vec_iter = self._negatives_gen(
+                    word2vec_iter, token_type, self._create_negative_rng(i))
+            for lists in word2vec_iter:
+                yield lists
 
     def estimate_docs_transformed_size(self, doc, *docs):
+        """
+        Expected number of pairs: contexts per center (window_size + 1 on
+        average with dynamic windows) times the expected number of kept tokens,
+        the keep rate being the count weighted mean of the keep probabilities
+        """
+        num_contexts = self._window_size + 1 if self._dynamic_window else 2 * self._window_size
+        keep_rate = 1.0
+        if self._keep_probs is not None:
+            counts = np.asarray(self._vocab_reader.vocab_counts_list, dtype=np.float64)
+            keep_rate = float(np.dot(counts, self._keep_probs) / max(counts.sum(), 1))
         len_sum = 0 
         docs = [doc] + list(docs)
         for doc in docs:
-            len_sum += (2 * self._window_size) * (len(doc) - 1) 
-        return len_sum
+            len_sum += num_contexts * (keep_rate * len(doc) - 1)
+        return int(len_sum)
 
     def estimate_seq_docs_transformed_size(self, *docs):
         raise NotImplementedError("Not supported")
 
 
+def subsample_keep_probs(vocab_counts, threshold):
+    """
+    Keep probability per id, words never counted (special tokens) are kept
+    """
+    counts = np.asarray(vocab_counts, dtype=np.float64)
+    freqs = counts / max(counts.sum(), 1)
+    keep_probs = np.ones(len(counts))
+    counted = freqs > 0
+    ratios = threshold / freqs[counted]
+    keep_probs[counted] = np.minimum(np.sqrt(ratios) + ratios, 1.0)
+    return keep_probs
+
+
+def create_alias_table(weights):
+    """
+    Walker/Vose alias table of the distribution proportional to weights,
+    returns (accept_probs, aliases) arrays
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    num_bins = len(weights)
+    scaled = weights * num_bins / weights.sum()
+    accept_probs = np.ones(num_bins)
+    aliases = np.arange(num_bins)
+    small = np.flatnonzero(scaled < 1.0).tolist()
+    large = np.flatnonzero(scaled >= 1.0).tolist()
+    scaled = scaled.tolist()
+    while small and large:
+        small_i, large_i = small.pop(), large[-1]
+        accept_probs[small_i] = scaled[small_i]
+        aliases[small_i] = large_i
+        scaled[large_i] -= 1.0 - scaled[small_i]
+        if scaled[large_i] < 1.0:
+            small.append(large.pop())
+    return accept_probs, aliases
+
+
+def alias_sample(alias_table, size, rng):
+    """
+    size draws from an alias table, each one from a single uniform: its
+    integer part picks the bin, its fractional part accepts it or its alias
+    """
+    accept_probs, aliases = alias_table
+    draws = rng.random_sample(size) * len(accept_probs)
+    bins = draws.astype(np.int64)
+    np.minimum(bins, len(accept_probs) - 1, out=bins)
+    return np.where(draws - bins < accept_probs[bins], bins, aliases[bins])
+
+
+def skipgram_pairs(ids, window_size, start=0, stop=None, unk_id=pvocab.UNK_ID, radii=None):
+    """
+    All (center, context) id pairs with centers in ids[start:stop], contexts
+    ordered from offset -window_size to window_size, pairs with UNK or
+    outside of ids are masked
+    radii: optional window size of each center, <= window_size
+    """
+    stop = len(ids) if stop is None else stop
+    offsets = np.concatenate((np.arange(-window_size, 0), np.arange(1, window_size + 1)))
+    center_pos = np.arange(start, stop)
+    context_pos = center_pos[:, None] + offsets[None, :]
+    valid = (context_pos >= 0) & (context_pos < len(ids))
+    if radii is not None:
+        valid &= np.abs(offsets)[None, :] <= np.asarray(radii)[:, None]
+    context_pos[~valid] = 0
+    centers = np.broadcast_to(ids[start:stop, None], context_pos.shape)
+    contexts = ids[context_pos]
+    valid &= (centers != unk_id) & (contexts != unk_id)
+    return centers[valid], contexts[valid]
+
+
 class Sca2wordTransformer(DocTransformer):
-    def __init__(self, val_token_type, window_size, each_num_examples, vocab_reader, u_w_ret_id=True):
+    """
+    precompute_masks: numeric & in vocab masks are computed once per doc,
+        over its distinct tokens, and u_v_w centers are found by a sparse
+        scan of the candidate positions instead of testing every window.
+        Same output, but each doc is held in memory as a token list.
+    """
+    def __init__(self, val_token_type, window_size, each_num_examples, vocab_reader,
+                 u_w_ret_id=True, precompute_masks=False):
         self._window_size = window_size
         self._each_num_examples = each_num_examples
         self._val_token_type = val_token_type
         self._vocab_reader = vocab_reader
         self._u_w_ret_id = u_w_ret_id
+        self._precompute_masks = precompute_masks
+        self._doc_counts_cache = weakref.WeakKeyDictionary()
 
     def get_lists_stats(self, doc, *docs):
         token_type = doc.token_type
@@ -116,10 +381,10 @@ class Sca2wordTransformer(DocTransformer):
         vocab = self._vocab_reader
         for doc in docs:
             for u_a, v_a, w_a, u_b, v_b, w_b in self._sca2word_gen(doc):
-                u_a = [vocab[x] for x in u_a]
-                w_a = [vocab[x] for x in w_a]
-                u_b = [vocab[x] for x in u_b]
-                w_b = [vocab[x] for x in w_b]
+                u_a = vocab.words2ids(u_a).tolist()
+                w_a = vocab.words2ids(w_a).tolist()
+                u_b = vocab.words2ids(u_b).tolist()
+                w_b = vocab.words2ids(w_b).tolist()
                 yield u_a, v_a, w_a, u_b, v_b, w_b
         # for u_a, v_a, w_a, u_b, v_b, w_b in merged_round_iter(*sca2word_iters):
         #     yield u_a, v_a, w_a, u_b, v_b, w_b
@@ -138,71 +403,135 @@ class Sca2wordTransformer(DocTransformer):
                     yield u, float(v), w
 
     def find_next_u_v_w(self, doc_iter):
-        try:
-            u = [next(doc_iter) for _ in range(self._window_size)]
-            v = next(doc_iter)
-            w = [next(doc_iter) for _ in range(self._window_size)]
-            u_v_w = [u, v, w]
-        except StopIteration:
+        window = self._u_v_w_window(doc_iter)
+        if window is None:
             return None
         while True:
-            # if is_num(w):
-            #    pdb.set_trace()
+            u_v_w = (window.left_buf, window.center, window.right_buf)
             if self.is_u_v_w(u_v_w):
-                return u_v_w
-            try:
-                u_v_w[0].pop(0)
-                u_v_w[0].append(u_v_w[1])
-                u_v_w[1] = u_v_w[2].pop(0)
-                u_v_w[2].append(next(doc_iter))
-            except StopIteration:
+                return [list(window.left_buf), window.center, list(window.right_buf)]
+            window.shift()
+            if len(window.right_buf) < self._window_size:
                 return None
 
+    def _u_v_w_window(self, doc_iter):
+        """
+        Window with full u (left) and w (right), None if doc_iter runs out
+        """
+        window = ptoken.ContextWindow(doc_iter, self._window_size, self._window_size)
+        for _ in range(self._window_size):
+            window.shift()
+        if len(window.left_buf) < self._window_size or not window.has_center:
+            return None
+        if not window.fill_right():
+            return None
+        return window
+
+    def _doc_tokens(self, doc):
+        return list(itertools.chain.from_iterable(doc.iter_chunks()))
+
+    def u_v_w_center_mask(self, tokens):
+        """
+        is_u_v_w of the window centered on each position, False where the
+        window doesn't fit. The string checks run once per distinct token.
+        """
+        window_size = self._window_size
+        num_tokens = len(tokens)
+        mask = np.zeros(num_tokens, dtype=bool)
+        if num_tokens < 2 * window_size + 1:
+            return mask
+        token2index = {}
+        inverse = np.fromiter((token2index.setdefault(token, len(token2index)) for token in tokens),
+                              dtype=np.int64, count=num_tokens)
+        distinct_tokens = list(token2index)
+        distinct_is_num = np.array([self.is_num(token) for token in distinct_tokens], dtype=bool)
+        distinct_exist = np.array([self._vocab_reader.check_word_exist(token)
+                                   for token in distinct_tokens], dtype=bool)
+        is_num = distinct_is_num[inverse]
+        bad_context = is_num | ~distinct_exist[inverse]
+        # bad_cumsum[i]: number of bad context tokens in tokens[:i]
+        bad_cumsum = np.concatenate(([0], np.cumsum(bad_context)))
+        centers = np.arange(window_size, num_tokens - window_size)
+        num_bad = (bad_cumsum[centers + window_size + 1] - bad_cumsum[centers + 1]
+                   + bad_cumsum[centers] - bad_cumsum[centers - window_size])
+        mask[centers] = is_num[centers] & (num_bad == 0)
+        return mask
+
+    def sparse_u_v_w_gen(self, tokens):
+        """
+        Same u_v_w sequence as repeated find_next_u_v_w calls over tokens:
+        after a match at c, the next search starts at c + window_size + 1,
+        so its center is at least c + 2 * window_size + 1
+        """
+        window_size = self._window_size
+        candidates = np.flatnonzero(self.u_v_w_center_mask(tokens)).tolist()
+        min_center = window_size
+        for center in candidates:
+            if center < min_center:
+                continue
+            yield [tokens[center - window_size:center], tokens[center],
+                   tokens[center + 1:center + window_size + 1]]
+            min_center = center + 2 * window_size + 1
+
     def u_v_w_gen_with_label(self, doc):
         """
         When the is_sca label is True,
         the context u, w are converted to their indices
         """
-        doc_iter = iter(doc)
-        u = [next(doc_iter) for _ in range(self._window_size)]
-        u = []
-        for i in range(self._window_size):
-            item = next(doc_iter)
-            u.append(item)
-            yield (None, item, None), False
-        v = next(doc_iter)
-        w = [next(doc_iter) for _ in range(self._window_size)]
-        u_v_w = [u, v, w]
-
-        is_end = False
-        while not is_end:
-            u_v_w_ids = self.u_v_w_word2id(u_v_w)
-            yield u_v_w_ids, self.is_u_v_w(u_v_w)
-            u_v_w[0].pop(0)
-            u_v_w[0].append(u_v_w[1])
-            u_v_w[1] = u_v_w[2].pop(0)
-            try: 
-                u_v_w[2].append(next(doc_iter))
-            except StopIteration:
-                yield u_v_w, False
-                is_end = True
-        for item in u_v_w[2]:
+        if self._precompute_masks:
+            tokens = self._doc_tokens(doc)
+            center_mask = self.u_v_w_center_mask(tokens)
+            doc_iter = iter(tokens)
+        else:
+            center_mask = None
+            doc_iter = iter(doc)
+        # the first window_size tokens are skipped
+        for _ in range(self._window_size):
+            next(doc_iter)
+        window = ptoken.ContextWindow(doc_iter, self._window_size, self._window_size)
+        for _ in range(self._window_size):
+            yield (None, window.center, None), False
+            window.shift()
+        window.fill_right()
+        left_buf, right_buf = window.left_buf, window.right_buf
+
+        center_pos = 2 * self._window_size
+        while True:
+            u_v_w = (left_buf, window.center, right_buf)
+            if center_mask is not None and len(left_buf) == len(right_buf) == self._window_size:
+                is_sca = bool(center_mask[center_pos])
+            else:
+                # partial windows at the end of short docs
+                is_sca = self.is_u_v_w(u_v_w)
+            yield self.u_v_w_word2id(u_v_w), is_sca
+            center_pos += 1
+            window.shift()
+            if len(right_buf) < self._window_size:
+                yield [list(left_buf), window.center, list(right_buf)], False
+                break
+        for item in right_buf:
             yield (None, item, None), False
 
     def u_v_w_word2id(self, u_v_w):
-        u = [self._vocab_reader[x] for x in u_v_w[0]]
-        w = [self._vocab_reader[x] for x in u_v_w[2]]
+        u = self._vocab_reader.words2ids(u_v_w[0]).tolist()
+        w = self._vocab_reader.words2ids(u_v_w[2]).tolist()
         v = u_v_w[1]
         return (u, v, w)
 
 
     def _sca2word_gen(self, doc):
-        doc_gen = iter(doc)
-        u_v_w_a = self.find_next_u_v_w(doc_gen)
+        if self._precompute_masks:
+            u_v_w_iter = self.sparse_u_v_w_gen(self._doc_tokens(doc))
+            find_next = lambda: next(u_v_w_iter, None)
+        else:
+            doc_gen = iter(doc)
+            find_next = lambda: self.find_next_u_v_w(doc_gen)
+        u_v_w_a = find_next()
         if u_v_w_a is None:
             return
             # raise ValueError("Not even a single example")
-        comparisons = [self.find_next_u_v_w(doc_gen) for _ in range(self._each_num_examples)]
+        comparisons = collections.deque(
+            find_next() for _ in range(self._each_num_examples))
         count = 0
         while True:
             if comparisons[0] is None:
@@ -221,8 +550,8 @@ class Sca2wordTransformer(DocTransformer):
                 else:
                     raise ValueError("Unsupported Value token type")
 
-            u_v_w_a = comparisons.pop(0)
-            comparisons.append(self.find_next_u_v_w(doc_gen))
+            u_v_w_a = comparisons.popleft()
+            comparisons.append(find_next())
 
     @staticmethod
     def is_num(token):
@@ -240,17 +569,65 @@ class Sca2wordTransformer(DocTransformer):
                 return False
         return True
 
-    def estimate_docs_transformed_size(self, *docs):
-        len_sum = 0
-        for _ in self.transform_docs(*docs):
-            len_sum += 1
-        return len_sum
-
-    def estimate_docs_single_transformed_size(self, *docs):
-        len_sum = 0
-        for _ in self.transform_docs2(*docs):
-            len_sum += 1
-        return len_sum
+    def _doc_counts(self, doc):
+        """
+        (transform_docs size, transform_docs2 size) of doc, from a single
+        pass counting valid u_v_w centers, cached per doc
+        """
+        if doc in self._doc_counts_cache:
+            return self._doc_counts_cache[doc]
+        window_size = self._window_size
+        num_u_v_w, num_labels, num_tokens = 0, 0, 0
+        min_u_v_w_center = window_size
+        buf, buf_start, next_center = [], 0, window_size
+        for chunk in doc.iter_chunks():
+            buf.extend(chunk)
+            num_tokens += len(chunk)
+            mask = self.u_v_w_center_mask(buf)
+            for center in (np.flatnonzero(mask[next_center:]) + (buf_start + next_center)).tolist():
+                # u_v_w_gen_with_label labels from 2 * window_size on
+                if center >= 2 * window_size:
+                    num_labels += 1
+                # non overlapping, as find_next_u_v_w
+                if center >= min_u_v_w_center:
+                    num_u_v_w += 1
+                    min_u_v_w_center = center + 2 * window_size + 1
+            # keep 2 * window_size tokens, the context of the undecided centers
+            keep_from = max(len(buf) - 2 * window_size, 0)
+            next_center = max(len(buf) - window_size, next_center) - keep_from
+            buf = buf[keep_from:]
+            buf_start += keep_from
+        if num_tokens < 3 * window_size + 1:
+            # partial windows of short docs, see u_v_w_gen_with_label
+            num_labels = sum(1 for _ in self.transform_docs2(doc))
+        # each u_v_w is compared with up to each_num_examples following ones
+        num_compared = min(self._each_num_examples, max(num_u_v_w - 1, 0))
+        num_examples = (num_compared * (num_compared + 1) // 2 +
+                        self._each_num_examples * max(num_u_v_w - 1 - self._each_num_examples, 0))
+        counts = (num_examples, num_labels)
+        self._doc_counts_cache[doc] = counts
+        return counts
+
+    def _estimate_size(self, docs, count_i, sample_rate, seed):
+        if sample_rate is None:
+            return sum(self._doc_counts(doc)[count_i] for doc in docs)
+        num_sampled = max(int(round(sample_rate * len(docs))), 1)
+        sampled_docs = np.random.RandomState(seed).choice(len(docs), num_sampled, replace=False)
+        sampled_sum = sum(self._doc_counts(docs[i])[count_i] for i in sampled_docs)
+        return int(round(sampled_sum * len(docs) / num_sampled))
+
+    def estimate_docs_transformed_size(self, *docs, sample_rate=None, seed=0):
+        """
+        Exact size of transform_docs, without running it.
+        sample_rate: only count a random fraction of the docs and scale up
+        """
+        return self._estimate_size(docs, 0, sample_rate, seed)
+
+    def estimate_docs_single_transformed_size(self, *docs, sample_rate=None, seed=0):
+        """
+        Exact size of transform_docs2, see estimate_docs_transformed_size
+        """
+        return self._estimate_size(docs, 1, sample_rate, seed)
 
     def estimate_seq_docs_transformed_size(self, *docs):
         raise NotImplementedError("Not supported")
@@ -76,3 +76,20 @@ class ListStat:
     def sub_list_stat(self):
         return self._sub_list_stat
 
+
+    def to_dict(self):
+        return {
+            "name": self._name,
+            "token_type": self._token_type,
+            "list_len": self._list_len,
+            "is_seq": self._is_seq,
+            "sub_list_stat": (self._sub_list_stat.to_dict()
+                              if self._sub_list_stat is not None else None)
+        }
+
+    @classmethod
+    def from_dict(cls, list_stat_dict):
+        sub_list_stat_dict = list_stat_dict["sub_list_stat"]
+        return cls(list_stat_dict["name"], list_stat_dict["token_type"],
+                   list_stat_dict["list_len"], list_stat_dict["is_seq"],
+                   cls.from_dict(sub_list_stat_dict) if sub_list_stat_dict is not None else None)
@@ -0,0 +1,90 @@
+import itertools
+import numpy as np
+from plp.transformers.interface import DocTransformer, ListStat
+import plp.vocab as pvocab
+
+
+class PackedLangModelTransformer(DocTransformer):
+    """
+    Language model examples (input, target) without padding: the docs are
+    concatenated, each followed by a separator token (EOS by default), and
+    cut into contiguous blocks of block_len tokens. target is input shifted by
+    one token, both are views over the same packed array.
+    Flag tokens of id docs (e.g. the "\n" of keep_eol_nl) are packed as the
+    separator.
+    The last tokens that don't fill a whole block are dropped.
+    """
+    def __init__(self, block_len, sep_token=None):
+        self._block_len = block_len
+        self._sep_token = sep_token
+
+    def get_lists_stats(self, doc, *docs):
+        token_type = self._validate(doc, *docs)
+        return (
+            ListStat("input", token_type, self._block_len, is_seq=True),
+            ListStat("target", token_type, self._block_len, is_seq=True)
+        )
+
+    def transform_docs(self, doc, *docs):
+        token_type = self._validate(doc, *docs)
+        docs = [doc] + list(docs)
+        sep = self._get_sep(token_type)
+        token_chunk_iters = (itertools.chain(self._iter_chunks(doc_, token_type, sep), [[sep]])
+                             for doc_ in docs)
+        return self._packed_gen(itertools.chain.from_iterable(token_chunk_iters), token_type)
+
+    def _iter_chunks(self, doc, token_type, sep):
+        if token_type != "id_type" or not doc.is_flag_token_applied:
+            return doc.iter_chunks()
+        flag_tokens = set(doc.applied_flag_tokens)
+        return ([sep if token in flag_tokens else token for token in chunk]
+                for chunk in doc.iter_chunks())
+
+    def transform_seq_docs(self, seq_doc, *seq_docs):
+        """
+        Each seq is followed by the separator
+        """
+        token_type = self._validate(seq_doc, *seq_docs)
+        seq_docs = [seq_doc] + list(seq_docs)
+        sep = self._get_sep(token_type)
+        token_chunk_iter = (chunk for seq_doc_ in seq_docs
+                            for seq, _ in iter(seq_doc_) for chunk in (seq, [sep]))
+        return self._packed_gen(token_chunk_iter, token_type)
+
+    def _packed_gen(self, token_chunk_iter, token_type):
+        block_len = self._block_len
+        dtype = np.int64 if token_type == "id_type" else object
+        pending, num_pending = [], 0
+        for chunk in token_chunk_iter:
+            chunk = np.asarray(chunk, dtype=dtype)
+            pending.append(chunk)
+            num_pending += len(chunk)
+            if num_pending < block_len + 1:
+                continue
+            packed = np.concatenate(pending)
+            num_blocks = (len(packed) - 1) // block_len
+            for start in range(0, num_blocks * block_len, block_len):
+                yield packed[start:start + block_len], packed[start + 1:start + block_len + 1]
+            # the last target token starts the next input
+            pending = [packed[num_blocks * block_len:]]
+            num_pending = len(pending[0])
+
+    def _get_sep(self, token_type):
+        if self._sep_token is not None:
+            return self._sep_token
+        return pvocab.EOS if token_type == "word_type" else pvocab.EOS_ID
+
+    def _validate(self, doc, *docs):
+        token_type = doc.token_type
+        if token_type != "word_type" and token_type != "id_type":
+            raise NotImplementedError("not implemented type")
+        DocTransformer.assert_docs_token_type(token_type, *docs)
+        return token_type
+
+    def estimate_docs_transformed_size(self, *docs):
+        num_tokens = sum(len(doc) + 1 for doc in docs)
+        return max(num_tokens - 1, 0) // self._block_len
+
+    def estimate_seq_docs_transformed_size(self, *seq_docs):
+        num_tokens = sum(len(seq) + 1 for seq_doc in seq_docs for seq, _ in iter(seq_doc))
+        return max(num_tokens - 1, 0) // self._block_len
@@ -1,5 +1,4 @@
 from plp.transformers.interface import DocTransformer, ListStat
-import plp.token as ptoken
 import plp.seq as pseq
 import plp.vocab as pvocab
 import numpy as np
@@ -15,12 +14,12 @@ class QueAnsTransformer(DocTransformer):
     def get_lists_stats(self, doc, *docs):
         token_type = doc.token_type
         DocTransformer.assert_docs_token_type(token_type, *docs)
-        if token_type == ptoken.EMBED_TYPE:
+        if token_type == "embed_type":
             embed_stat = ListStat(
-                "embed", ptoken.VALUE_FLOAT_TYPE, doc.embed_size
+                "embed", "value_float_type", doc.embed_size
                 )
             context_stat = ListStat(
-                "context", ptoken.LIST_TYPE, self._c_max_len,
+                "context", "list_type", self._c_max_len,
                 is_seq=True, sub_list_stat=embed_stat
                 )
         else:
@@ -29,13 +28,13 @@ class QueAnsTransformer(DocTransformer):
                 is_seq=True)
         return (
             ListStat("question", token_type, self._q_max_len, is_seq=True),
-            ListStat("contexts", ptoken.LIST_TYPE, self._cs_max_size,
+            ListStat("contexts", "list_type", self._cs_max_size,
                      is_seq=True, sub_list_stat=context_stat),
             ListStat("answer", token_type, self._a_max_len, is_seq=True),
-            ListStat("q_len", ptoken.VALUE_INT_TYPE, 1),
-            ListStat("cs_size", ptoken.VALUE_INT_TYPE, 1),
-            ListStat("a_len", ptoken.VALUE_INT_TYPE, 1),
-            ListStat("c_lens", ptoken.VALUE_INT_TYPE,
+            ListStat("q_len", "value_int_type", 1),
+            ListStat("cs_size", "value_int_type", 1),
+            ListStat("a_len", "value_int_type", 1),
+            ListStat("c_lens", "value_int_type",
                      self._cs_max_size, is_seq=True)
         )
 
@@ -45,7 +44,7 @@ class QueAnsTransformer(DocTransformer):
     def transform_seq_docs(self, qa_seq_doc, *qa_seq_docs):
         token_type = qa_seq_doc.token_type
         DocTransformer.assert_docs_token_type(token_type, *qa_seq_docs)
-        if token_type == ptoken.ID_TYPE:
+        if token_type == "id_type":
             create_contexts_f = lambda: np.full(
                 (self._cs_max_size, self._c_max_len),
                 pvocab.PAD_ID, dtype=np.int64
@@ -58,7 +57,7 @@ class QueAnsTransformer(DocTransformer):
                 self._a_max_len,
                 pvocab.PAD_ID, dtype=np.int64
             )
-        elif token_type == ptoken.WORD_TYPE:
+        elif token_type == "word_type":
             create_contexts_f = lambda: np.full(
                 (self._cs_max_size, self._c_max_len),
                 pvocab.PAD, dtype=object
@@ -95,20 +94,20 @@ class QueAnsTransformer(DocTransformer):
             c_index = 0
             for seq, flag in q_a_doc:
                 if flag == "context":
-                    if token_type == ptoken.EMBED_TYPE:
+                    if token_type == "embed_type":
                         context_seqs[c_index, :len(seq), :] = seq
                     else:
                         context_seqs[c_index, :len(seq)] = seq
                     c_index += 1
                     c_lens.append(len(seq))
                 elif flag == "question":
-                    if token_type == ptoken.EMBED_TYPE:
+                    if token_type == "embed_type":
                         q_seq[:len(seq), :] = seq
                     else:
                         q_seq[:len(seq)] = seq
                     q_len = len(seq)
                 elif flag == "answer":
-                    if token_type == ptoken.EMBED_TYPE:
+                    if token_type == "embed_type":
                         a_seq[:len(seq), :] = seq
                     else:
                         a_seq[:len(seq)] = seq
@@ -122,6 +121,84 @@ class QueAnsTransformer(DocTransformer):
                 else:
                     pass
 
+    def transform_seq_docs_batched(self, batch_size, qa_seq_doc, *qa_seq_docs):
+        """
+        Same examples as transform_seq_docs, batch_size at a time:
+        (question, contexts, answer, q_len, cs_size, a_len, c_lens) with a
+        leading batch dim, c_lens padded with 0 to cs_max_size.
+        The arrays are views over buffers reused by the next batch, copy
+        them to keep them. Only the regions written by the previous
+        example of a row are reset to pad.
+        """
+        token_type = qa_seq_doc.token_type
+        DocTransformer.assert_docs_token_type(token_type, *qa_seq_docs)
+        if token_type == "id_type":
+            pad, dtype, embed_shape = pvocab.PAD_ID, np.int64, ()
+        elif token_type == "word_type":
+            pad, dtype, embed_shape = pvocab.PAD, object, ()
+        else:
+            pad, dtype = qa_seq_doc.pad_embedding, np.float64
+            embed_shape = (qa_seq_doc.embed_size,)
+        q_seqs = np.full((batch_size, self._q_max_len) + embed_shape, pad, dtype=dtype)
+        context_seqs = np.full((batch_size, self._cs_max_size, self._c_max_len) + embed_shape,
+                               pad, dtype=dtype)
+        a_seqs = np.full((batch_size, self._a_max_len) + embed_shape, pad, dtype=dtype)
+        q_lens = np.zeros(batch_size, dtype=np.int64)
+        cs_sizes = np.zeros(batch_size, dtype=np.int64)
+        a_lens = np.zeros(batch_size, dtype=np.int64)
+        c_lens = np.zeros((batch_size, self._cs_max_size), dtype=np.int64)
+
+        i = 0
+        for q_seq, contexts, a_seq in self._qa_gen([qa_seq_doc] + list(qa_seq_docs)):
+            q_seqs[i, :q_lens[i]] = pad
+            a_seqs[i, :a_lens[i]] = pad
+            context_seqs[i, :cs_sizes[i], :c_lens[i].max()] = pad
+            c_lens[i] = 0
+
+            q_lens[i], cs_sizes[i], a_lens[i] = len(q_seq), len(contexts), len(a_seq)
+            q_seqs[i, :len(q_seq)] = q_seq
+            a_seqs[i, :len(a_seq)] = a_seq
+            if token_type == "embed_type":
+                for c_i, seq in enumerate(contexts):
+                    context_seqs[i, c_i, :len(seq)] = seq
+                    c_lens[i, c_i] = len(seq)
+            elif contexts:
+                # the whole story at once
+                story_c_lens = np.fromiter(map(len, contexts), dtype=np.int64,
+                                           count=len(contexts))
+                c_lens[i, :len(contexts)] = story_c_lens
+                row_ids = np.repeat(np.arange(len(contexts)), story_c_lens)
+                col_ids = np.arange(len(row_ids)) - np.repeat(
+                    np.cumsum(story_c_lens) - story_c_lens, story_c_lens)
+                story_tokens = np.empty(len(row_ids), dtype=dtype)
+                story_tokens[:] = [token for seq in contexts for token in seq]
+                context_seqs[i, row_ids, col_ids] = story_tokens
+            i += 1
+            if i == batch_size:
+                yield q_seqs, context_seqs, a_seqs, q_lens, cs_sizes, a_lens, c_lens
+                i = 0
+        if i > 0:
+            yield q_seqs[:i], context_seqs[:i], a_seqs[:i], \
+                q_lens[:i], cs_sizes[:i], a_lens[:i], c_lens[:i]
+
+    def _qa_gen(self, qa_seq_docs):
+        for q_a_doc in qa_seq_docs:
+            q_seq, contexts = (), []
+            for seq, flag in q_a_doc:
+                if flag == "context":
+                    contexts.append(seq)
+                elif flag == "question":
+                    q_seq = seq
+                elif flag == "answer":
+                    yield q_seq, contexts, seq
+                    q_seq, contexts = (), []
+
+    def estimate_docs_transformed_size(self, *docs):
+        raise NotImplementedError("Not supported")
+
+    def estimate_seq_docs_transformed_size(self, *qa_seq_docs):
+        return sum(1 for qa_seq_doc in qa_seq_docs for _, flag in qa_seq_doc if flag == "answer")
+
     def estimate_max_size(self, *docs):
         raise NotImplementedError("Not implemented yet")
 
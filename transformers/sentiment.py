@@ -1,3 +1,5 @@
+import itertools
+import numpy as np
 from plp.transformers.interface import DocTransformer, ListStat
 import plp.token as ptoken
 import plp.seq as pseq
@@ -13,11 +15,14 @@ class DocLabelsTransformer(DocTransformer):
     train format, with each batch containing bool flag for the end of the doc
     If seq_len is provided, all the seqs will be truncated or padded to that len
     but the src_len returns the actual length
+    If max_batch_tokens is provided, batch_transform_docs batches the docs of a
+    len bucket by a total padded token budget instead of batch_size
     """
-    def __init__(self, batch_size, seq_len, max_doc_len=None):
+    def __init__(self, batch_size, seq_len, max_doc_len=None, max_batch_tokens=None):
         self._batch_size = batch_size
         self._seq_len = seq_len 
         self._max_doc_len = max_doc_len
+        self._max_batch_tokens = max_batch_tokens
 
     def get_lists_stats(self, doc, *docs):
         token_type = doc.token_type
@@ -64,6 +69,9 @@ class DocLabelsTransformer(DocTransformer):
     def batch_transform_docs(self, doc, *docs, yield_doc=False):
         pad_token = self._validate(doc, *docs)
         docs = [doc] + list(docs)
+        if self._max_batch_tokens is not None:
+            yield from self._token_budget_batch_gen(docs, pad_token, yield_doc)
+            return
         for batched_docs, lens in pdoc.batch_docs_by_len(self._batch_size, self._seq_len, docs):
             #if len(batched_docs) != 32:
             #    pdb.set_trace()
@@ -116,6 +124,32 @@ class DocLabelsTransformer(DocTransformer):
                 else:
                     yield batch_src, batch_src_len, labels, 0, batched_docs
 
+    def _token_budget_batch_gen(self, docs, pad_token, yield_doc):
+        """
+        Same batches as batch_transform_docs but as numpy arrays, src is
+        (num_docs, seq_len), src_len, labels and eod_flag are (num_docs,)
+        """
+        seq_len = self._seq_len
+        dtype = object if docs[0].token_type == "word_type" else np.int64
+        for batched_docs, lens in pdoc.batch_docs_by_token_budget(
+                self._max_batch_tokens, seq_len, docs, self._max_doc_len):
+            num_seqs = max(-(-max(lens) // seq_len), 1)
+            if self._max_doc_len is not None:
+                num_seqs = min(num_seqs, max(-(-self._max_doc_len // seq_len), 1))
+            num_tokens = num_seqs * seq_len
+            src = np.full((len(batched_docs), num_tokens), pad_token, dtype=dtype)
+            for i, doc_ in enumerate(batched_docs):
+                tokens = list(itertools.islice(iter(doc_), num_tokens))
+                src[i, :len(tokens)] = tokens
+            doc_lens = np.minimum(np.asarray(lens, dtype=np.int64), num_tokens)
+            labels = np.asarray([doc_.get_label("label") for doc_ in batched_docs])
+            for seq_i in range(num_seqs):
+                start = seq_i * seq_len
+                batch_src_len = np.clip(doc_lens - start, 0, seq_len).astype(np.int32)
+                eod_flag = np.full(len(batched_docs), int(seq_i == num_seqs - 1), dtype=np.int32)
+                batch = (src[:, start:start + seq_len], batch_src_len, labels, eod_flag)
+                yield batch + (batched_docs,) if yield_doc else batch
+
     def _validate(self, doc, *docs):
         assert self._seq_len is not None
         token_type = doc.token_type
@@ -0,0 +1,331 @@
+import os
+import json
+import shutil
+import tempfile
+import itertools
+import plp.doc as pdoc
+import plp.seq as pseq
+import plp.token as ptoken
+import plp.vocab as pvocab
+import plp.pipeline as ppipeline
+import unittest
+
+BABI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "babi_sample")
+BABI_PATH = os.path.join(BABI_DIR, "qa1_single-supporting-fact_test.txt")
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self._cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._cache_dir)
+
+    def _create_docs(self, gen_eol_type):
+        doc = pdoc.Document.create_from_txt(
+            BABI_PATH, "word_type", gen_eol_type, isolating_tokens=["\t"])
+        cached_doc = pdoc.Document.create_from_txt(
+            BABI_PATH, "word_type", gen_eol_type, isolating_tokens=["\t"],
+            cache_dir=self._cache_dir)
+        return doc, cached_doc
+
+    def test_same_tokens(self):
+        for gen_eol_type in ("yield_eol", "ignore_eol", "keep_eol_nl"):
+            doc, cached_doc = self._create_docs(gen_eol_type)
+            self.assertEqual(list(doc), list(cached_doc))
+            # second pass reads from the built cache
+            self.assertEqual(list(doc), list(cached_doc))
+            self.assertEqual(doc.applied_flag_tokens, cached_doc.applied_flag_tokens)
+
+    def test_invalidated_by_key(self):
+        _, cached_doc = self._create_docs("keep_eol_nl")
+        list(cached_doc)
+        cached_doc = pdoc.Document.create_from_txt(
+            BABI_PATH, "word_type", "keep_eol_nl", cache_dir=self._cache_dir)
+        doc = pdoc.Document.create_from_txt(BABI_PATH, "word_type", "keep_eol_nl")
+        self.assertEqual(list(doc), list(cached_doc))
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        doc = pdoc.Document.create_from_txt(BABI_PATH, "word_type", "ignore_eol")
+        self._vocab = pvocab.create_vocab_from_docs(
+            [doc], 20, os.path.join(self._tmp_dir, "vocab.txt"),
+            os.path.join(self._tmp_dir, "count.txt"))
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_compile_ops(self):
+        ops = [ppipeline.MapOp("a", str.strip), ppipeline.MapOp("b", str.lower),
+               ppipeline.GenOp("c", lambda it: it), ppipeline.MapOp("d", str.upper)]
+        stages = ppipeline.compile_ops(ops)
+        self.assertEqual([stage.name for stage in stages], ["a+b", "c", "d"])
+
+    def test_fused_map_op_memo(self):
+        calls = []
+
+        def upper(token):
+            calls.append(token)
+            return token.upper()
+        tokens = ["a", "b", "c", "a", "b", "c", "a"]
+        fused = ppipeline.FusedMapOp([ppipeline.MapOp("upper", upper)])
+        self.assertEqual(list(fused(tokens)), [token.upper() for token in tokens])
+        self.assertEqual(calls, ["a", "b", "c"])
+        # bounded: cleared once full
+        del calls[:]
+        memo_max_size = ppipeline.MEMO_MAX_SIZE
+        ppipeline.MEMO_MAX_SIZE = 2
+        try:
+            self.assertEqual(list(fused(tokens)), [token.upper() for token in tokens])
+            self.assertEqual(calls, ["a", "b", "c", "a", "b", "c", "a"])
+        finally:
+            ppipeline.MEMO_MAX_SIZE = memo_max_size
+        del calls[:]
+        fused = ppipeline.FusedMapOp([ppipeline.MapOp("upper", upper),
+                                      ppipeline.MapOp("embed", str.lower, memoize=False)])
+        self.assertEqual(list(fused(tokens)), tokens)
+        self.assertEqual([chunk for chunk in fused.iter_chunks([tokens[:4], tokens[4:]], 4)],
+                         [tokens[:4], tokens[4:]])
+        self.assertEqual(calls, tokens + tokens)
+
+    def test_fused_map_ops(self):
+        doc = pdoc.Document.create_from_txt(
+            BABI_PATH, "word_type", "yield_eol", self._vocab)
+        doc.strip_tokens()
+        skip_num_transformer = ptoken.TokenTransformer(
+            lambda left, center, right: ptoken.is_num(center),
+            num_left_tokens=0, num_right_tokens=0)
+        doc.skip_tokens([skip_num_transformer])
+        doc.mask_unk()
+        doc.toggle_word_id()
+
+        expected = []
+        raw_doc = pdoc.Document.create_from_txt(BABI_PATH, "word_type", "yield_eol")
+        for token in raw_doc:
+            token = token.strip()
+            if ptoken.is_num(token):
+                continue
+            if not self._vocab.check_word_exist(token):
+                token = pvocab.UNK
+            expected.append(self._vocab.word2id(token))
+        self.assertEqual(list(doc), expected)
+
+class TestIterChunks(unittest.TestCase):
+
+    def _create_doc(self, **kwargs):
+        doc = pdoc.Document.create_from_txt(
+            BABI_PATH, "word_type", "keep_eol_nl", isolating_tokens=["\t"], **kwargs)
+        doc.record_new_flag_tokens("\t")
+        babi_num_skip_transformer = ptoken.TokenTransformer(
+            lambda left, center, right: right[0] != "\n" and ptoken.is_num(center),
+            num_left_tokens=0, num_right_tokens=1)
+        doc.skip_tokens([babi_num_skip_transformer])
+        doc.strip_tokens()
+        comma_transformer = ptoken.TokenTransformer(
+            lambda left, center, right: [center[:-1]] if center[-1] == "." else None,
+            num_left_tokens=0, num_right_tokens=0)
+        doc.transform_tokens([comma_transformer])
+        return doc
+
+    def test_same_as_iter(self):
+        doc = self._create_doc()
+        tokens = list(doc)
+        for chunk_size in (1, 7, 4096):
+            chunks = list(doc.iter_chunks(chunk_size))
+            self.assertEqual(list(itertools.chain.from_iterable(chunks)), tokens)
+        self.assertEqual(len(doc), len(tokens))
+
+    def test_cached_source(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            doc = self._create_doc(cache_dir=cache_dir)
+            chunks = list(doc.iter_chunks(5))
+            self.assertEqual(list(itertools.chain.from_iterable(chunks)),
+                             list(self._create_doc()))
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+class TestParallelLoading(unittest.TestCase):
+
+    def setUp(self):
+        self._txt_dir = tempfile.mkdtemp()
+        with open(BABI_PATH) as f:
+            lines = f.readlines()
+        for i in range(6):
+            with open(os.path.join(self._txt_dir, "%d.txt" % i), "w") as f:
+                f.writelines(lines[i * 10:(i + 1) * 10])
+
+    def tearDown(self):
+        shutil.rmtree(self._txt_dir)
+
+    def test_same_as_serial(self):
+        def prepare_doc(doc):
+            doc.strip_tokens()
+            doc.skip_tokens([ptoken.TokenTransformer(
+                lambda left, center, right: ptoken.is_num(center), 0, 0)])
+            doc.set_label("label", doc.f_name)
+
+        serial_docs = list(pdoc.gen_from_txt_dir(self._txt_dir, "word_type", "yield_eol"))
+        for doc in serial_docs:
+            prepare_doc(doc)
+        parallel_docs = list(pdoc.gen_from_txt_dir_parallel(
+            self._txt_dir, "word_type", "yield_eol", prepare_doc_f=prepare_doc,
+            num_workers=2, max_in_flight=2))
+        self.assertEqual(len(serial_docs), len(parallel_docs))
+        for doc, parallel_doc in zip(serial_docs, parallel_docs):
+            self.assertEqual(doc.src_path, parallel_doc.src_path)
+            self.assertEqual(doc.get_label("label"), parallel_doc.get_label("label"))
+            self.assertEqual(list(doc), list(parallel_doc))
+            self.assertEqual(len(doc), len(parallel_doc))
+        created_docs = pdoc.create_from_txt_dir_parallel(
+            self._txt_dir, "word_type", "yield_eol", prepare_doc_f=prepare_doc,
+            num_workers=2, max_in_flight=1)
+        self.assertEqual([list(doc) for doc in created_docs],
+                         [list(doc) for doc in serial_docs])
+
+
+class TestBatchDocsByLen(unittest.TestCase):
+    def setUp(self):
+        self._txt_dir = tempfile.mkdtemp()
+        with open(BABI_PATH) as f:
+            lines = f.readlines()
+        for i in range(20):
+            with open(os.path.join(self._txt_dir, "%d.txt" % i), "w") as f:
+                f.writelines(lines[:(i * 7) % 23 + 1])
+
+    def tearDown(self):
+        shutil.rmtree(self._txt_dir)
+
+    def _create_docs(self):
+        return pdoc.create_from_txt_dir(self._txt_dir, "word_type", "ignore_eol")
+
+    def test_buckets(self):
+        docs = self._create_docs()
+        lens = [len(doc) for doc in docs]
+        self.assertEqual(pdoc.compute_docs_lens(self._create_docs(), num_workers=2), lens)
+        for shuffle_seed in (None, 1):
+            batches = list(pdoc.batch_docs_by_len(4, 30, docs, shuffle_seed=shuffle_seed))
+            buckets = [(batch_lens[0] - 1) // 30 for _, batch_lens in batches]
+            self.assertEqual(buckets, sorted(buckets))
+            for batch, batch_lens in batches:
+                self.assertLessEqual(len(batch), 4)
+                self.assertEqual([len(doc) for doc in batch], batch_lens)
+                self.assertEqual(len(set((doc_len - 1) // 30 for doc_len in batch_lens)), 1)
+            self.assertEqual(sorted(id(doc) for batch, _ in batches for doc in batch),
+                             sorted(id(doc) for doc in docs))
+        self.assertEqual(list(pdoc.batch_docs_by_len(4, 30, docs, shuffle_seed=1)),
+                         list(pdoc.batch_docs_by_len(4, 30, docs, shuffle_seed=1)))
+
+    def test_lens_sidecar(self):
+        lens_f_path = os.path.join(self._txt_dir, "lens.json")
+        docs = self._create_docs()
+        lens = pdoc.compute_docs_lens(docs, lens_f_path=lens_f_path)
+        with open(lens_f_path) as f:
+            stored_lens = json.load(f)
+        self.assertEqual(sorted(stored_lens.values()), sorted(lens))
+        # read back from the sidecar without iterating the docs
+        stored_lens = {key: doc_len + 1 for key, doc_len in stored_lens.items()}
+        with open(lens_f_path, "w") as f:
+            json.dump(stored_lens, f)
+        self.assertEqual(pdoc.compute_docs_lens(self._create_docs(), lens_f_path=lens_f_path),
+                         [doc_len + 1 for doc_len in lens])
+        # a different pipeline is another key
+        docs = self._create_docs()
+        for doc in docs:
+            doc.strip_tokens()
+        self.assertEqual(pdoc.compute_docs_lens(docs, lens_f_path=lens_f_path), lens)
+
+    def test_lens_sidecar_keys(self):
+        lens_f_path = os.path.join(self._txt_dir, "lens.json")
+        txt_path = os.path.join(self._txt_dir, "3.txt")
+
+        def create_doc(gen_eol_type, skip_tokens=(), cache_key=None):
+            doc = pdoc.Document.create_from_txt(txt_path, "word_type", gen_eol_type)
+            doc.skip_tokens([ptoken.TokenTransformer(
+                lambda left, center, right: center in skip_tokens, 0, 0)], cache_key)
+            return doc
+
+        def check_lens(*create_args):
+            docs = [create_doc(*args) for args in create_args]
+            true_lens = [len(create_doc(*args)) for args in create_args]
+            self.assertEqual(pdoc.compute_docs_lens(docs, lens_f_path=lens_f_path), true_lens)
+
+        # same op name, different transformers, not stored without a cache_key
+        check_lens(("ignore_eol", ("Mary",)), ("ignore_eol", ("Mary", "to", "the")))
+        self.assertFalse(os.path.exists(lens_f_path))
+        check_lens(("ignore_eol", ("Mary",), "mary"),
+                   ("ignore_eol", ("Mary", "to", "the"), "mary_to_the"))
+        check_lens(("ignore_eol", ("Mary", "to", "the"), "mary_to_the"),
+                   ("ignore_eol", ("Mary",), "mary"))
+        # same file and pipeline read with other gen_eol_types
+        check_lens(("yield_eol", (), "none"), ("ignore_eol", (), "none"),
+                   ("keep_eol_nl", (), "none"))
+        with open(lens_f_path) as f:
+            self.assertEqual(len(json.load(f)), 5)
+
+
+class TestContextWindow(unittest.TestCase):
+
+    def test_window(self):
+        window = ptoken.ContextWindow(iter(range(10)), 2, 3)
+        window.fill_right()
+        windows = []
+        while window.has_center:
+            windows.append((list(window.left), window.center, list(window.right)))
+            window.shift()
+        self.assertEqual(windows[0], ([], 0, [1, 2, 3]))
+        self.assertEqual(windows[4], ([2, 3], 4, [5, 6, 7]))
+        self.assertEqual(windows[-1], ([7, 8], 9, []))
+        self.assertEqual(len(windows), 10)
+
+    def test_views(self):
+        window = ptoken.ContextWindow(iter([("a", 1), ("b", 2), ("c", 3)]), 2, 2, field=1)
+        window.fill_right()
+        self.assertEqual(window.right, [2, 3])
+        self.assertEqual(window.right[-1], 3)
+        self.assertEqual(list(window.right[1:]), [3])
+        window.shift()
+        window.shift()
+        self.assertEqual(window.left, [1, 2])
+        self.assertEqual(len(window.right), 0)
+
+    def test_babi_transform_flags(self):
+        doc = pdoc.Document.create_from_txt(
+            BABI_PATH, "word_type", "keep_eol_nl", isolating_tokens=["\t"])
+        doc.record_new_flag_tokens("\t")
+        doc.skip_tokens([ptoken.TokenTransformer(
+            lambda left, center, right: right[0] != "\n" and ptoken.is_num(center),
+            num_left_tokens=0, num_right_tokens=1)])
+        doc.transform_tokens([ptoken.TokenTransformer(
+            lambda left, center, right: [center[:-1]] if center[-1] in ".?" else None,
+            num_left_tokens=0, num_right_tokens=0)])
+        seq_doc = pseq.SeqDocument.create_flag_separated_seq_doc(doc)
+
+        def babi_qa_token_transform_f(left, center, right):
+            if left[0] == "\n" and center == "\t":
+                return "question"
+            elif left[0] == "\t" and center == "\t":
+                return "answer"
+            elif left[0] == "\t" and center == "\n":
+                return "support_id"
+            return None
+        seq_doc.transform_flags([
+            ptoken.TokenTransformer(babi_qa_token_transform_f, 1, 0),
+            ptoken.TokenTransformer(
+                lambda left, center, right: "context" if center == "\n" else None, 0, 0)])
+        with open(os.path.join(BABI_DIR, "qa1-flag-updated.txt")) as f:
+            expected_flags = f.read().split()
+        with open(os.path.join(BABI_DIR, "qa1-seq-updated.txt")) as f:
+            expected_seqs = [line.split() for line in f]
+        seqs, flags = zip(*seq_doc)
+        self.assertEqual(list(flags), expected_flags)
+        self.assertEqual([list(seq) for seq in seqs], expected_seqs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,143 @@
-import tensorflow as tf
+import os
+import shutil
+import tempfile
+import numpy as np
+import plp.doc as pdoc
+import plp.vocab as pvocab
+import plp.transformers.embeddings as embeddings
+from plp.transformers.embeddings import Word2vecTransformer
+import unittest
+
+BABI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "babi_sample", "qa1_single-supporting-fact_test.txt")
 
 
 class TestWord2vec(unittest.TestCase):
     def setUp(self):
-        pass
+        self._tmp_dir = tempfile.mkdtemp()
+        doc = pdoc.Document.create_from_txt(BABI_PATH, "word_type", "ignore_eol")
+        self._vocab = pvocab.create_vocab_from_docs(
+            [doc], 100, os.path.join(self._tmp_dir, "vocab.txt"),
+            os.path.join(self._tmp_dir, "count.txt"))
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
 
     def test_doc_transform(self):
         pass
+
+    def _create_id_docs(self):
+        docs = []
+        for i in range(2):
+            doc = pdoc.Document.create_from_txt(
+                BABI_PATH, "word_type", "ignore_eol", self._vocab)
+            doc.toggle_word_id()
+            docs.append(doc)
+        return docs
+
+    def _assert_batched_same_as_gen(self, transformer, docs):
+        pairs = list(transformer.transform_docs(*docs))
+        blocks = list(transformer.transform_docs_batched(*docs))
+        centers = np.concatenate([centers for centers, _ in blocks])
+        contexts = np.concatenate([contexts for _, contexts in blocks])
+        self.assertEqual(list(zip(centers.tolist(), contexts.tolist())), pairs)
+        return pairs
+
+    def test_batched_same_as_gen(self):
+        docs = self._create_id_docs()
+        for window_size in (1, 3, 50):
+            self._assert_batched_same_as_gen(Word2vecTransformer(window_size), docs)
+
+    def test_subsampling_dynamic_window(self):
+        docs = self._create_id_docs()
+        all_pairs = list(Word2vecTransformer(3).transform_docs(*docs))
+        transformer = Word2vecTransformer(
+            3, subsample_threshold=1e-3, dynamic_window=True,
+            vocab_reader=self._vocab, seed=3)
+        pairs = self._assert_batched_same_as_gen(transformer, docs)
+        self.assertEqual(pairs, list(transformer.transform_docs(*docs)))
+        self.assertLess(len(pairs), len(all_pairs) / 2)
+        # estimates ignore UNK, compared relative to the unsampled one
+        estimated_ratio = (transformer.estimate_docs_transformed_size(*docs) /
+                           Word2vecTransformer(3).estimate_docs_transformed_size(*docs))
+        self.assertAlmostEqual(estimated_ratio, len(pairs) / len(all_pairs), delta=0.05)
+
+        word_docs = [pdoc.Document.create_from_txt(
+            BABI_PATH, "word_type", "ignore_eol", self._vocab) for _ in docs]
+        for doc in word_docs:
+            doc.mask_unk()
+        word_pairs = transformer.transform_docs(*word_docs)
+        self.assertEqual([(self._vocab.word2id(center), self._vocab.word2id(context))
+                          for center, context in word_pairs], pairs)
+
+    def test_negatives(self):
+        docs = self._create_id_docs()
+        transformer = Word2vecTransformer(
+            2, vocab_reader=self._vocab, seed=5, num_negatives=3)
+        self.assertEqual([stat.list_len for stat in transformer.get_lists_stats(*docs)],
+                         [1, 1, 3])
+        examples = list(transformer.transform_docs(*docs))
+        blocks = list(transformer.transform_docs_batched(*docs))
+        self.assertEqual([(center, context) for center, context, _ in examples],
+                         list(Word2vecTransformer(2).transform_docs(*docs)))
+        negatives = np.concatenate([negatives for _, _, negatives in blocks])
+        self.assertEqual([negatives for _, _, negatives in examples], negatives.tolist())
+
+        counts = np.asarray(self._vocab.vocab_counts_list, dtype=np.float64)
+        expected_probs = counts ** 0.75 / (counts ** 0.75).sum()
+        alias_table = embeddings.create_alias_table(expected_probs)
+        sampled = np.bincount(
+            embeddings.alias_sample(alias_table, 200000, np.random.RandomState(0)),
+            minlength=len(counts))
+        self.assertEqual(sampled[counts == 0].sum(), 0)
+        np.testing.assert_allclose(sampled / sampled.sum(), expected_probs, atol=0.005)
+
+
+class TestSca2word(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self._tmp_dir, "vocab.txt"), "w") as f:
+            f.write("\n".join([pvocab.UNK, pvocab.SOS, pvocab.EOS, pvocab.PAD,
+                               "a", "b", "c", "1", "2.5"]))
+        self._vocab = pvocab.Vocab(os.path.join(self._tmp_dir, "vocab.txt"))
+        rng = np.random.RandomState(0)
+        words = ["a", "b", "c", "x", "1", "2.5", "-3"]
+        self._doc_path = os.path.join(self._tmp_dir, "doc.txt")
+        with open(self._doc_path, "w") as f:
+            for _ in range(200):
+                f.write(" ".join(rng.choice(words, 10)) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_precomputed_masks(self):
+        for window_size in (1, 2):
+            transformer = embeddings.Sca2wordTransformer(
+                "value_float_type", window_size, 3, self._vocab)
+            masks_transformer = embeddings.Sca2wordTransformer(
+                "value_float_type", window_size, 3, self._vocab, precompute_masks=True)
+            doc = pdoc.Document.create_from_txt(self._doc_path, "word_type", "ignore_eol")
+            examples = list(transformer.transform_docs(doc))
+            self.assertTrue(examples)
+            self.assertEqual(list(masks_transformer.transform_docs(doc)), examples)
+            self.assertEqual(list(masks_transformer.transform_docs2(doc)),
+                             list(transformer.transform_docs2(doc)))
+            self.assertEqual(list(masks_transformer.u_v_w_gen_with_label(doc)),
+                             list(transformer.u_v_w_gen_with_label(doc)))
+
+    def test_estimate_size(self):
+        doc = pdoc.Document.create_from_txt(self._doc_path, "word_type", "ignore_eol")
+        for window_size, each_num_examples in ((1, 3), (2, 1)):
+            transformer = embeddings.Sca2wordTransformer(
+                "value_float_type", window_size, each_num_examples, self._vocab)
+            self.assertEqual(transformer.estimate_docs_transformed_size(doc, doc),
+                             len(list(transformer.transform_docs(doc, doc))))
+            self.assertEqual(transformer.estimate_docs_single_transformed_size(doc),
+                             len(list(transformer.transform_docs2(doc))))
+            self.assertEqual(
+                transformer.estimate_docs_transformed_size(*[doc] * 4, sample_rate=0.5),
+                4 * transformer.estimate_docs_transformed_size(doc))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import itertools
+import plp.doc as pdoc
+import plp.vocab as pvocab
+from plp.transformers.lang_gen import PackedLangModelTransformer
+import unittest
+
+BABI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "babi_sample", "qa1_single-supporting-fact_test.txt")
+
+
+class TestPackedLangModel(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        doc = pdoc.Document.create_from_txt(BABI_PATH, "word_type", "ignore_eol")
+        self._vocab = pvocab.create_vocab_from_docs(
+            [doc], 30, os.path.join(self._tmp_dir, "vocab.txt"))
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_packed_blocks(self):
+        docs = []
+        for _ in range(3):
+            doc = pdoc.Document.create_from_txt(
+                BABI_PATH, "word_type", "ignore_eol", self._vocab)
+            doc.mask_unk()
+            doc.toggle_word_id()
+            docs.append(doc)
+        packed = list(itertools.chain.from_iterable(
+            list(doc) + [pvocab.EOS_ID] for doc in docs))
+        for block_len in (1, 7, 128):
+            transformer = PackedLangModelTransformer(block_len)
+            examples = list(transformer.transform_docs(*docs))
+            self.assertEqual(len(examples), transformer.estimate_docs_transformed_size(*docs))
+            self.assertEqual(len(examples), (len(packed) - 1) // block_len)
+            for i, (inputs, targets) in enumerate(examples):
+                self.assertEqual(inputs.tolist(), packed[i * block_len:(i + 1) * block_len])
+                self.assertEqual(targets.tolist(), packed[i * block_len + 1:(i + 1) * block_len + 1])
+
+    def test_id_type_flag_tokens(self):
+        doc = pdoc.Document.create_from_txt(
+            BABI_PATH, "word_type", "keep_eol_nl", self._vocab)
+        doc.toggle_word_id()
+        tokens = [pvocab.EOS_ID if token == "\n" else token for token in doc]
+        self.assertIn(pvocab.EOS_ID, tokens)
+        packed = tokens + [pvocab.EOS_ID]
+        transformer = PackedLangModelTransformer(9)
+        examples = list(transformer.transform_docs(doc))
+        self.assertEqual(len(examples), (len(packed) - 1) // 9)
+        for i, (inputs, targets) in enumerate(examples):
+            self.assertEqual(inputs.tolist(), packed[i * 9:(i + 1) * 9])
+            self.assertEqual(targets.tolist(), packed[i * 9 + 1:(i + 1) * 9 + 1])
+
+    def test_word_type(self):
+        doc = pdoc.Document.create_from_txt(BABI_PATH, "word_type", "ignore_eol")
+        tokens = list(doc) + [pvocab.EOS]
+        transformer = PackedLangModelTransformer(16)
+        stats = transformer.get_lists_stats(doc)
+        self.assertEqual([(stat.name, stat.list_len) for stat in stats],
+                         [("input", 16), ("target", 16)])
+        inputs, targets = next(transformer.transform_docs(doc))
+        self.assertEqual(inputs.tolist(), tokens[:16])
+        self.assertEqual(targets.tolist(), tokens[1:17])
+
+
+if __name__ == '__main__':
+    unittest.main()
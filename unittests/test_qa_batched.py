@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import plp.doc as pdoc
+import plp.seq as pseq
+import plp.vocab as pvocab
+import plp.serializers.columnar as pcolumnar
+import plp.deserializers.columnar as pdcolumnar
+from plp.transformers.qa import QueAnsTransformer
+from plp.transformers.interface import DocTransformState
+import unittest
+
+
+class TestQueAnsBatched(unittest.TestCase):
+    def _create_seq_doc(self, token_type, seed):
+        rng = np.random.RandomState(seed)
+        tokens = []
+        for _ in range(30):
+            for _ in range(rng.randint(0, 5)):
+                tokens += [int(token) for token in rng.randint(4, 50, rng.randint(1, 7))]
+                tokens.append("context")
+            tokens += [int(token) for token in rng.randint(4, 50, rng.randint(1, 5))]
+            tokens.append("question")
+            tokens += [int(token) for token in rng.randint(4, 50, rng.randint(1, 3))]
+            tokens.append("answer")
+        if token_type != "id_type":
+            tokens = [token if isinstance(token, str) else "w%d" % token for token in tokens]
+        flag_tokens = ["context", "question", "answer"]
+        if token_type == "embed_type":
+            doc = pdoc.Document.create_from_tokens(
+                tokens, "word_type", flag_tokens=flag_tokens, vocab_reader=self._embed)
+            doc.convert_embed()
+        else:
+            doc = pdoc.Document.create_from_tokens(tokens, token_type, flag_tokens=flag_tokens)
+        return pseq.SeqDocument.create_flag_separated_seq_doc(doc)
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        vocab_path = os.path.join(self._tmp_dir, "vocab.txt")
+        embed_path = os.path.join(self._tmp_dir, "embed.npy")
+        with open(vocab_path, "w") as f:
+            f.write("\n".join([pvocab.UNK, pvocab.SOS, pvocab.EOS, pvocab.PAD] +
+                              ["w%d" % i for i in range(4, 30)]))
+        np.save(embed_path, np.random.RandomState(0).rand(30, 5).astype(np.float32))
+        self._embed = pvocab.Embed(vocab_path, embed_path)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_same_as_transform_seq_docs(self):
+        qa_transformer = QueAnsTransformer(6, 4, 6, 2)
+        for token_type in ("id_type", "word_type", "embed_type"):
+            seq_docs = [self._create_seq_doc(token_type, seed) for seed in range(3)]
+            examples = list(qa_transformer.transform_seq_docs(*seq_docs))
+            batched_examples = []
+            for batch in qa_transformer.transform_seq_docs_batched(7, *seq_docs):
+                self.assertLessEqual(len(batch[0]), 7)
+                for q, cs, a, q_len, cs_size, a_len, c_lens in zip(*batch):
+                    batched_examples.append((q.tolist(), cs.tolist(), a.tolist(), q_len,
+                                             cs_size, a_len, c_lens[:cs_size].tolist()))
+            self.assertEqual(len(batched_examples), len(examples))
+            for batched_example, (q, cs, a, q_len, cs_size, a_len, c_lens) in \
+                    zip(batched_examples, examples):
+                self.assertEqual(batched_example, (q.tolist(), cs.tolist(), a.tolist(),
+                                                   q_len[0], cs_size[0], a_len[0], c_lens))
+
+    def test_columnar_save(self):
+        seq_docs = [self._create_seq_doc("id_type", seed) for seed in range(2)]
+        state = DocTransformState(seq_docs, QueAnsTransformer(6, 4, 6, 2), None)
+        save_dir = os.path.join(self._tmp_dir, "qa")
+        pcolumnar.seq_docs_transformed_save(state, save_dir)
+        dataset = pdcolumnar.ColumnarDataset(save_dir)
+        examples = list(state.transformer.transform_seq_docs(*seq_docs))
+        self.assertEqual(len(dataset), len(examples))
+        for example, saved_example in zip(examples, dataset):
+            for t_list, saved_t_list in zip(example, saved_example):
+                self.assertEqual(np.asarray(t_list).tolist(), np.asarray(saved_t_list).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
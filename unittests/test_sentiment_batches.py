@@ -0,0 +1,57 @@
+import numpy as np
+import plp.doc as pdoc
+import plp.vocab as pvocab
+from plp.transformers.sentiment import DocLabelsTransformer
+import unittest
+
+
+class TestDocLabelBatches(unittest.TestCase):
+    def _create_docs(self):
+        rng = np.random.RandomState(0)
+        docs = []
+        for i in range(50):
+            tokens = [int(token) for token in rng.randint(4, 100, rng.randint(1, 40))]
+            doc = pdoc.Document.create_from_tokens(tokens, "id_type")
+            doc.set_label("label", i % 3)
+            docs.append(doc)
+        return docs
+
+    def test_token_budget_buckets(self):
+        docs = self._create_docs()
+        for max_doc_len in (None, 12):
+            batched_ids = []
+            for batched_docs, lens in pdoc.batch_docs_by_token_budget(60, 5, docs, max_doc_len):
+                num_seqs = [max(-(-doc_len // 5), 1) for doc_len in lens]
+                if max_doc_len is not None:
+                    num_seqs = [min(num_seqs_, 3) for num_seqs_ in num_seqs]
+                # one len bucket per batch, within the budget unless a single doc
+                self.assertEqual(len(set(num_seqs)), 1)
+                self.assertTrue(len(batched_docs) == 1 or len(batched_docs) * num_seqs[0] * 5 <= 60)
+                batched_ids.extend(id(doc) for doc in batched_docs)
+            self.assertEqual(sorted(batched_ids), sorted(id(doc) for doc in docs))
+
+    def test_token_budget_batches(self):
+        docs = self._create_docs()
+        # max_doc_len truncates at seq granularity, 12 -> 3 seqs of 5
+        for max_doc_len, max_num_tokens in ((None, None), (12, 15)):
+            transformer = DocLabelsTransformer(1, 5, max_doc_len, max_batch_tokens=60)
+            tokens_by_doc = {}
+            for src, src_len, labels, eod_flag, batched_docs in \
+                    transformer.batch_transform_docs(*docs, yield_doc=True):
+                self.assertLessEqual(src.size, 60)
+                self.assertEqual(src.shape, (len(batched_docs), 5))
+                for i, doc in enumerate(batched_docs):
+                    self.assertEqual(labels[i], doc.get_label("label"))
+                    self.assertTrue(all(token == pvocab.PAD_ID for token in src[i, src_len[i]:]))
+                    doc_tokens = tokens_by_doc.setdefault(id(doc), [])
+                    self.assertNotIn(None, doc_tokens)
+                    doc_tokens.extend(src[i, :src_len[i]].tolist())
+                    if eod_flag[i]:
+                        doc_tokens.append(None)
+            for doc in docs:
+                expected_tokens = list(doc)[:max_num_tokens] + [None]
+                self.assertEqual(tokens_by_doc[id(doc)], expected_tokens)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,308 @@
+import os
+import gzip
+import shutil
+import tempfile
+import plp.doc as pdoc
+import plp.vocab as pvocab
+import numpy as np
+import plp.serializers.txt as ptxt
+import plp.serializers.columnar as pcolumnar
+import plp.serializers.tfrecords as ptfrecords
+import plp.serializers.tfrecord_writer as ptfrecord_writer
+import plp.deserializers.columnar as pdcolumnar
+import plp.utils.file as pfile
+from plp.transformers.lang_gen import PackedLangModelTransformer
+from plp.transformers.embeddings import Word2vecTransformer
+from plp.transformers.interface import DocTransformState, ListStat
+import unittest
+
+BABI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "babi_sample", "qa1_single-supporting-fact_test.txt")
+
+
+class TestResumableSave(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._num_iters = 0
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _create_docs(self, failing_doc_i=None):
+        docs = []
+        for i in range(5):
+            def tokens_iter_f(i=i):
+                self._num_iters += 1
+                if i == failing_doc_i:
+                    raise IOError("failed")
+                return iter(range(i * 10, i * 10 + 23))
+            docs.append(pdoc.Document(tokens_iter_f, "id_type", src_path="doc%d.txt" % i))
+        return docs
+
+    def _save(self, docs, out_dir, size=None):
+        save_paths = [os.path.join(out_dir, "input.txt"), os.path.join(out_dir, "target.txt")]
+        return ptxt.docs_transformed_save_resumable(
+            DocTransformState(docs, PackedLangModelTransformer(4), size), save_paths, 2)
+
+    def _read_shards(self, shards):
+        contents = []
+        for shard in shards:
+            for path in shard["paths"]:
+                with open(path) as f:
+                    contents.append((os.path.basename(path), f.read()))
+        return contents
+
+    def test_resume(self):
+        out_dir = os.path.join(self._tmp_dir, "resumed")
+        os.mkdir(out_dir)
+        with self.assertRaises(IOError):
+            self._save(self._create_docs(failing_doc_i=3), out_dir)
+        self.assertEqual(sorted(os.listdir(out_dir)),
+                         ["input.checkpoint.json", "input_00000.txt", "target_00000.txt"])
+
+        self._num_iters = 0
+        shards = self._save(self._create_docs(), out_dir)
+        # only the docs of the last two shards are transformed again
+        self.assertEqual(self._num_iters, 3)
+        self.assertEqual([(shard["doc_start"], shard["doc_end"]) for shard in shards],
+                         [(0, 2), (2, 4), (4, 5)])
+        self.assertEqual(self._save(self._create_docs(), out_dir), shards)
+
+        full_dir = os.path.join(self._tmp_dir, "full")
+        os.mkdir(full_dir)
+        full_shards = self._save(self._create_docs(), full_dir)
+        self.assertEqual(self._read_shards(shards), self._read_shards(full_shards))
+        self.assertEqual(sum(shard["num_records"] for shard in shards), 2 * 11 + 5)
+
+    def test_size(self):
+        shards = self._save(self._create_docs(), self._tmp_dir, size=13)
+        self.assertEqual([shard["num_records"] for shard in shards], [11, 2])
+
+
+class TestTxtSave(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_lists_byte_identical(self):
+        lists_stats = (
+            ListStat("ids", "id_type", 4, is_seq=True),
+            ListStat("words", "word_type", 3, is_seq=True),
+            ListStat("scores", "value_float_type", 2),
+            ListStat("embeds", "list_type", 2, is_seq=True,
+                     sub_list_stat=ListStat("embed", "value_float_type", 3)),
+            ListStat("contexts", "list_type", 2, is_seq=True,
+                     sub_list_stat=ListStat("context", "id_type", 2))
+        )
+        rng = np.random.RandomState(0)
+        examples = [(np.arange(i, i + 4), ["a", "b", "c%d" % i],
+                     np.array([0.1, 0.25 * i], dtype=np.float32),
+                     rng.rand(2, 3).astype(np.float32),
+                     np.array([[i, 1], [2, 3]]))
+                    for i in range(5)]
+        save_paths = [os.path.join(self._tmp_dir, "%s.txt" % list_stat.name)
+                      for list_stat in lists_stats]
+        ptxt._transformed_save(iter(examples), lists_stats, save_paths, None)
+        # the previous writers: str() of each token
+        for i, save_path in enumerate(save_paths):
+            lines = []
+            for example in examples:
+                if lists_stats[i].token_type == "list_type":
+                    lines.append("".join(" ".join(str(token) for token in sub_list) + "\t"
+                                         for sub_list in example[i]))
+                else:
+                    lines.append(" ".join(str(token) for token in example[i]))
+            with open(save_path) as f:
+                self.assertEqual(f.read(), "\n".join(lines) + "\n")
+        with open(save_paths[2]) as f:
+            self.assertEqual(f.readline(), "0.1 0.0\n")
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_doc_round_trip(self):
+        doc = pdoc.Document.create_from_txt(BABI_PATH, "word_type", "keep_eol_nl")
+        gz_path = os.path.join(self._tmp_dir, "doc.txt.gz")
+        doc.save_as_txt(gz_path)
+        with open(gz_path, "rb") as f:
+            self.assertEqual(f.read(2), b"\x1f\x8b")
+        for cache_dir in (None, self._tmp_dir):
+            gz_doc = pdoc.Document.create_from_txt(
+                gz_path, "word_type", "keep_eol_nl", cache_dir=cache_dir)
+            self.assertEqual(list(gz_doc), list(doc))
+            self.assertEqual([token for chunk in gz_doc.iter_chunks(100) for token in chunk],
+                             list(doc))
+
+    def test_id_doc_by_line(self):
+        tokens = [5, 17, 3, "\n", 42, 0, 7, 9, 11]
+        doc = pdoc.Document.create_from_tokens(tokens, "id_type", flag_tokens=["\n"])
+        for f_name in ("ids.txt", "ids.txt.gz"):
+            txt_path = os.path.join(self._tmp_dir, f_name)
+            doc.save_as_txt(txt_path, num_tokens_per_line=4)
+            saved_doc = pdoc.Document.create_from_txt(txt_path, "id_type", "ignore_eol")
+            # the txt readers yield ids as str
+            self.assertEqual(list(saved_doc), [str(pvocab.EOS_ID if token == "\n" else token)
+                                               for token in tokens])
+
+    def test_background_writer(self):
+        lines = ["%d %s\n" % (i, "a" * (i % 50)) for i in range(20000)]
+        path = os.path.join(self._tmp_dir, "lines.txt")
+        with pfile.BackgroundCompressedWriter(path, "gzip", buffer_size=1000) as f:
+            for line in lines:
+                f.write(line)
+        with gzip.open(path, "rt") as f:
+            self.assertEqual(f.read(), "".join(lines))
+        with pfile.open_read(path) as f:
+            self.assertEqual(list(f), lines)
+
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_packed_lang_model(self):
+        docs = [pdoc.Document.create_from_tokens(list(range(i, i + 50)), "id_type")
+                for i in range(5)]
+        state = DocTransformState(docs, PackedLangModelTransformer(8), None)
+        save_dir = os.path.join(self._tmp_dir, "lm")
+        schema = pcolumnar.docs_transformed_save(state, save_dir)
+        examples = list(state.transformer.transform_docs(*docs))
+        dataset = pdcolumnar.ColumnarDataset(save_dir)
+        self.assertEqual(len(dataset), len(examples))
+        self.assertEqual(schema["num_examples"], len(examples))
+        self.assertEqual(dataset.names, ["input", "target"])
+        self.assertEqual([list_stat.to_dict() for list_stat in dataset.lists_stats],
+                         [list_stat.to_dict() for list_stat in state.transformer.get_lists_stats(*docs)])
+        for (inputs, targets), (inputs_, targets_) in zip(examples, dataset):
+            self.assertEqual(inputs.tolist(), inputs_.tolist())
+            self.assertEqual(targets.tolist(), targets_.tolist())
+        self.assertIsInstance(dataset[3][0].base, np.memmap)
+        (inputs, input_offsets), _ = dataset.get_batch(2, 5)
+        self.assertEqual(input_offsets.tolist(), [0, 8, 16, 24])
+        self.assertEqual(inputs.tolist(), np.concatenate([examples[i][0] for i in (2, 3, 4)]).tolist())
+        shuffled = list(dataset.iter_examples(shuffle=True, seed=0))
+        self.assertEqual(sorted(inputs.tolist() for inputs, _ in shuffled),
+                         sorted(inputs.tolist() for inputs, _ in examples))
+
+    def test_column_types(self):
+        lists_stats = (
+            ListStat("words", "word_type", 3, is_seq=True),
+            ListStat("label", "word_type", 1),
+            ListStat("contexts", "list_type", 2, is_seq=True,
+                     sub_list_stat=ListStat("context", "id_type", 3, is_seq=True)),
+            ListStat("len", "value_int_type", 1),
+            ListStat("scores", "value_float_type", 2)
+        )
+        examples = [(["a", "bé", "c"][:i % 4], "l%d" % i, [[i, 2, 3]] * (i % 3), i, [0.5, i])
+                    for i in range(10)]
+        save_dir = os.path.join(self._tmp_dir, "columns")
+        pcolumnar._transformed_save(iter(examples), lists_stats, save_dir, 8)
+        dataset = pdcolumnar.ColumnarDataset(save_dir)
+        self.assertEqual(len(dataset), 8)
+        for example, (words, label, contexts, len_, scores) in zip(examples, dataset):
+            self.assertEqual((words, label, contexts.tolist(), int(len_), scores.tolist()),
+                             example)
+        words, labels, (contexts, context_offsets), lens, scores = dataset.get_batch(4, 7)
+        self.assertEqual((words[0], words[1].tolist()), (["a", "a", "bé"], [0, 0, 1, 3]))
+        self.assertEqual(labels, ["l4", "l5", "l6"])
+        self.assertEqual(context_offsets.tolist(), [0, 1, 3, 3])
+        self.assertEqual(contexts.shape, (3, 3))
+        self.assertEqual(lens.tolist(), [4, 5, 6])
+
+
+class TestTFRecords(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_crc32c(self):
+        self.assertEqual(ptfrecord_writer._crc32c(b"123456789"), 0xe3069283)
+        self.assertEqual(ptfrecord_writer.crc32c(b"123456789"), 0xe3069283)
+        datas = [bytes(range(i % 256)) * (i // 256 + 1)
+                 for i in (0, 3, 4, 5, 63, 64, 65, 129, 300, 700)] + [b"123456789" * 2000]
+        for chunk_size in (8, 64):
+            self.assertEqual(ptfrecord_writer.crc32cs(datas, chunk_size),
+                             [ptfrecord_writer._crc32c(data) for data in datas])
+
+    def test_packed_lang_model(self):
+        docs = [pdoc.Document.create_from_tokens(list(range(1, 12)), "id_type")]
+        state = DocTransformState(docs, PackedLangModelTransformer(2), None)
+        for ext, compression_type in ((".tfrecords", ""), (".gz", "GZIP"), (".zlib", "ZLIB")):
+            save_path = os.path.join(self._tmp_dir, "lm" + ext)
+            ptfrecords.docs_transformed_save(state, save_path)
+            records = list(ptfrecord_writer.iter_records(save_path, compression_type))
+            self.assertEqual(len(records), 5)
+            # empty context, then the input [1, 2] and target [2, 3] int64 feature lists
+            self.assertEqual(records[0],
+                             b"\n\x00\x123"
+                             b"\n\x17\n\x05input\x12\x0e\n\x05\x1a\x03\n\x01\x01\n\x05\x1a\x03\n\x01\x02"
+                             b"\n\x18\n\x06target\x12\x0e\n\x05\x1a\x03\n\x01\x02\n\x05\x1a\x03\n\x01\x03")
+
+    def _save_sharded(self, docs, size, compression_type, ext):
+        state = DocTransformState(docs, Word2vecTransformer(1), size)
+        save_path = os.path.join(self._tmp_dir, "single" + ext)
+        ptfrecords.docs_transformed_save(state, save_path, compression_type)
+        single_records = list(ptfrecord_writer.iter_records(save_path, compression_type))
+        save_prefix = os.path.join(self._tmp_dir, "sharded%s%s" % (size, compression_type))
+        manifest = ptfrecords.docs_transformed_save_sharded(
+            state, save_prefix, num_workers=3, max_shard_records=25,
+            compression_type=compression_type)
+        self.assertEqual(ptfrecords.read_manifest(ptfrecords.get_manifest_path(save_prefix)),
+                         dict(manifest, shards=[
+                             dict(shard, path=os.path.join(self._tmp_dir, shard["path"]))
+                             for shard in manifest["shards"]]))
+        records = []
+        for i, shard in enumerate(manifest["shards"]):
+            self.assertEqual(shard["path"], "%s-%05d-of-%05d" % (
+                os.path.basename(save_prefix), i, len(manifest["shards"])))
+            shard_path = os.path.join(self._tmp_dir, shard["path"])
+            shard_records = list(ptfrecord_writer.iter_records(shard_path, compression_type))
+            self.assertLessEqual(len(shard_records), 25)
+            self.assertEqual(len(shard_records), shard["num_records"])
+            self.assertEqual(os.path.getsize(shard_path), shard["num_bytes"])
+            records.extend(shard_records)
+        self.assertEqual(records, single_records)
+        self.assertEqual(manifest["num_records"], len(records))
+        self.assertEqual(manifest["compression_type"], compression_type)
+        self.assertEqual([list_stat["name"] for list_stat in manifest["lists_stats"]],
+                         ["center", "context"])
+        self.assertFalse([f_name for f_name in os.listdir(self._tmp_dir)
+                          if "temp" in f_name or "trim" in f_name])
+        return manifest
+
+    def test_sharded(self):
+        docs = [pdoc.Document.create_from_tokens(list(range(100 * i, 100 * i + doc_len)),
+                                                 "id_type")
+                for i, doc_len in enumerate((6, 6, 60, 60, 60, 60))]
+        manifest = self._save_sharded(docs, None, "", ".tfrecords")
+        self.assertEqual([shard["num_records"] for shard in manifest["shards"]],
+                         [18] + [25] * 9 + [11] + [25] * 9 + [11])
+        # the first part runs short of size
+        self.assertEqual(self._save_sharded(docs, 30, "", ".tfrecords")["num_records"], 30)
+        # the shard crossing size is rewritten
+        manifest = self._save_sharded(docs, 70, "GZIP", ".gz")
+        self.assertEqual([shard["num_records"] for shard in manifest["shards"]],
+                         [18, 25, 25, 2])
+
+    def test_varints(self):
+        values = [0, 1, 127, 128, 300, 2 ** 62, -1, -2 ** 63]
+        self.assertEqual(ptfrecords._varints(values),
+                         b"".join(ptfrecords._varint(value) for value in values))
+        self.assertEqual(ptfrecords._varint(300), b"\xac\x02")
+        self.assertEqual(ptfrecords._varint(-1), b"\xff" * 9 + b"\x01")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import itertools
+import collections
+import numpy as np
+import plp.doc as pdoc
+import plp.vocab as pvocab
+import plp.serializers.vocab_bin as pvocab_bin
+import unittest
+
+BABI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "babi_sample", "qa1_single-supporting-fact_test.txt")
+
+
+class TestVocab(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._vocab_path = os.path.join(self._tmp_dir, "vocab.txt")
+        self._count_path = os.path.join(self._tmp_dir, "count.txt")
+        doc = pdoc.Document.create_from_txt(BABI_PATH, "word_type", "ignore_eol")
+        self._vocab = pvocab.create_vocab_from_docs(
+            [doc], 15, self._vocab_path, self._count_path)
+        self._embed_path = os.path.join(self._tmp_dir, "embed.npy")
+        np.save(self._embed_path,
+                np.random.RandomState(0).rand(len(self._vocab), 4).astype(np.float32))
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_batch_lookups(self):
+        words = ["Mary", "John", "not_a_word", pvocab.EOS, "went"]
+        ids = self._vocab.words2ids(words)
+        self.assertEqual(ids.dtype, np.int32)
+        self.assertEqual(ids.tolist(), [self._vocab.word2id(word) for word in words])
+        ids = [0, 5, len(self._vocab) + 3]
+        self.assertEqual(self._vocab.ids2words(ids), [self._vocab.id2word(i) for i in ids])
+
+        embed = pvocab.Embed(self._vocab_path, self._embed_path, self._count_path)
+        embeds = embed.ids2embeds(ids)
+        self.assertEqual(embeds.shape, (3, 4))
+        for row, id_token in zip(embeds, ids):
+            np.testing.assert_array_equal(row, embed.id2embed_lookup(id_token))
+
+    def test_chunked_word2id(self):
+        for gen_eol_type in ("ignore_eol", "keep_eol_nl"):
+            doc = pdoc.Document.create_from_txt(
+                BABI_PATH, "word_type", gen_eol_type, self._vocab)
+            doc.toggle_word_id()
+            chunked = list(itertools.chain.from_iterable(doc.iter_chunks(64)))
+            self.assertEqual(chunked, list(doc))
+            doc.toggle_word_id()
+            chunked = list(itertools.chain.from_iterable(doc.iter_chunks(64)))
+            self.assertEqual(chunked, list(doc))
+
+    def test_mmap_quantized_embed(self):
+        embed = pvocab.Embed(self._vocab_path, self._embed_path, self._count_path)
+        ids = [0, 3, 7, len(self._vocab) + 1]
+        expected = embed.ids2embeds(ids)
+        mmap_embed = pvocab.Embed(
+            self._vocab_path, self._embed_path, self._count_path, mmap=True)
+        np.testing.assert_array_equal(mmap_embed.ids2embeds(ids), expected)
+        for storage_type, atol in (("float16", 1e-3), ("int8", 1.0 / 127)):
+            out_path = os.path.join(self._tmp_dir, "embed_%s.npy" % storage_type)
+            pvocab.quantize_embed(self._embed_path, out_path, storage_type, block_size=4)
+            q_embed = pvocab.Embed(self._vocab_path, out_path, mmap=True)
+            self.assertEqual(q_embed.storage_type, storage_type)
+            embeds = q_embed.ids2embeds(ids)
+            self.assertEqual(embeds.dtype, np.float32)
+            np.testing.assert_allclose(embeds, expected, atol=atol)
+            np.testing.assert_array_equal(q_embed.id2embed_lookup(7), embeds[2])
+
+    def test_float64_embed(self):
+        table = np.load(self._embed_path).astype(np.float64)
+        embed_path = os.path.join(self._tmp_dir, "embed_float64.npy")
+        np.save(embed_path, table)
+        embed = pvocab.Embed(self._vocab_path, embed_path)
+        self.assertEqual(embed.storage_type, "float64")
+        embeds = embed.ids2embeds([0, 3, 7])
+        self.assertEqual(embeds.dtype, np.float64)
+        np.testing.assert_array_equal(embeds, table[[0, 3, 7]])
+        np.testing.assert_array_equal(embed.word2embed_lookup(embed.id2word(3)), table[3])
+
+    def test_binary_vocab(self):
+        bin_path = os.path.join(self._tmp_dir, "vocab.bin")
+        pvocab_bin.compile_vocab(self._vocab_path, bin_path, self._count_path)
+        bin_vocab = pvocab.Vocab(bin_path)
+        self.assertEqual(len(bin_vocab), len(self._vocab))
+        self.assertEqual(pvocab.get_vocab_size(bin_path), len(self._vocab))
+        self.assertEqual(bin_vocab.vocab_counts_list, self._vocab.vocab_counts_list)
+        words = ["Mary", "not_a_word", pvocab.PAD, "went"] + \
+            [self._vocab.id2word(i) for i in range(len(self._vocab))]
+        for word in words:
+            self.assertEqual(bin_vocab.word2id(word), self._vocab.word2id(word))
+            self.assertEqual(bin_vocab.check_word_exist(word), self._vocab.check_word_exist(word))
+        self.assertEqual(bin_vocab.words2ids(words).tolist(), self._vocab.words2ids(words).tolist())
+        ids = list(range(len(self._vocab) + 2))
+        self.assertEqual(bin_vocab.ids2words(ids), self._vocab.ids2words(ids))
+
+        embed = pvocab.Embed(bin_path, self._embed_path)
+        np.testing.assert_array_equal(
+            embed.words2embeds(words),
+            pvocab.Embed(self._vocab_path, self._embed_path).words2embeds(words))
+
+    def test_parallel_and_spilled_counting(self):
+        with open(BABI_PATH) as f:
+            lines = f.readlines()
+        docs = []
+        for i in range(7):
+            txt_path = os.path.join(self._tmp_dir, "%d.txt" % i)
+            with open(txt_path, "w") as f:
+                f.writelines(lines[i * 9:(i + 1) * 9])
+            docs.append(pdoc.Document.create_from_txt(txt_path, "word_type", "yield_eol"))
+        out_paths = []
+        for num_workers, count_mode in ((1, "exact"), (3, "exact"), (1, "spill"), (3, "spill")):
+            name = "%s%d" % (count_mode, num_workers)
+            vocab_path = os.path.join(self._tmp_dir, name + "_vocab.txt")
+            count_path = os.path.join(self._tmp_dir, name + "_count.txt")
+            pvocab.create_vocab_from_docs(
+                docs, 25, vocab_path, count_path, num_workers=num_workers,
+                count_mode=count_mode, max_num_counters=5, spill_dir=self._tmp_dir)
+            out_paths.append((vocab_path, count_path))
+        for paths in out_paths[1:]:
+            for path, expected_path in zip(paths, out_paths[0]):
+                with open(path) as f, open(expected_path) as expected_f:
+                    self.assertEqual(f.read(), expected_f.read())
+        self.assertFalse([f_name for f_name in os.listdir(self._tmp_dir)
+                          if f_name.endswith(".vocab_run")])
+
+    def test_approx_counting(self):
+        doc = pdoc.Document.create_from_txt(BABI_PATH, "word_type", "yield_eol")
+        true_counts = collections.Counter(doc)
+        vocab_path = os.path.join(self._tmp_dir, "approx_vocab.txt")
+        count_path = os.path.join(self._tmp_dir, "approx_count.txt")
+        approx_vocab = pvocab.create_vocab_from_docs(
+            [doc], 12, vocab_path, count_path,
+            count_mode="approx", max_num_counters=16)
+        with open(count_path + ".error_bound") as f:
+            error_bound = int(f.read())
+        self.assertGreater(error_bound, 0)
+        for word_id in range(4, len(approx_vocab)):
+            count = approx_vocab.vocab_counts_list[word_id]
+            true_count = true_counts[approx_vocab.id2word(word_id)]
+            self.assertLessEqual(count, true_count)
+            self.assertLessEqual(true_count, count + error_bound)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,20 @@
+import io
 import os
+import gzip
+import zlib
+import queue
+import threading
+
+COMPRESSION_TYPES = ("gzip", "zstd")
+_COMPRESSION_EXTS = {".gz": "gzip", ".zst": "zstd"}
+_TFRECORDS_COMPRESSION_EXTS = {".gz": "GZIP", ".zlib": "ZLIB"}
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
 
 
 class MultiWriteOpen:
-    def __init__(self, *files):
-        self._files = [open(f, "w") for f in files]
+    def __init__(self, *files, compression=None):
+        self._files = [open_write(f, compression) for f in files]
 
     def __getitem__(self, key):
         return self._files[key]
@@ -58,6 +69,147 @@ class ReadReplaceOpen:
         os.rename(self._temp_name, self._f_name)
 
 
+class AtomicWriteOpen:
+    """
+    Like MultiWriteOpen, but the files are written as temp files and all
+    renamed over the target paths only when the block exits without error
+    """
+    def __init__(self, *files, compression=None):
+        self._f_names = files
+        self._temp_names = [extend_path_basename(f, "temp") for f in files]
+        self._files = [open_write(f, compression) for f in self._temp_names]
+
+    def __getitem__(self, key):
+        return self._files[key]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for f in self._files:
+            f.close()
+        for temp_name, f_name in zip(self._temp_names, self._f_names):
+            if exc_type is None:
+                os.replace(temp_name, f_name)
+            else:
+                os.remove(temp_name)
+
+
+def get_compression(path):
+    """
+    Compression type given by the path extension, None if uncompressed
+    """
+    return _COMPRESSION_EXTS.get(os.path.splitext(path)[1])
+
+
+def get_tfrecords_compression_type(path):
+    """
+    TFRecord compression type (GZIP, ZLIB or "") given by the path extension
+    """
+    return _TFRECORDS_COMPRESSION_EXTS.get(os.path.splitext(path)[1], "")
+
+
+def open_write(path, compression=None):
+    """
+    Text file to write, compressed on a background thread if compression
+    (gzip or zstd, default get_compression(path)) is set
+    """
+    if compression is None:
+        compression = get_compression(path)
+    if compression is None:
+        return open(path, "w")
+    return BackgroundCompressedWriter(path, compression)
+
+
+def open_read(path):
+    """
+    Text file to read, gzip and zstd files are detected by their magic
+    bytes and decompressed transparently
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(_ZSTD_MAGIC))
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.open(path, "rt")
+    if magic == _ZSTD_MAGIC:
+        import zstandard
+        return io.TextIOWrapper(
+            zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True),
+            encoding="utf-8")
+    return open(path)
+
+
+class BackgroundCompressedWriter:
+    """
+    Write-only text file, writes are buffered and handed to a thread that
+    encodes, compresses and writes them, zlib and zstd release the GIL so
+    the compression overlaps with the caller
+    """
+    def __init__(self, path, compression, buffer_size=1 << 20, max_pending=4):
+        if compression == "gzip":
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif compression == "zstd":
+            import zstandard
+            self._compressor = zstandard.ZstdCompressor().compressobj()
+        else:
+            raise ValueError("compression should be one of " + str(COMPRESSION_TYPES))
+        self._f = open(path, "wb")
+        self._buffer_size = buffer_size
+        self._buffer = []
+        self._buffer_len = 0
+        self._error = None
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._compress_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, entry):
+        self._buffer.append(entry)
+        self._buffer_len += len(entry)
+        if self._buffer_len >= self._buffer_size:
+            self._put_buffer()
+
+    def _put_buffer(self):
+        if self._error is not None:
+            raise self._error
+        if self._buffer:
+            self._queue.put("".join(self._buffer).encode("utf-8"))
+        self._buffer = []
+        self._buffer_len = 0
+
+    def _compress_loop(self):
+        data = None
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+                self._f.write(self._compressor.compress(data))
+            self._f.write(self._compressor.flush())
+        except Exception as e:
+            self._error = e
+            # unblock the writer until close
+            while data is not None:
+                data = self._queue.get()
+
+    def close(self):
+        if self._thread is None:
+            return
+        try:
+            self._put_buffer()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._f.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def extend_path_basename(data_path, extended_signature):
     """
     E.g. /data/hello/path_name.json 
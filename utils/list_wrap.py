@@ -25,7 +25,7 @@ def batch_pad_lookup_(batch_tokens, vocab, max_num_tokens=None):
          are np.ndarray objects
     """
     mask = batch_pad_(batch_tokens, vocab.pad_token, max_num_tokens)
-    batch_ids = [[vocab[x] for x in sub_tokens] for sub_tokens in batch_tokens]
+    batch_ids = [vocab.words2ids(sub_tokens).tolist() for sub_tokens in batch_tokens]
     return batch_ids, mask
 
 
@@ -29,14 +29,9 @@ def batch_pad_lookup_(batch_tokens, vocab, max_num_tokens=None):
     """
     # [m, s]
     mask = batch_pad_(batch_tokens, vocab.pad_token, max_num_tokens)
-    ids = []
-    for sub_tokens in batch_tokens:
-        ids.append([])
-        for x in sub_tokens:
-            x_id = vocab[x]
-            ids[-1].append(x_id)
-    # TODO CHECK np type
-    batch_ids = np.array(ids)
+    batch_ids = np.zeros(mask.shape, dtype=np.int64)
+    for sub_ids, sub_tokens in zip(batch_ids, batch_tokens):
+        sub_ids[:] = vocab.words2ids(sub_tokens)
     return batch_ids, mask
 
 
@@ -0,0 +1,46 @@
+import collections
+import multiprocessing
+
+_worker_f = None
+
+
+def _set_worker_f(f):
+    global _worker_f
+    _worker_f = f
+
+
+def _call_worker_f(item):
+    return _worker_f(item)
+
+
+def ordered_bounded_map(f, items, num_workers=None, max_in_flight=None):
+    """
+    map(f, items) over a fork based process pool.
+    Results are yielded in the order of items, with at most max_in_flight
+    items submitted but not yet yielded, so memory stays flat on long inputs.
+    f is inherited by the forked workers and doesn't need to be picklable
+    (closures, recorded doc pipelines...), items and results do.
+    """
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if num_workers <= 1:
+        for item in items:
+            yield f(item)
+        return
+    if max_in_flight is None:
+        max_in_flight = 4 * num_workers
+    ctx = multiprocessing.get_context("fork")
+    pool = ctx.Pool(num_workers, initializer=_set_worker_f, initargs=(f,))
+    try:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.apply_async(_call_worker_f, (item,)))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
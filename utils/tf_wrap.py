@@ -1,5 +1,6 @@
 import tensorflow as tf
 import plp.vocab as pvocab
+import plp.serializers.vocab_bin as pvocab_bin
 from tensorflow.python.ops import lookup_ops
 
 class VocabReader(object):
@@ -9,12 +10,21 @@ class VocabReader(object):
         self._vocab_size = None
         self._vocab_counts = None
         with tf.variable_scope("vocab_lookup"):
-            self._id2word_table = lookup_ops.index_to_string_table_from_file(
-                self._vocab_f_path, default_value=pvocab.UNK, name="id2word"
-            )
-            self._word2id_table = lookup_ops.index_table_from_file(
-                self._vocab_f_path, default_value=pvocab.UNK_ID, name="word2id"
-            )
+            if pvocab_bin.is_binary_vocab(self._vocab_f_path):
+                words = list(pvocab_bin.BinaryVocab(self._vocab_f_path).words)
+                self._id2word_table = lookup_ops.index_to_string_table_from_tensor(
+                    words, default_value=pvocab.UNK, name="id2word"
+                )
+                self._word2id_table = lookup_ops.index_table_from_tensor(
+                    words, default_value=pvocab.UNK_ID, name="word2id"
+                )
+            else:
+                self._id2word_table = lookup_ops.index_to_string_table_from_file(
+                    self._vocab_f_path, default_value=pvocab.UNK, name="id2word"
+                )
+                self._word2id_table = lookup_ops.index_table_from_file(
+                    self._vocab_f_path, default_value=pvocab.UNK_ID, name="word2id"
+                )
 
     def id2word(self, id_token):
         return self._id2word_table.lookup(tf.to_int64(id_token))
@@ -25,8 +35,7 @@ class VocabReader(object):
     @property
     def vocab_size(self):
         if not self._vocab_size:
-            with open(self._vocab_f_path) as f:
-                self._vocab_size = len(f.read().strip().split())
+            self._vocab_size = pvocab.get_vocab_size(self._vocab_f_path)
         return self._vocab_size
 
     @property
@@ -35,5 +44,7 @@ class VocabReader(object):
             with open(self._count_f_path) as count_f:
                 counts = count_f.read().strip().split()
                 self._vocab_counts = [int(count) for count in counts]
+        elif not self._vocab_counts and pvocab_bin.is_binary_vocab(self._vocab_f_path):
+            self._vocab_counts = pvocab_bin.BinaryVocab(self._vocab_f_path).counts
         return self._vocab_counts
 
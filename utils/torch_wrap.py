@@ -1,3 +1,4 @@
+import numpy as np
 import torch
 import ipdb
 
@@ -24,10 +25,10 @@ def batch_pad_lookup_(batch_tokens, vocab, device, max_num_tokens=None):
          are torch.tensor objects
     """
     mask = batch_pad_(batch_tokens, vocab.pad_token, device, max_num_tokens)
-    batch_ids = torch.tensor(
-            [[vocab[x] for x in sub_tokens] for sub_tokens in batch_tokens],
-            device=device
-            )
+    batch_ids = np.zeros(tuple(mask.shape), dtype=np.int64)
+    for sub_ids, sub_tokens in zip(batch_ids, batch_tokens):
+        sub_ids[:] = vocab.words2ids(sub_tokens)
+    batch_ids = torch.from_numpy(batch_ids).to(device)
     return batch_ids, mask
 
 
@@ -1,5 +1,14 @@
+import os
+import json
+import heapq
+import shutil
+import tempfile
+import collections
+import itertools
 import numpy as np
 import plp.token as ptoken
+import plp.serializers.vocab_bin as pvocab_bin
+import plp.utils.parallel as pparallel
 import ipdb
 import string
 UNK = "<unk>"
@@ -14,36 +23,214 @@ EOS_ID = 3
 
 def create_vocab_from_docs(docs, max_vocab_size, out_vocab_f_path,
                            out_count_f_path=None,
-                           prepend_special_tokens=(UNK, SOS, EOS, PAD)):
+                           prepend_special_tokens=(UNK, SOS, EOS, PAD),
+                           num_workers=1, count_mode="exact", max_num_counters=None,
+                           spill_dir=None):
+    """
+    num_workers > 1: docs are split in contiguous shards counted by forked
+    workers, the shard Counters are merged in doc order so the vocab and
+    count files are byte-identical to the serial ones (in exact and spill
+    count_mode). In spill count_mode each worker spills its own runs, so
+    up to num_workers + 1 times max_num_counters words are held
+    count_mode, max_num_counters, spill_dir: see VocabCreator
+    """
     assert docs[0].token_type == "word_type"
     with VocabCreator(
             max_vocab_size, out_vocab_f_path, out_count_f_path,
-            prepend_special_tokens) as vocab_creator:
-        for doc in docs:
-            for token in doc:
-                if token not in doc.applied_flag_tokens:
-                    vocab_creator.update_vocab_from_word(token)
+            prepend_special_tokens, count_mode, max_num_counters,
+            spill_dir) as vocab_creator:
+        if num_workers > 1:
+            num_shards = min(len(docs), 4 * num_workers)
+            shard_bounds = [len(docs) * i // num_shards for i in range(num_shards + 1)]
+            shards = zip(shard_bounds[:-1], shard_bounds[1:])
+
+            run_dir = vocab_creator.get_run_dir() if count_mode == "spill" else None
+
+            def count_shard(bounds):
+                counter = collections.Counter()
+                error_bound = 0
+                runs = []
+                for doc in docs[bounds[0]:bounds[1]]:
+                    for words in _iter_doc_words(doc):
+                        counter.update(words)
+                        if count_mode == "approx" and len(counter) > max_num_counters:
+                            error_bound += misra_gries_compact(counter, max_num_counters // 2)
+                        elif count_mode == "spill" and len(counter) >= max_num_counters:
+                            for special_token in prepend_special_tokens:
+                                counter.pop(special_token, None)
+                            runs.append((write_run(counter, run_dir), len(counter)))
+                            counter = collections.Counter()
+                return counter, error_bound, runs
+            for counter, error_bound, runs in pparallel.ordered_bounded_map(
+                    count_shard, shards, num_workers=num_workers):
+                vocab_creator.add_runs(runs)
+                vocab_creator.update_vocab_from_counter(counter, error_bound)
+        else:
+            for doc in docs:
+                for words in _iter_doc_words(doc):
+                    vocab_creator.update_vocab_from_words(words)
     return Vocab(out_vocab_f_path, out_count_f_path)
-    
+
+
+def _iter_doc_words(doc):
+    flag_tokens = doc.applied_flag_tokens
+    for chunk in doc.iter_chunks():
+        if flag_tokens:
+            chunk = [token for token in chunk if token not in flag_tokens]
+        yield chunk
+
+
+def misra_gries_compact(counter, num_kept):
+    """
+    Batched Misra-Gries decrement, in-place: subtracts the (num_kept+1)th
+    largest count from every count and drops the ones reaching 0, leaving at
+    most num_kept words.
+    Returns the decrement, each remaining count underestimates its true count
+    by at most the sum of the decrements.
+    """
+    if len(counter) <= num_kept:
+        return 0
+    counts = np.fromiter(counter.values(), dtype=np.int64, count=len(counter))
+    decrement = int(np.partition(counts, len(counts) - num_kept - 1)[len(counts) - num_kept - 1])
+    dropped = []
+    for word, count in counter.items():
+        if count <= decrement:
+            dropped.append(word)
+        else:
+            counter[word] = count - decrement
+    for word in dropped:
+        del counter[word]
+    return decrement
+
 
 class VocabCreator:
+    """
+    count_mode: "exact", or "approx" to count in bounded memory, keeping at
+    most max_num_counters distinct words (checked after each update) with
+    Misra-Gries. Written counts are then lower bounds, off by at most
+    error_bound, which is also written next to the count file
+    (<out_count_f_path>.error_bound).
+    "spill" keeps exact counts but once max_num_counters distinct words are
+    held, writes them as a word sorted run in spill_dir (default: a temp dir)
+    and starts over; runs are k-way merged at exit. Files are the same as
+    with "exact".
+    """
     def __init__(self, max_vocab_size, out_vocab_f_path, out_count_f_path=None, 
-                 prepend_special_tokens=(UNK, SOS, EOS, PAD)):
+                 prepend_special_tokens=(UNK, SOS, EOS, PAD),
+                 count_mode="exact", max_num_counters=None, spill_dir=None):
+        if count_mode not in ("exact", "approx", "spill"):
+            raise ValueError("count_mode %s not supported" % count_mode)
+        if count_mode == "approx" and (max_num_counters is None or max_num_counters <
+                                       2 * (max_vocab_size - len(prepend_special_tokens))):
+            raise ValueError("approx count_mode needs max_num_counters >= 2 * max_vocab_size")
+        if count_mode == "spill" and not max_num_counters:
+            raise ValueError("spill count_mode needs max_num_counters")
         self._opened_vocab_file = open(out_vocab_f_path, "w")
-        self._vocab = {}
+        self._vocab = collections.Counter()
         self._max_vocab_size = max_vocab_size
+        self._out_count_f_path = out_count_f_path
         if out_count_f_path:
             self._opened_count_file = open(out_count_f_path, "w")
         else:
             self._opened_count_file = None
         self._special_tokens = prepend_special_tokens
+        self._count_mode = count_mode
+        self._max_num_counters = max_num_counters
+        self._error_bound = 0
+        self._spill_dir = spill_dir
+        self._temp_spill_dir = None
+        # (run path, first position offset) of the spilled runs
+        self._runs = []
+        self._num_spilled_words = 0
 
     def __enter__(self):
         return self
 
+    @property
+    def error_bound(self):
+        return self._error_bound
+
     def update_vocab_from_word(self, word):
         if not (word in self._special_tokens):
             self._vocab[word] = self._vocab[word]+1 if word in self._vocab else 1
+            self._bound_memory()
+
+    def update_vocab_from_words(self, words):
+        """
+        Chunked update, same counts as update_vocab_from_word on each word
+        """
+        self._vocab.update(words)
+        self._remove_special_tokens()
+        self._bound_memory()
+
+    def update_vocab_from_counter(self, counter, error_bound=0):
+        """
+        Merges counts of words seen after the ones already counted
+        error_bound: of counter, if approximate
+        """
+        self._vocab.update(counter)
+        self._error_bound += error_bound
+        self._remove_special_tokens()
+        self._bound_memory()
+
+    def _remove_special_tokens(self):
+        for special_token in self._special_tokens:
+            if special_token in self._vocab:
+                del self._vocab[special_token]
+
+    def _bound_memory(self):
+        if self._count_mode == "approx" and len(self._vocab) > self._max_num_counters:
+            self._error_bound += misra_gries_compact(self._vocab, self._max_num_counters // 2)
+        elif self._count_mode == "spill" and len(self._vocab) >= self._max_num_counters:
+            self._spill()
+
+    def get_run_dir(self):
+        if self._spill_dir is not None:
+            return self._spill_dir
+        self._temp_spill_dir = self._temp_spill_dir or tempfile.mkdtemp()
+        return self._temp_spill_dir
+
+    def add_runs(self, runs):
+        """
+        Merges runs of words seen after the ones already counted, as written
+        by write_run
+        runs: [(run path, number of words)]
+        """
+        if runs and self._vocab:
+            self._spill()
+        for run_path, num_words in runs:
+            self._append_run(run_path, num_words)
+
+    def _append_run(self, run_path, num_words):
+        # first positions continue across runs, so ties are broken as in memory
+        self._runs.append((run_path, self._num_spilled_words))
+        self._num_spilled_words += num_words
+
+    def _spill(self):
+        self._append_run(write_run(self._vocab, self.get_run_dir()), len(self._vocab))
+        self._vocab = collections.Counter()
+
+    def _iter_merged_runs(self):
+        """
+        (first position, (word, count)) of every word, summed over runs
+        """
+        runs = [_iter_run(run_path, offset) for run_path, offset in self._runs]
+        for word, records in itertools.groupby(
+                heapq.merge(*runs), key=lambda record: record[0]):
+            count = 0
+            first_pos = None
+            for _, run_count, pos in records:
+                count += run_count
+                first_pos = pos if first_pos is None else min(first_pos, pos)
+            yield first_pos, (word, count)
+
+    def _remove_runs(self):
+        for run_path, _ in self._runs:
+            os.remove(run_path)
+        self._runs = []
+        if self._temp_spill_dir is not None:
+            shutil.rmtree(self._temp_spill_dir, ignore_errors=True)
+            self._temp_spill_dir = None
 
     def update_vocab_from_sentence(self, sentence):
         for word in sentence.split():
@@ -52,12 +239,18 @@ class VocabCreator:
     def __exit__(self, exc_type, exc_val, exc_tb):
         for special_token in self._special_tokens:
             self._opened_vocab_file.write(special_token + "\n")
-            self._opened_count_file.write("0\n")
-
-        actual_vocab_len = self._max_vocab_size-len(self._special_tokens)
-        for word, count in sorted(self._vocab.items(),
-                                  key=lambda x: x[1],
-                                  reverse=True)[:actual_vocab_len]:
+            if self._opened_count_file is not None:
+                self._opened_count_file.write("0\n")
+
+        actual_vocab_len = max(self._max_vocab_size-len(self._special_tokens), 0)
+        if self._runs:
+            if self._vocab:
+                self._spill()
+            top_words = _top_k_words(self._iter_merged_runs(), actual_vocab_len)
+            self._remove_runs()
+        else:
+            top_words = top_counted_words(self._vocab, actual_vocab_len)
+        for word, count in top_words:
             self._opened_vocab_file.write(word + "\n")
             if self._opened_count_file is not None:
                 self._opened_count_file.write(str(count) + "\n")
@@ -65,10 +258,70 @@ class VocabCreator:
         self._opened_vocab_file.close()
         if self._opened_count_file:
             self._opened_count_file.close()
+            if self._count_mode == "approx":
+                with open(self._out_count_f_path + ".error_bound", "w") as f:
+                    f.write(str(self._error_bound) + "\n")
+
+
+def top_counted_words(counter, k):
+    """
+    The k most counted (word, count), ties broken by first occurrence.
+    Same as a stable sort by count, but partial: O(n log k)
+    """
+    return _top_k_words(enumerate(counter.items()), k)
+
+
+def _top_k_words(pos_word_counts, k):
+    top = heapq.nsmallest(k, pos_word_counts, key=lambda x: (-x[1][1], x[0]))
+    return [word_count for _, word_count in top]
+
+
+def write_run(counter, run_dir):
+    """
+    Writes the counts as a run of (word, count, first position) sorted by
+    word, in a new file in run_dir. Returns its path
+    """
+    fd, run_path = tempfile.mkstemp(suffix=".vocab_run", dir=run_dir)
+    run = sorted((word, count, i) for i, (word, count) in enumerate(counter.items()))
+    with os.fdopen(fd, "w") as f:
+        for record in run:
+            f.write(json.dumps(record) + "\n")
+    return run_path
+
+
+def _iter_run(run_path, offset):
+    with open(run_path) as f:
+        for line in f:
+            word, count, pos = json.loads(line)
+            yield word, count, offset + pos
+
+
+def get_vocab_size(vocab_f_path):
+    """
+    Works on both txt and binary (pvocab_bin.compile_vocab) vocab files
+    """
+    if pvocab_bin.is_binary_vocab(vocab_f_path):
+        return len(pvocab_bin.BinaryVocab(vocab_f_path))
+    with open(vocab_f_path) as f:
+        return len(f.read().strip().split())
 
 
 class Vocab:
+    """
+    vocab_f_path: txt vocab, one word per line, or a binary vocab compiled
+    with pvocab_bin.compile_vocab which is memory-mapped instead of parsed
+    """
     def __init__(self, vocab_f_path, count_f_path=None):
+        if pvocab_bin.is_binary_vocab(vocab_f_path):
+            bin_vocab = pvocab_bin.BinaryVocab(vocab_f_path)
+            self._vocab_size = len(bin_vocab)
+            self._id2word_table = bin_vocab.words
+            self._word2id_table = bin_vocab.word_ids
+            self._vocab_counts = None
+            if count_f_path is not None:
+                self._vocab_counts = _read_counts(count_f_path)
+            self._bin_vocab = bin_vocab
+            return
         with open(vocab_f_path) as f:
             words = f.read().strip().split()
             ids = range(len(words))
@@ -77,9 +330,7 @@ class Vocab:
             self._word2id_table = dict(zip(words, ids))
             self._vocab_counts = None
             if count_f_path is not None:
-                with open(count_f_path) as count_f:
-                    counts = count_f.read().strip().split()
-                    self._vocab_counts = [int(count) for count in counts]
+                self._vocab_counts = _read_counts(count_f_path)
 
     def __getitem__(self, word_token):
         return self._word2id_table.get(word_token, UNK_ID)
@@ -92,6 +343,36 @@ class Vocab:
     def word2id(self, word_token):
         return self._word2id_table.get(word_token, UNK_ID)
 
+    def words2ids(self, word_tokens):
+        """
+        Batch word2id, returns np.int32 array, UNK_ID for unknown words
+        """
+        ids_iter = map(self._word2id_table.get, word_tokens, itertools.repeat(UNK_ID))
+        return np.fromiter(ids_iter, dtype=np.int32, count=len(word_tokens))
+
+    def ids2words(self, id_tokens):
+        """
+        Batch id2word, returns list of words, UNK for ids out of vocab
+        """
+        id_tokens = np.asarray(id_tokens)
+        is_unk = id_tokens >= self.vocab_size
+        if not isinstance(self._id2word_table, list):
+            # binary vocab, decoded per id instead of materializing every word
+            id2word_table = self._id2word_table
+            return [UNK if unk else id2word_table[id_token]
+                    for id_token, unk in zip(id_tokens.tolist(), is_unk.tolist())]
+        if is_unk.any():
+            id_tokens = np.where(is_unk, UNK_ID, id_tokens)
+            words = self._get_id2word_array()[id_tokens]
+            words[is_unk] = UNK
+            return words.tolist()
+        return self._get_id2word_array()[id_tokens].tolist()
+
+    def _get_id2word_array(self):
+        if getattr(self, "_id2word_array", None) is None:
+            self._id2word_array = np.array(self._id2word_table, dtype=object)
+        return self._id2word_array
+
     def check_word_exist(self, word_token):
         return word_token in self._word2id_table
 
@@ -107,6 +388,9 @@ class Vocab:
 
     @property
     def vocab_counts_list(self):
+        if self._vocab_counts is None and getattr(self, "_bin_vocab", None) is not None:
+            # binary vocab counts are only converted to a list when asked for
+            self._vocab_counts = self._bin_vocab.counts
         return self._vocab_counts
 
     @property
@@ -122,6 +406,11 @@ class Vocab:
         return UNK_ID
 
 
+def _read_counts(count_f_path):
+    with open(count_f_path) as count_f:
+        return [int(count) for count in count_f.read().strip().split()]
+
+
 class LazyVocab(Vocab):
     def __init__(self, vocab_name, max_size, allow_unk, *preallocated):
         assert max_size >= 2
@@ -177,6 +466,9 @@ class LazyVocab(Vocab):
         else:
             return token
 
+    def words2ids(self, tokens):
+        return np.array([self[token] for token in tokens], dtype=np.int32)
+
     def rev_lookups(self, token_ids):
         rev_dict = {w_id: w for w, w_id in self._vocab.items()}
         return [rev_dict[token_id] for token_id in token_ids]
@@ -220,22 +512,98 @@ def create_lazy_char_vocab(extra_size=0):
     return LazyVocab(max_size, *preallocated)
 
 
+EMBED_STORAGE_TYPES = ("float32", "float16", "int8")
+
+
+def get_embed_scale_path(embed_f_path):
+    """
+    Per-row scale sidecar of an int8 embed file
+    """
+    return os.path.splitext(embed_f_path)[0] + ".scale.npy"
+
+
+def quantize_embed(embed_f_path, out_embed_f_path, storage_type, block_size=65536):
+    """
+    Converts a float embed .npy file to storage_type.
+    int8 stores round(row / scale) with scale = max(abs(row)) / 127 per row,
+    scales are written to get_embed_scale_path(out_embed_f_path).
+    The source is read through mmap block by block, so tables larger than
+    RAM can be converted.
+    """
+    assert storage_type in EMBED_STORAGE_TYPES
+    table = np.load(embed_f_path, mmap_mode="r")
+    out_table = np.lib.format.open_memmap(
+        out_embed_f_path, mode="w+", dtype=np.dtype(storage_type), shape=table.shape)
+    scales = np.empty(table.shape[0], dtype=np.float32) if storage_type == "int8" else None
+    for start in range(0, table.shape[0], block_size):
+        block = np.asarray(table[start:start+block_size], dtype=np.float32)
+        if storage_type == "int8":
+            block_scales = np.abs(block).max(axis=1) / 127.0
+            block_scales[block_scales == 0] = 1.0
+            out_table[start:start+block_size] = np.rint(block / block_scales[:, None])
+            scales[start:start+block_size] = block_scales
+        else:
+            out_table[start:start+block_size] = block
+    out_table.flush()
+    del out_table
+    if scales is not None:
+        np.save(get_embed_scale_path(out_embed_f_path), scales)
+
+
 class Embed(Vocab):
-    def __init__(self, vocab_f_path, embed_f_path, count_f_path=None):
+    """
+    Storage type (float32, float16 or int8) follows the dtype of the embed file,
+    float16 and int8 lookups return float32, dequantized on gather. Other
+    float tables (float64) are full precision and returned as stored.
+    mmap: maps the embed file read only instead of loading it, the pages are
+    shared by every process reading the same file.
+    """
+    def __init__(self, vocab_f_path, embed_f_path, count_f_path=None, mmap=False):
         super(Embed, self).__init__(vocab_f_path, count_f_path)
-        self._id2embed_table = np.load(embed_f_path)
+        mmap_mode = "r" if mmap else None
+        self._id2embed_table = np.load(embed_f_path, mmap_mode=mmap_mode)
         assert self._id2embed_table.shape[0] == self.vocab_size
+        self._storage_type = self._id2embed_table.dtype.name
+        if self._storage_type not in EMBED_STORAGE_TYPES and \
+                self._id2embed_table.dtype.kind != "f":
+            raise ValueError("Embed storage type %s not supported" % self._storage_type)
+        self._scales = None
+        if self._storage_type == "int8":
+            self._scales = np.load(get_embed_scale_path(embed_f_path), mmap_mode=mmap_mode)
+            assert self._scales.shape[0] == self.vocab_size
+
+    def _dequantize(self, rows, id_tokens):
+        if self._storage_type not in ("float16", "int8"):
+            return rows
+        rows = rows.astype(np.float32)
+        if self._scales is not None:
+            rows *= self._scales[id_tokens][..., None]
+        return rows
 
     def id2embed_lookup(self, id_token):
         if id_token >= self.vocab_size:
-            return self._id2embed_table[UNK]
-        return self._id2embed_table[id_token]
+            id_token = UNK_ID
+        return self._dequantize(self._id2embed_table[id_token], id_token)
 
     def word2embed_lookup(self, word_token):
         id_token = self._word2id_table.get(word_token, UNK_ID)
-        return self.id2embed_lookup[id_token]
+        return self.id2embed_lookup(id_token)
+
+    def ids2embeds(self, id_tokens):
+        """
+        Batch id2embed_lookup, gathers a (n, embed_size) array
+        """
+        id_tokens = np.asarray(id_tokens)
+        id_tokens = np.where(id_tokens >= self.vocab_size, UNK_ID, id_tokens)
+        return self._dequantize(self._id2embed_table[id_tokens], id_tokens)
+
+    def words2embeds(self, word_tokens):
+        return self.ids2embeds(self.words2ids(word_tokens))
 
     @property
     def embed_size(self):
         return self._id2embed_table.shape[1]
 
+    @property
+    def storage_type(self):
+        return self._storage_type